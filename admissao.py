@@ -0,0 +1,224 @@
+"""Controle de admissão das rotas que usam o banco.
+
+Cada rota tem um limite de requisições simultâneas (ADMISSAO_LEITURA para
+GET/HEAD, ADMISSAO_ESCRITA para as demais, ou o valor de ADMISSAO_ROTAS) e
+todas juntas podem ter um limite global (ADMISSAO_GLOBAL). Quem passa do
+limite espera numa fila de até ADMISSAO_FILA requisições por no máximo
+ADMISSAO_ESPERA_MS; com a fila cheia ou o prazo vencido a resposta é `503`
+com `Retry-After`, antes de ocupar uma thread ou uma conexão do pool.
+
+No limite global as vagas liberadas vão primeiro para o tipo de
+ADMISSAO_PRIORIDADE (escritas, por padrão), e com a fila cheia uma chegada
+desse tipo toma o lugar da última requisição do outro.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from dotenv import load_dotenv
+from fastapi.responses import ORJSONResponse
+
+import metrics
+
+
+load_dotenv()
+
+LEITURA = "leitura"
+ESCRITA = "escrita"
+METODOS_LEITURA = ("GET", "HEAD")
+
+# Requisições simultâneas por rota (0 = sem limite)
+ADMISSAO_LEITURA = int(os.getenv("ADMISSAO_LEITURA", "0"))
+ADMISSAO_ESCRITA = int(os.getenv("ADMISSAO_ESCRITA", "0"))
+# Limites de rotas específicas: "GET /v1/empresas=20,POST /v1/empresas/bulk=2"
+ADMISSAO_ROTAS = os.getenv("ADMISSAO_ROTAS", "")
+# Requisições simultâneas somando todas as rotas (0 = sem limite)
+ADMISSAO_GLOBAL = int(os.getenv("ADMISSAO_GLOBAL", "0"))
+ADMISSAO_PRIORIDADE = os.getenv("ADMISSAO_PRIORIDADE", ESCRITA).lower()
+# Requisições esperando por limitador e prazo máximo de espera
+ADMISSAO_FILA = int(os.getenv("ADMISSAO_FILA", "50"))
+ADMISSAO_ESPERA_MS = float(os.getenv("ADMISSAO_ESPERA_MS", "500"))
+# Segundos informados no Retry-After das recusas
+ADMISSAO_RETRY_AFTER = int(os.getenv("ADMISSAO_RETRY_AFTER", "1"))
+
+FILA_CHEIA = "fila_cheia"
+PRAZO = "prazo"
+
+
+def _le_rotas(valor: str) -> dict:
+    limites = {}
+    for item in valor.split(","):
+        if not item.strip():
+            continue
+        rota, _, limite = item.rpartition("=")
+        metodo, _, caminho = rota.strip().partition(" ")
+        if not caminho.strip() or not limite.strip().isdigit():
+            raise ValueError(f"ADMISSAO_ROTAS inválida: {item.strip()!r} (use \"MÉTODO /caminho=limite\")")
+        limites[(metodo.upper(), caminho.strip())] = int(limite)
+    return limites
+
+
+def valida_configuracao():
+    erros = []
+    for nome, valor in (("ADMISSAO_LEITURA", ADMISSAO_LEITURA), ("ADMISSAO_ESCRITA", ADMISSAO_ESCRITA), ("ADMISSAO_GLOBAL", ADMISSAO_GLOBAL), ("ADMISSAO_FILA", ADMISSAO_FILA)):
+        if valor < 0:
+            erros.append(f"{nome} não pode ser negativo")
+    if ADMISSAO_ESPERA_MS < 0:
+        erros.append("ADMISSAO_ESPERA_MS não pode ser negativo")
+    if ADMISSAO_PRIORIDADE not in (LEITURA, ESCRITA):
+        erros.append(f"ADMISSAO_PRIORIDADE deve ser {ESCRITA!r} ou {LEITURA!r}")
+    if erros:
+        raise ValueError("Configuração de admissão inválida: " + "; ".join(erros))
+
+valida_configuracao()
+LIMITES_ROTAS = _le_rotas(ADMISSAO_ROTAS)
+
+
+class Rejeitada(Exception):
+    def __init__(self, motivo: str):
+        super().__init__(motivo)
+        self.motivo = motivo
+
+
+class Limitador:
+    """Até `limite` execuções simultâneas e até `fila` requisições esperando.
+
+    `entra` devolve quando há vaga ou levanta `Rejeitada` (fila cheia ou
+    `prazo` vencido); cada entrada é seguida de um `sai`. A vaga liberada
+    passa direto para a próxima da fila, primeiro as do tipo `prioridade`.
+    """
+
+    def __init__(self, limite: int, fila: int = ADMISSAO_FILA, prioridade: str = ADMISSAO_PRIORIDADE, labels=("*", "*")):
+        self.limite = limite
+        self.fila = fila
+        self.labels = labels
+        self.em_uso = 0
+        outra = LEITURA if prioridade == ESCRITA else ESCRITA
+        self._filas = {prioridade: deque(), outra: deque()}
+
+    @property
+    def na_fila(self):
+        return sum(len(fila) for fila in self._filas.values())
+
+    async def entra(self, tipo: str, prazo: float):
+        if self.em_uso < self.limite and not self.na_fila:
+            self.em_uso += 1
+            metrics.ADMISSION_IN_FLIGHT.inc(*self.labels)
+            return
+        if self.na_fila >= self.fila:
+            self._abre_espaco(tipo)
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._filas[tipo].append(futuro)
+        metrics.ADMISSION_QUEUE_DEPTH.inc(*self.labels)
+        try:
+            await asyncio.wait_for(futuro, max(prazo - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            raise Rejeitada(PRAZO)
+        except BaseException:
+            # Cancelada depois de receber a vaga: devolve
+            if futuro.done() and not futuro.cancelled() and futuro.exception() is None:
+                self.sai()
+            raise
+        finally:
+            if futuro in self._filas[tipo]:
+                self._filas[tipo].remove(futuro)
+            metrics.ADMISSION_QUEUE_DEPTH.dec(*self.labels)
+
+    def _abre_espaco(self, tipo: str):
+        prioritaria, outra = self._filas
+        if tipo == prioritaria and self._filas[outra]:
+            # Recusa a última da fila menos prioritária no lugar desta
+            self._filas[outra].pop().set_exception(Rejeitada(FILA_CHEIA))
+            return
+        raise Rejeitada(FILA_CHEIA)
+
+    def sai(self):
+        for fila in self._filas.values():
+            while fila:
+                futuro = fila.popleft()
+                if not futuro.done():
+                    futuro.set_result(None)
+                    return
+        self.em_uso -= 1
+        metrics.ADMISSION_IN_FLIGHT.dec(*self.labels)
+
+
+limitador_global = Limitador(ADMISSAO_GLOBAL) if ADMISSAO_GLOBAL else None
+
+
+def limite_da_rota(metodos, caminho: str) -> int:
+    for metodo in metodos:
+        if (metodo, caminho) in LIMITES_ROTAS:
+            return LIMITES_ROTAS[(metodo, caminho)]
+    return ADMISSAO_LEITURA if set(metodos) <= set(METODOS_LEITURA) else ADMISSAO_ESCRITA
+
+
+def recusa():
+    return ORJSONResponse(
+        {"detail": "Servidor sobrecarregado, tente novamente em instantes"},
+        status_code=503,
+        headers={"Retry-After": str(ADMISSAO_RETRY_AFTER)},
+    )
+
+
+class _Liberando:
+    """Envia a resposta e só então libera as vagas, para que o corpo de um
+    StreamingResponse também conte como execução."""
+
+    def __init__(self, resposta, libera):
+        self.resposta = resposta
+        self.libera = libera
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.resposta(scope, receive, send)
+        finally:
+            self.libera()
+
+
+class RotaAdmitida(metrics.InstrumentedRoute):
+    """Rota instrumentada que passa pelo controle de admissão antes de
+    validar o corpo e resolver as dependências (get_db)."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        limite = limite_da_rota(self.methods, self.path)
+        limitadores = []
+        if limite:
+            limitadores.append(Limitador(limite, ADMISSAO_FILA, labels=(",".join(sorted(self.methods)), self.path)))
+        if limitador_global is not None:
+            limitadores.append(limitador_global)
+        if not limitadores:
+            return handler
+
+        async def admitido(request):
+            tipo = LEITURA if request.method in METODOS_LEITURA else ESCRITA
+            inicio = time.monotonic()
+            obtidos = []
+
+            def libera():
+                while obtidos:
+                    obtidos.pop().sai()
+
+            try:
+                for limitador in limitadores:
+                    await limitador.entra(tipo, inicio + ADMISSAO_ESPERA_MS / 1000)
+                    obtidos.append(limitador)
+            except Rejeitada as exc:
+                libera()
+                metrics.ADMISSION_REJECTED.inc(request.method, self.path, exc.motivo)
+                return recusa()
+            except BaseException:
+                libera()
+                raise
+            metrics.ADMISSION_QUEUE_WAIT.observe(time.monotonic() - inicio, request.method, self.path)
+
+            try:
+                resposta = await handler(request)
+            except BaseException:
+                libera()
+                raise
+            return _Liberando(resposta, libera)
+
+        return admitido
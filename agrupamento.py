@@ -0,0 +1,80 @@
+"""Agrupamento de escritas unitárias concorrentes em lotes.
+
+Com AGRUPA_OBRIGACOES=true, os `POST /v1/obrigacaoAcessoria` que chegam
+com até AGRUPA_ESPERA_MS milissegundos de diferença (e no máximo
+AGRUPA_LOTE_MAX por vez) viram um único INSERT multi-linha com RETURNING e
+um único commit, pelo mesmo caminho das cargas em lote. Cada requisição
+continua recebendo o próprio id ou o próprio erro.
+"""
+import asyncio
+import contextvars
+import os
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+AGRUPA_OBRIGACOES = os.getenv("AGRUPA_OBRIGACOES", "false").lower() in ("1", "true", "yes")
+# Espera máxima somada a uma requisição e tamanho máximo de um lote
+AGRUPA_ESPERA_MS = float(os.getenv("AGRUPA_ESPERA_MS", "2"))
+AGRUPA_LOTE_MAX = int(os.getenv("AGRUPA_LOTE_MAX", "100"))
+
+
+class Agrupador:
+    """Junta os itens enviados por chamadas concorrentes e os grava em lote.
+
+    `executa(itens)` é uma corrotina que grava a lista e devolve um
+    resultado por item, na mesma ordem. Um lote é disparado quando chega a
+    `lote_max` itens ou `espera` segundos depois do primeiro item.
+    """
+
+    def __init__(self, executa, espera: float = AGRUPA_ESPERA_MS / 1000, lote_max: int = AGRUPA_LOTE_MAX):
+        self._executa = executa
+        self.espera = espera
+        self.lote_max = lote_max
+        self.lotes = 0
+        self._pendentes = []
+        self._timer = None
+        self._tarefas = set()
+
+    async def envia(self, item):
+        futuro = asyncio.get_running_loop().create_future()
+        self._pendentes.append((item, futuro))
+        if len(self._pendentes) >= self.lote_max:
+            self._dispara()
+        elif self._timer is None:
+            # Contexto vazio: o SQL do lote não entra nas métricas da
+            # requisição que por acaso abriu o lote
+            self._timer = asyncio.get_running_loop().call_later(self.espera, self._dispara, context=contextvars.Context())
+        return await futuro
+
+    def _dispara(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        lote, self._pendentes = self._pendentes, []
+        if lote:
+            tarefa = asyncio.get_running_loop().create_task(self._grava(lote), context=contextvars.Context())
+            self._tarefas.add(tarefa)
+            tarefa.add_done_callback(self._tarefas.discard)
+
+    async def _grava(self, lote):
+        self.lotes += 1
+        try:
+            resultados = await self._executa([item for item, _ in lote])
+        except Exception as exc:
+            # Falha do lote inteiro (banco fora do ar, por exemplo): todas as
+            # chamadas recebem o erro
+            for _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(exc)
+        else:
+            for (_, futuro), resultado in zip(lote, resultados):
+                if not futuro.done():
+                    futuro.set_result(resultado)
+
+    async def encerra(self):
+        # Grava o que ainda está pendente e espera os lotes em andamento
+        self._dispara()
+        if self._tarefas:
+            await asyncio.gather(*self._tarefas, return_exceptions=True)
\ No newline at end of file
@@ -0,0 +1,158 @@
+import mudancas, models, schemas
+import repositories
+from datetime import date
+from typing import List, Optional, Union
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+
+# Versões assíncronas das funções de repositories.py. Com AsyncSession a
+# função síncrona roda via run_sync sobre a conexão assíncrona (sem ocupar
+# thread); com Session ela roda no threadpool, como nos endpoints síncronos.
+
+async def _run(db: Union[AsyncSession, Session], funcao, *args, **kwargs):
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(funcao, *args, **kwargs)
+    return await run_in_threadpool(funcao, db, *args, **kwargs)
+
+
+async def _stream(db: AsyncSession, stmt, model, yield_per: int, linhas: bool = False):
+    stmt = stmt.order_by(model.id).execution_options(yield_per=yield_per)
+    resultado = (await db.stream(stmt)).mappings() if linhas else await db.stream_scalars(stmt)
+    async for lote in resultado.partitions():
+        yield lote
+
+
+# Empresas
+
+async def get_empresa(db: AsyncSession, empresa_id: int):
+    return await _run(db, repositories.get_empresa, empresa_id)
+
+
+async def get_empresa_linha(db: AsyncSession, empresa_id: int):
+    return await _run(db, repositories.get_empresa_linha, empresa_id)
+
+
+async def get_empresas(db: AsyncSession, empresa_ids: List[int]):
+    return await _run(db, repositories.get_empresas, empresa_ids)
+
+
+async def get_empresas_por_cnpj(db: AsyncSession, cnpjs: List[str]):
+    return await _run(db, repositories.get_empresas_por_cnpj, cnpjs)
+
+
+async def get_empresa_com_obrigacoes(db: AsyncSession, empresa_id: int):
+    return await _run(db, repositories.get_empresa_com_obrigacoes, empresa_id)
+
+
+async def list_empresas(db: AsyncSession, cnpj: Optional[str] = None, cursor: Optional[int] = None, limit: int = 100, include_obrigacoes: bool = False):
+    return await _run(db, repositories.list_empresas, cnpj, cursor, limit, include_obrigacoes)
+
+
+def stream_empresas(db: AsyncSession, cnpj: Optional[str] = None, yield_per: int = repositories.STREAM_YIELD_PER, include_obrigacoes: bool = False):
+    return _stream(db, repositories._filtra_empresas(cnpj, include_obrigacoes), models.Empresa, yield_per, linhas=not include_obrigacoes)
+
+
+async def search_empresas(db: AsyncSession, q: str, limit: int = 20):
+    return await _run(db, repositories.search_empresas, q, limit)
+
+
+async def create_empresa(db: AsyncSession, empresa: schemas.Empresa):
+    return await _run(db, repositories.create_empresa, empresa)
+
+
+async def bulk_create_empresas(db: AsyncSession, empresas: List[schemas.Empresa], chunk_size: int = repositories.BULK_CHUNK_SIZE):
+    return await _run(db, repositories.bulk_create_empresas, empresas, chunk_size)
+
+
+async def delete_empresa(db: AsyncSession, empresa_id: int):
+    return await _run(db, repositories.delete_empresa, empresa_id)
+
+
+async def delete_empresas(db: AsyncSession, empresa_ids: List[int]):
+    return await _run(db, repositories.delete_empresas, empresa_ids)
+
+
+async def versao_empresa(db: AsyncSession, empresa_id: int):
+    return await _run(db, repositories.versao_empresa, empresa_id)
+
+
+async def update_empresa(db: AsyncSession, update_empresa: schemas.EmpresaPatch, empresa_id: int, versoes: Optional[List[int]] = None):
+    return await _run(db, repositories.update_empresa, update_empresa, empresa_id, versoes)
+
+
+# Obrigação Acessória
+
+async def get_obrigacao_acessoria(db: AsyncSession, obrigacao_acessoria_id: int):
+    return await _run(db, repositories.get_obrigacao_acessoria, obrigacao_acessoria_id)
+
+
+async def get_obrigacao_acessoria_linha(db: AsyncSession, obrigacao_acessoria_id: int):
+    return await _run(db, repositories.get_obrigacao_acessoria_linha, obrigacao_acessoria_id)
+
+
+async def get_obrigacoes_acessorias(db: AsyncSession, obrigacao_acessoria_ids: List[int]):
+    return await _run(db, repositories.get_obrigacoes_acessorias, obrigacao_acessoria_ids)
+
+
+async def list_obrigacoes_acessorias(db: AsyncSession, empresa_id: Optional[int] = None, periodicidade: Optional[str] = None, cursor: Optional[int] = None, limit: int = 100):
+    return await _run(db, repositories.list_obrigacoes_acessorias, empresa_id, periodicidade, cursor, limit)
+
+
+def stream_obrigacoes_acessorias(db: AsyncSession, empresa_id: Optional[int] = None, periodicidade: Optional[str] = None, yield_per: int = repositories.STREAM_YIELD_PER):
+    return _stream(db, repositories._filtra_obrigacoes_acessorias(empresa_id, periodicidade), models.ObrigacaoAcessoria, yield_per, linhas=True)
+
+
+async def create_obrigacao_acessoria(db: AsyncSession, obrigacao_acessoria: schemas.ObrigacaoAcessoria):
+    return await _run(db, repositories.create_obrigacao_acessoria, obrigacao_acessoria)
+
+
+async def bulk_create_obrigacoes_acessorias(db: AsyncSession, obrigacoes_acessorias: List[schemas.ObrigacaoAcessoria], chunk_size: int = repositories.BULK_CHUNK_SIZE):
+    return await _run(db, repositories.bulk_create_obrigacoes_acessorias, obrigacoes_acessorias, chunk_size)
+
+
+async def delete_obrigacao_acessoria(db: AsyncSession, obrigacao_acessoria_id: int):
+    return await _run(db, repositories.delete_obrigacao_acessoria, obrigacao_acessoria_id)
+
+
+async def delete_obrigacoes_acessorias(db: AsyncSession, obrigacao_acessoria_ids: List[int]):
+    return await _run(db, repositories.delete_obrigacoes_acessorias, obrigacao_acessoria_ids)
+
+
+async def versao_obrigacao_acessoria(db: AsyncSession, obrigacao_acessoria_id: int):
+    return await _run(db, repositories.versao_obrigacao_acessoria, obrigacao_acessoria_id)
+
+
+async def update_obrigacao_acessoria(db: AsyncSession, update_obrigacao_acessoria: schemas.ObrigacaoAcessoriaPatch, obrigacao_acessoria_id: int, versoes: Optional[List[int]] = None):
+    return await _run(db, repositories.update_obrigacao_acessoria, update_obrigacao_acessoria, obrigacao_acessoria_id, versoes)
+
+
+# Vencimentos
+
+async def list_vencimentos(db: AsyncSession, de: date, ate: date, empresa_id: Optional[int] = None, cursor: Optional[str] = None, limit: int = 1000):
+    return await _run(db, repositories.list_vencimentos, de, ate, empresa_id, cursor, limit)
+
+
+# Mudanças
+
+async def list_mudancas(db: AsyncSession, since: int = 0, limit: int = mudancas.MUDANCAS_LOTE):
+    return await _run(db, repositories.list_mudancas, since, limit)
+
+
+async def ultima_mudanca(db: AsyncSession):
+    return await _run(db, repositories.ultima_mudanca)
+
+
+# Relatórios
+
+async def relatorio_obrigacoes(db: AsyncSession, empresa_id: Optional[int] = None, cursor: Optional[int] = None, limit: int = 100):
+    return await _run(db, repositories.relatorio_obrigacoes, empresa_id, cursor, limit)
+
+
+# Exportação
+
+async def stream_export(db: AsyncSession, cursor: Optional[int] = None, yield_per: int = repositories.STREAM_YIELD_PER):
+    resultado = await db.stream(repositories._export_stmt(cursor).execution_options(yield_per=yield_per))
+    async for lote in resultado.partitions():
+        yield [tuple(linha) for linha in lote]
\ No newline at end of file
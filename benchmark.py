@@ -0,0 +1,386 @@
+"""Benchmark das rotas da API.
+
+Popula o banco com um conjunto de dados realista pelos repositórios, sobe a
+API com o uvicorn (ou usa uma já em execução com --url) e dispara cada rota
+em níveis fixos de concorrência, medindo vazão e latências p50/p95/p99. O
+resultado é salvo em JSON para comparação entre commits.
+
+Exemplos:
+    python benchmark.py --database-url sqlite:///./bench.db --empresas 10000
+    python benchmark.py --empresas 1000000 --concurrency 1,16,64 --requests 5000
+    python benchmark.py --baseline bench-results/anterior.json --threshold 0.10
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+
+PERIODICIDADES = ["Mensal", "Trimestral", "Semestral", "Anual"]
+PESOS_PERIODICIDADES = [0.6, 0.15, 0.05, 0.2]
+LOTE_SEED = 5000
+LOTE_BULK = 100
+LOTE_LOOKUP = 200
+LOTE_REMOCAO = 100
+
+# Metas de latência p99 (ms) por rota, verificadas em todos os níveis de
+# concorrência; a execução falha se alguma for ultrapassada
+METAS_P99_MS = {
+    "GET /v1/empresas/search": 100.0,
+}
+
+
+# Dados
+
+def _empresa(rng: random.Random, cnpj: str):
+    return {
+        "nome": f"Empresa {cnpj} {rng.choice(['Ltda', 'S.A.', 'ME', 'EIRELI'])}",
+        "cnpj": cnpj,
+        "endereco": f"Rua {rng.randint(1, 9999)}, {rng.randint(1, 3000)}",
+        "email": f"contato{cnpj}@empresa.com.br",
+        "telefone": f"11{rng.randint(900000000, 999999999)}",
+    }
+
+
+def _obrigacao(rng: random.Random, empresa_id: int):
+    return {
+        "nome": rng.choice(["DCTF", "EFD-Contribuições", "SPED Fiscal", "DIRF", "ECF", "ECD", "GIA", "DEFIS"]),
+        "periodicidade": rng.choices(PERIODICIDADES, PESOS_PERIODICIDADES)[0],
+        "empresa_id": empresa_id,
+        "dia_vencimento": rng.choice([7, 15, 20, 25, 31]),
+        "mes_inicial": rng.randint(1, 12),
+    }
+
+
+def seed(empresas: int, obrigacoes_min: int, obrigacoes_max: int, semente: int):
+    """Insere empresas até o banco ter `empresas` linhas, cada uma com entre
+    obrigacoes_min e obrigacoes_max obrigações, usando as cargas em lote dos
+    repositórios."""
+    import database, models, repositories, schemas, run
+    from sqlalchemy import func, select
+
+    # O mesmo esquema da produção (índices e restrições inclusive)
+    run.migra()
+    rng = random.Random(semente)
+
+    with database.SessionLocal() as db:
+        existentes = db.scalar(select(func.count()).select_from(models.Empresa))
+        for inicio in range(existentes, empresas, LOTE_SEED):
+            lote = [schemas.Empresa(**_empresa(rng, f"{i:014d}")) for i in range(inicio, min(inicio + LOTE_SEED, empresas))]
+            ids = [r.id for r in repositories.bulk_create_empresas(db, lote) if r.id is not None]
+            obrigacoes = [
+                schemas.ObrigacaoAcessoria(**_obrigacao(rng, empresa_id))
+                for empresa_id in ids
+                for _ in range(rng.randint(obrigacoes_min, obrigacoes_max))
+            ]
+            repositories.bulk_create_obrigacoes_acessorias(db, obrigacoes)
+            print(f"seed: {inicio + len(lote)}/{empresas} empresas", file=sys.stderr)
+
+        return {
+            "empresas": db.execute(select(func.min(models.Empresa.id), func.max(models.Empresa.id))).one(),
+            "obrigacoes": db.execute(select(func.min(models.ObrigacaoAcessoria.id), func.max(models.ObrigacaoAcessoria.id))).one(),
+        }
+
+
+# Cenários
+
+class Cenario:
+    """Gera a i-ésima requisição de uma rota. `vitimas` indica o tipo de
+    entidade descartável que a rota consome (rotas DELETE), `por_requisicao`
+    de cada uma."""
+
+    def __init__(self, requisicao, vitimas: str = None, por_requisicao: int = 1):
+        self.requisicao = requisicao
+        self.vitimas = vitimas
+        self.por_requisicao = por_requisicao
+
+
+def gerador_cnpj():
+    # CNPJs novos a cada execução, sem colidir com os do seed (que começam com zeros)
+    prefixo = f"9{int(time.time()) % 10000:04d}"
+    contador = itertools.count()
+    return lambda: f"{prefixo}{next(contador):09d}"
+
+
+def _lote(vitimas: list, i: int):
+    # i-ésimo lote de LOTE_REMOCAO vítimas, no formato do parâmetro ids
+    return ",".join(str(id) for id in vitimas[i * LOTE_REMOCAO:(i + 1) * LOTE_REMOCAO])
+
+
+def cenarios(faixas: dict, rng: random.Random, novo_cnpj):
+    def empresa_id():
+        return rng.randint(*faixas["empresas"])
+
+    def obrigacao_id():
+        return rng.randint(*faixas["obrigacoes"])
+
+    def termo_busca(i):
+        # Alterna entre prefixo de CNPJ, prefixo de e-mail e nome de empresas do seed
+        cnpj = f"{empresa_id() - 1:014d}"
+        return [cnpj[:10], f"contato{cnpj}@", f"Empresa {cnpj}"][i % 3]
+
+    return {
+        "GET /v1/empresas": Cenario(lambda i, v: ("GET", "/v1/empresas", {"params": {"cursor": empresa_id(), "limit": 100}})),
+        "GET /v1/empresas?include=obrigacoes": Cenario(lambda i, v: ("GET", "/v1/empresas", {"params": {"cursor": empresa_id(), "limit": 100, "include": "obrigacoes"}})),
+        "GET /v1/empresas?ids": Cenario(lambda i, v: ("GET", "/v1/empresas", {"params": {"ids": ",".join(str(empresa_id()) for _ in range(LOTE_LOOKUP))}})),
+        "POST /v1/empresas/lookup": Cenario(lambda i, v: ("POST", "/v1/empresas/lookup", {"json": {"ids": [empresa_id() for _ in range(LOTE_LOOKUP)]}})),
+        "GET /v1/empresas/search": Cenario(lambda i, v: ("GET", "/v1/empresas/search", {"params": {"q": termo_busca(i)}})),
+        "GET /v1/empresas/{empresa_id}": Cenario(lambda i, v: ("GET", f"/v1/empresas/{empresa_id()}", {})),
+        # "*" corresponde a qualquer versão: mede o caminho do 304, que só lê a versão
+        "GET /v1/empresas/{empresa_id} If-None-Match": Cenario(lambda i, v: ("GET", f"/v1/empresas/{empresa_id()}", {"headers": {"If-None-Match": "*"}})),
+        "GET /v1/empresas/{empresa_id}?include=obrigacoes": Cenario(lambda i, v: ("GET", f"/v1/empresas/{empresa_id()}", {"params": {"include": "obrigacoes"}})),
+        "POST /v1/empresas": Cenario(lambda i, v: ("POST", "/v1/empresas", {"json": _empresa(rng, novo_cnpj())})),
+        "POST /v1/empresas/bulk": Cenario(lambda i, v: ("POST", "/v1/empresas/bulk", {"json": [_empresa(rng, novo_cnpj()) for _ in range(LOTE_BULK)]})),
+        "PUT /v1/empresas/{empresa_id}": Cenario(lambda i, v: ("PUT", f"/v1/empresas/{empresa_id()}", {"json": {"telefone": f"11{rng.randint(900000000, 999999999)}"}})),
+        "DELETE /v1/empresas/{empresa_id}": Cenario(lambda i, v: ("DELETE", f"/v1/empresas/{v[i]}", {}), vitimas="empresas"),
+        "DELETE /v1/empresas": Cenario(lambda i, v: ("DELETE", "/v1/empresas", {"params": {"ids": _lote(v, i)}}), vitimas="empresas", por_requisicao=LOTE_REMOCAO),
+        "GET /v1/obrigacaoAcessoria": Cenario(lambda i, v: ("GET", "/v1/obrigacaoAcessoria", {"params": {"empresa_id": empresa_id()}})),
+        "GET /v1/obrigacaoAcessoria?formato=ndjson": Cenario(lambda i, v: ("GET", "/v1/obrigacaoAcessoria", {"params": {"empresa_id": empresa_id(), "formato": "ndjson"}})),
+        "GET /v1/obrigacaoAcessoria?ids": Cenario(lambda i, v: ("GET", "/v1/obrigacaoAcessoria", {"params": {"ids": ",".join(str(obrigacao_id()) for _ in range(LOTE_LOOKUP))}})),
+        "POST /v1/obrigacaoAcessoria/lookup": Cenario(lambda i, v: ("POST", "/v1/obrigacaoAcessoria/lookup", {"json": {"ids": [obrigacao_id() for _ in range(LOTE_LOOKUP)]}})),
+        "GET /v1/obrigacaoAcessoria/vencimentos": Cenario(lambda i, v: ("GET", "/v1/obrigacaoAcessoria/vencimentos", {"params": {"limit": 1000}})),
+        "GET /v1/obrigacaoAcessoria/vencimentos?empresa_id": Cenario(lambda i, v: ("GET", "/v1/obrigacaoAcessoria/vencimentos", {"params": {"empresa_id": empresa_id()}})),
+        "GET /v1/obrigacaoAcessoria/{obrigacao_acessoria_id}": Cenario(lambda i, v: ("GET", f"/v1/obrigacaoAcessoria/{obrigacao_id()}", {})),
+        "POST /v1/obrigacaoAcessoria": Cenario(lambda i, v: ("POST", "/v1/obrigacaoAcessoria", {"json": _obrigacao(rng, empresa_id())})),
+        "POST /v1/obrigacaoAcessoria/bulk": Cenario(lambda i, v: ("POST", "/v1/obrigacaoAcessoria/bulk", {"json": [_obrigacao(rng, empresa_id()) for _ in range(LOTE_BULK)]})),
+        "PUT /v1/obrigacaoAcessoria/{obrigacao_acessoria_id}": Cenario(lambda i, v: ("PUT", f"/v1/obrigacaoAcessoria/{obrigacao_id()}", {"json": {"nome": "DCTFWeb"}})),
+        "DELETE /v1/obrigacaoAcessoria/{obrigacao_acessoria_id}": Cenario(lambda i, v: ("DELETE", f"/v1/obrigacaoAcessoria/{v[i]}", {}), vitimas="obrigacoes"),
+        "DELETE /v1/obrigacaoAcessoria": Cenario(lambda i, v: ("DELETE", "/v1/obrigacaoAcessoria", {"params": {"ids": _lote(v, i)}}), vitimas="obrigacoes", por_requisicao=LOTE_REMOCAO),
+        "GET /v1/relatorios/obrigacoes": Cenario(lambda i, v: ("GET", "/v1/relatorios/obrigacoes", {"params": {"cursor": empresa_id(), "limit": 100}})),
+        "GET /v1/relatorios/obrigacoes?empresa_id": Cenario(lambda i, v: ("GET", "/v1/relatorios/obrigacoes", {"params": {"empresa_id": empresa_id()}})),
+        "GET /v1/changes": Cenario(lambda i, v: ("GET", "/v1/changes", {"params": {"since": 0, "limit": 100, "espera": 0}})),
+        "GET /v1/export/empresas": Cenario(lambda i, v: ("GET", "/v1/export/empresas", {"params": {"formato": "ndjson", "cursor": empresa_id()}})),
+        "GET /v1/cache/stats": Cenario(lambda i, v: ("GET", "/v1/cache/stats", {})),
+        "GET /v1/pool/stats": Cenario(lambda i, v: ("GET", "/v1/pool/stats", {})),
+        "GET /metrics": Cenario(lambda i, v: ("GET", "/metrics", {})),
+        "GET /ready": Cenario(lambda i, v: ("GET", "/ready", {})),
+    }
+
+
+def rotas_sem_cenario(nomes_cenarios):
+    """Rotas de main.app que o benchmark não cobre."""
+    from fastapi.routing import APIRoute
+    import main
+
+    rotas = {
+        f"{metodo} {rota.path}"
+        for rota in main.app.routes if isinstance(rota, APIRoute)
+        for metodo in rota.methods
+    }
+    return sorted(rotas - set(nomes_cenarios))
+
+
+async def _vitimas(client: httpx.AsyncClient, tipo: str, quantidade: int, faixas: dict, rng: random.Random, novo_cnpj):
+    # Entidades criadas só para serem removidas pelas rotas DELETE
+    ids = []
+    for inicio in range(0, quantidade, 1000):
+        total = min(1000, quantidade - inicio)
+        if tipo == "empresas":
+            corpo = [_empresa(rng, novo_cnpj()) for _ in range(total)]
+            resposta = await client.post("/v1/empresas/bulk", json=corpo)
+        else:
+            corpo = [_obrigacao(rng, rng.randint(*faixas["empresas"])) for _ in range(total)]
+            resposta = await client.post("/v1/obrigacaoAcessoria/bulk", json=corpo)
+        ids += [r["id"] for r in resposta.json()["resultados"] if r["id"] is not None]
+    return ids
+
+
+# Execução
+
+def percentil(valores: list, p: float):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p * len(ordenados)) - 1)]
+
+
+async def executa(client: httpx.AsyncClient, cenario: Cenario, requisicoes: int, concorrencia: int, vitimas: list = None):
+    proximas = iter(range(requisicoes))
+    latencias = []
+    erros = 0
+
+    async def worker():
+        nonlocal erros
+        for i in proximas:
+            metodo, caminho, kwargs = cenario.requisicao(i, vitimas)
+            inicio = time.perf_counter()
+            resposta = await client.request(metodo, caminho, **kwargs)
+            await resposta.aread()
+            latencias.append(time.perf_counter() - inicio)
+            if resposta.status_code >= 400:
+                erros += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+
+    return {
+        "requisicoes": requisicoes,
+        "erros": erros,
+        "rps": requisicoes / duracao,
+        "p50_ms": percentil(latencias, 0.50) * 1000,
+        "p95_ms": percentil(latencias, 0.95) * 1000,
+        "p99_ms": percentil(latencias, 0.99) * 1000,
+    }
+
+
+async def benchmark(url: str, faixas: dict, concorrencias: list, requisicoes: int, rotas: list, semente: int):
+    rng = random.Random(semente)
+    novo_cnpj = gerador_cnpj()
+    todos = cenarios(faixas, rng, novo_cnpj)
+    resultados = {}
+
+    limites = httpx.Limits(max_connections=max(concorrencias))
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as client:
+        # Escritas e remoções por último, para não alterar o que as leituras medem
+        ordem = sorted(todos, key=lambda nome: (nome.split()[0] in ("POST", "PUT", "DELETE"), nome.startswith("DELETE")))
+        for nome in ordem:
+            if rotas and nome not in rotas:
+                continue
+            cenario = todos[nome]
+            resultados[nome] = {}
+            for concorrencia in concorrencias:
+                vitimas = None
+                if cenario.vitimas:
+                    vitimas = await _vitimas(client, cenario.vitimas, requisicoes * cenario.por_requisicao, faixas, rng, novo_cnpj)
+                resultados[nome][str(concorrencia)] = await executa(client, cenario, min(requisicoes, len(vitimas) // cenario.por_requisicao if vitimas is not None else requisicoes), concorrencia, vitimas)
+                r = resultados[nome][str(concorrencia)]
+                print(f"{nome:60} c={concorrencia:<4} {r['rps']:9.1f} req/s  p50 {r['p50_ms']:8.2f} ms  p95 {r['p95_ms']:8.2f} ms  p99 {r['p99_ms']:8.2f} ms  erros {r['erros']}", file=sys.stderr)
+    return resultados
+
+
+def compara(atual: dict, baseline: dict, threshold: float):
+    """Lista as rotas cujo p95 piorou ou cuja vazão caiu mais que `threshold`."""
+    regressoes = []
+    for nome, niveis in atual["rotas"].items():
+        for concorrencia, r in niveis.items():
+            base = baseline.get("rotas", {}).get(nome, {}).get(concorrencia)
+            if base is None:
+                continue
+            if r["p95_ms"] > base["p95_ms"] * (1 + threshold):
+                regressoes.append(f"{nome} c={concorrencia}: p95 {base['p95_ms']:.2f} ms -> {r['p95_ms']:.2f} ms")
+            if r["rps"] < base["rps"] * (1 - threshold):
+                regressoes.append(f"{nome} c={concorrencia}: vazão {base['rps']:.1f} -> {r['rps']:.1f} req/s")
+    return regressoes
+
+
+def metas_estouradas(atual: dict, metas: dict = METAS_P99_MS):
+    """Lista as rotas cujo p99 passou da meta em algum nível de concorrência."""
+    estouradas = []
+    for nome, meta in metas.items():
+        for concorrencia, r in atual["rotas"].get(nome, {}).items():
+            if r["p99_ms"] > meta:
+                estouradas.append(f"{nome} c={concorrencia}: p99 {r['p99_ms']:.2f} ms (meta {meta:.0f} ms)")
+    return estouradas
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido"
+
+
+def _sobe_api(porta: int, workers: int):
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(porta), "--workers", str(workers), "--log-level", "warning"],
+        env=os.environ.copy(),
+    )
+    url = f"http://127.0.0.1:{porta}"
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        try:
+            if httpx.get(f"{url}/ready").status_code == 200:
+                return processo, url
+        except httpx.TransportError:
+            time.sleep(0.2)
+    processo.terminate()
+    raise RuntimeError("A API não respondeu em 30 segundos")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das rotas da API")
+    parser.add_argument("--database-url", help="URL do banco (padrão: DATABASE_URL / variáveis DB_* do .env)")
+    parser.add_argument("--url", help="Usa uma API já em execução em vez de subir o uvicorn")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--empresas", type=int, default=10000)
+    parser.add_argument("--obrigacoes-min", type=int, default=1)
+    parser.add_argument("--obrigacoes-max", type=int, default=20)
+    parser.add_argument("--skip-seed", action="store_true", help="Não insere dados; usa o que já está no banco")
+    parser.add_argument("--concurrency", default="1,8,32", help="Níveis de concorrência separados por vírgula")
+    parser.add_argument("--requests", type=int, default=1000, help="Requisições por rota e nível de concorrência")
+    parser.add_argument("--routes", default="", help="Rotas a medir, separadas por vírgula (padrão: todas)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Arquivo JSON de saída (padrão: bench-results/<commit>.json)")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparação")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Piora tolerada em relação ao baseline (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    faltando = rotas_sem_cenario(cenarios({"empresas": (1, 1), "obrigacoes": (1, 1)}, random.Random(), gerador_cnpj()))
+    if faltando:
+        parser.error("rotas sem cenário no benchmark: " + ", ".join(faltando))
+
+    # Com --skip-seed só lê as faixas de ids do que já está no banco
+    faixas = seed(0 if args.skip_seed else args.empresas, args.obrigacoes_min, args.obrigacoes_max, args.seed)
+
+    processo = None
+    url = args.url
+    if url is None:
+        processo, url = _sobe_api(args.port, args.workers)
+
+    try:
+        concorrencias = [int(c) for c in args.concurrency.split(",")]
+        rotas = [r.strip() for r in args.routes.split(",") if r.strip()]
+        resultados = asyncio.run(benchmark(url, faixas, concorrencias, args.requests, rotas, args.seed))
+    finally:
+        if processo is not None:
+            processo.terminate()
+            processo.wait()
+
+    saida = {
+        "commit": _commit(),
+        "data": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "empresas": args.empresas,
+            "obrigacoes": [args.obrigacoes_min, args.obrigacoes_max],
+            "concorrencias": concorrencias,
+            "requisicoes": args.requests,
+            "workers": args.workers,
+            "banco": os.getenv("DATABASE_URL", "postgresql (variáveis DB_*)").split("@")[-1],
+        },
+        "rotas": resultados,
+    }
+    caminho = args.output or os.path.join("bench-results", f"{saida['commit']}.json")
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    with open(caminho, "w") as arquivo:
+        json.dump(saida, arquivo, indent=2, ensure_ascii=False)
+    print(f"resultados salvos em {caminho}", file=sys.stderr)
+
+    falhas = []
+    for estourada in metas_estouradas(saida):
+        print(f"META: {estourada}", file=sys.stderr)
+        falhas.append(estourada)
+    if args.baseline:
+        with open(args.baseline) as arquivo:
+            regressoes = compara(saida, json.load(arquivo), args.threshold)
+        for regressao in regressoes:
+            print(f"REGRESSÃO: {regressao}", file=sys.stderr)
+        falhas.extend(regressoes)
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,173 @@
+import bisect
+import math
+import re
+import threading
+import unicodedata
+import weakref
+from sqlalchemy import select
+
+
+# Similaridade mínima (fração de trigramas em comum) para um nome entrar no
+# resultado, como o pg_trgm.similarity_threshold padrão
+SIMILARIDADE_MINIMA = 0.3
+
+
+def normaliza_nome(texto: str):
+    """Minúsculas, sem acentos e com os espaços colapsados."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.lower().split())
+
+
+def digitos(texto: str):
+    return re.sub(r"\D", "", texto or "")
+
+
+def classifica(q: str):
+    """Decide em qual campo buscar: ("email", prefixo), ("cnpj", dígitos)
+    quando o termo só tem dígitos e pontuação de CNPJ, ou ("nome", termo
+    normalizado)."""
+    termo = q.strip()
+    if "@" in termo:
+        return "email", termo.lower()
+    if digitos(termo) and not re.search(r"[^\d\s./-]", termo):
+        return "cnpj", digitos(termo)
+    return "nome", normaliza_nome(termo)
+
+
+def trigramas_internos(texto: str):
+    # Trigramas sem os espaços de borda: um nome que contém o termo tem
+    # todos eles
+    return {palavra[i:i + 3] for palavra in texto.split() for i in range(len(palavra) - 2)}
+
+
+def trigramas(texto: str):
+    # Mesma decomposição do pg_trgm: cada palavra com dois espaços antes e
+    # um depois
+    conjunto = set()
+    for palavra in texto.split():
+        palavra = f"  {palavra} "
+        conjunto.update(palavra[i:i + 3] for i in range(len(palavra) - 2))
+    return conjunto
+
+
+class IndiceNgram:
+    """Índice em memória usado quando o banco não é o Postgres (SQLite nos
+    testes e no desenvolvimento): trigramas do nome normalizado e listas
+    ordenadas de CNPJ e e-mail para busca por prefixo. É carregado do banco
+    na primeira busca e mantido pelas escritas dos repositórios; escritas
+    feitas por outros processos só aparecem depois que ele é recarregado."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nomes = {}
+        self._trigramas = {}
+        self._postings = {}
+        self._cnpjs = []
+        self._emails = []
+        self._linhas = {}
+
+    def carrega(self, linhas):
+        with self._lock:
+            for id, nome, cnpj, email in linhas:
+                self._adiciona(id, nome, cnpj, email)
+
+    def atualiza(self, id: int, nome: str, cnpj: str, email: str):
+        with self._lock:
+            self._remove(id)
+            self._adiciona(id, nome, cnpj, email)
+
+    def remove(self, *ids: int):
+        with self._lock:
+            for id in ids:
+                self._remove(id)
+
+    def busca(self, q: str, limit: int):
+        campo, termo = classifica(q)
+        if not termo:
+            return []
+        with self._lock:
+            if campo == "nome":
+                return self._busca_nome(termo, limit)
+            lista = self._cnpjs if campo == "cnpj" else self._emails
+            resultado = []
+            posicao = bisect.bisect_left(lista, (termo, 0))
+            while posicao < len(lista) and len(resultado) < limit and lista[posicao][0].startswith(termo):
+                resultado.append(lista[posicao][1])
+                posicao += 1
+            return resultado
+
+    def _busca_nome(self, termo: str, limit: int):
+        consulta = trigramas(termo)
+        listas = sorted((self._postings.get(trigrama, set()) for trigrama in consulta), key=len)
+        # Com similaridade >= SIMILARIDADE_MINIMA o nome tem pelo menos
+        # `necessarios` trigramas da consulta, então está em alguma das
+        # len(consulta) - necessarios + 1 listas mais curtas: as listas de
+        # trigramas comuns ("emp", "ltd") não precisam ser percorridas
+        necessarios = math.ceil(SIMILARIDADE_MINIMA * len(consulta))
+        candidatos = set().union(*listas[:len(consulta) - necessarios + 1])
+        internos = [self._postings.get(trigrama, set()) for trigrama in trigramas_internos(termo)]
+        candidatos |= min(internos, key=len) if internos else self._nomes.keys()
+
+        resultado = []
+        for id in candidatos:
+            nome = self._nomes[id]
+            comuns = len(consulta & self._trigramas[id])
+            similaridade = comuns / (len(consulta) + len(self._trigramas[id]) - comuns)
+            if similaridade >= SIMILARIDADE_MINIMA or termo in nome:
+                # Mesma ordem da consulta no Postgres: prefixo, similaridade, id
+                resultado.append((not nome.startswith(termo), -similaridade, id))
+        resultado.sort()
+        return [id for _, _, id in resultado[:limit]]
+
+    def _adiciona(self, id, nome, cnpj, email):
+        nome = normaliza_nome(nome)
+        self._linhas[id] = (digitos(cnpj), (email or "").lower())
+        self._nomes[id] = nome
+        self._trigramas[id] = trigramas(nome)
+        for trigrama in self._trigramas[id]:
+            self._postings.setdefault(trigrama, set()).add(id)
+        bisect.insort(self._cnpjs, (self._linhas[id][0], id))
+        bisect.insort(self._emails, (self._linhas[id][1], id))
+
+    def _remove(self, id):
+        if id not in self._linhas:
+            return
+        cnpj, email = self._linhas.pop(id)
+        for trigrama in self._trigramas.pop(id):
+            self._postings[trigrama].discard(id)
+        del self._nomes[id]
+        self._cnpjs.remove((cnpj, id))
+        self._emails.remove((email, id))
+
+
+# Um índice por engine, criado na primeira busca
+_indices = weakref.WeakKeyDictionary()
+_indices_lock = threading.Lock()
+
+
+def indice(db):
+    """Índice em memória do banco da sessão, carregado na primeira chamada."""
+    import models
+
+    engine = db.get_bind()
+    with _indices_lock:
+        if engine not in _indices:
+            novo = IndiceNgram()
+            novo.carrega(db.execute(select(models.Empresa.id, models.Empresa.nome, models.Empresa.cnpj, models.Empresa.email)))
+            _indices[engine] = novo
+        return _indices[engine]
+
+
+def atualiza(db, *empresas):
+    """Reflete no índice em memória (se já carregado) as empresas gravadas."""
+    carregado = _indices.get(db.get_bind())
+    if carregado is not None:
+        for empresa in empresas:
+            carregado.atualiza(empresa.id, empresa.nome, empresa.cnpj, empresa.email)
+
+
+def remove(db, *ids):
+    carregado = _indices.get(db.get_bind())
+    if carregado is not None:
+        carregado.remove(*ids)
\ No newline at end of file
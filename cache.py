@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# none | memory | redis
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "none")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Segundos em que uma chave invalidada por uma escrita não aceita o valor
+# lido por uma consulta que começou antes do commit
+CACHE_INVALIDACAO_TTL = float(os.getenv("CACHE_INVALIDACAO_TTL", "5"))
+
+
+def chave(entidade: str, id) -> str:
+    return f"{entidade}:{id}"
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def incrementa(self, contador: str, quantidade: int = 1):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + quantidade)
+
+
+class NullCache:
+    """Backend padrão: não guarda nada, as leituras sempre vão ao banco.
+
+    `set` grava sempre; `add` é o preenchimento feito pelas leituras e só
+    grava quando a chave está vazia. `delete` deixa a chave marcada como
+    invalidada por CACHE_INVALIDACAO_TTL segundos, e nesse tempo `add` não
+    grava nada: uma leitura que fez o SELECT antes do commit de uma escrita
+    não volta a guardar a linha antiga depois da invalidação.
+    """
+
+    nome = "none"
+    enabled = False
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, chave: str):
+        return None
+
+    def set(self, chave: str, valor: dict):
+        pass
+
+    def get_many(self, chaves):
+        # Devolve só as chaves encontradas
+        valores = {}
+        for chave in chaves:
+            valor = self.get(chave)
+            if valor is not None:
+                valores[chave] = valor
+        return valores
+
+    def set_many(self, valores: dict):
+        for chave, valor in valores.items():
+            self.set(chave, valor)
+
+    def add(self, chave: str, valor: dict):
+        pass
+
+    def add_many(self, valores: dict):
+        for chave, valor in valores.items():
+            self.add(chave, valor)
+
+    def delete(self, *chaves: str):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class MemoryCache(NullCache):
+    """LRU em memória do processo, com TTL e limite de entradas."""
+
+    nome = "memory"
+    enabled = True
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL, invalidacao_ttl: float = CACHE_INVALIDACAO_TTL):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.invalidacao_ttl = invalidacao_ttl
+        self._lock = threading.Lock()
+        # chave -> (expira_em, valor)
+        self._entradas = OrderedDict()
+        # Chaves invalidadas -> expira_em, fora do LRU: não ocupam o lugar de
+        # entradas nem contam como remoções. Todas têm o mesmo prazo, então
+        # a ordem de inserção é a de expiração
+        self._invalidadas = OrderedDict()
+
+    def _entrada(self, chave: str):
+        # Chamado com o lock: a entrada válida da chave, ou None
+        entrada = self._entradas.get(chave)
+        if entrada is not None and entrada[0] <= time.monotonic():
+            del self._entradas[chave]
+            self.stats.incrementa("expirations")
+            entrada = None
+        return entrada
+
+    def _invalidada(self, chave: str):
+        # Chamado com o lock
+        expira_em = self._invalidadas.get(chave)
+        if expira_em is not None and expira_em <= time.monotonic():
+            del self._invalidadas[chave]
+            expira_em = None
+        return expira_em is not None
+
+    def get(self, chave: str):
+        with self._lock:
+            entrada = self._entrada(chave)
+            if entrada is None:
+                self.stats.incrementa("misses")
+                return None
+            self._entradas.move_to_end(chave)
+        self.stats.incrementa("hits")
+        return dict(entrada[1])
+
+    def _grava(self, chave: str, valor: dict):
+        self._entradas[chave] = (time.monotonic() + self.ttl, dict(valor))
+        self._entradas.move_to_end(chave)
+        while len(self._entradas) > self.max_entries:
+            self._entradas.popitem(last=False)
+            self.stats.incrementa("evictions")
+
+    def set(self, chave: str, valor: dict):
+        with self._lock:
+            self._invalidadas.pop(chave, None)
+            self._grava(chave, valor)
+
+    def add(self, chave: str, valor: dict):
+        with self._lock:
+            if self._entrada(chave) is None and not self._invalidada(chave):
+                self._grava(chave, valor)
+
+    def delete(self, *chaves: str):
+        with self._lock:
+            agora = time.monotonic()
+            for chave in chaves:
+                self._entradas.pop(chave, None)
+                self._invalidadas.pop(chave, None)
+                self._invalidadas[chave] = agora + self.invalidacao_ttl
+            # Descarta as marcas vencidas e, acima do limite, as mais antigas
+            while self._invalidadas and (next(iter(self._invalidadas.values())) <= agora or len(self._invalidadas) > self.max_entries):
+                self._invalidadas.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entradas)
+
+
+class RedisCache(NullCache):
+    """Cache compartilhado entre processos. Aceita qualquer cliente com a
+    interface get/mget/set(ex=, nx=)/delete/pipeline do redis-py, o que permite
+    usar um servidor local ou um substituto em memória nos testes. Uma chave
+    invalidada guarda uma string vazia até expirar, e `add` usa SET NX."""
+
+    nome = "redis"
+    enabled = True
+
+    def __init__(self, client, ttl: float = CACHE_TTL, prefixo: str = "prova-selecao:", invalidacao_ttl: float = CACHE_INVALIDACAO_TTL):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.prefixo = prefixo
+        self.invalidacao_ttl = invalidacao_ttl
+
+    def get(self, chave: str):
+        valor = self.client.get(self.prefixo + chave)
+        if not valor:
+            self.stats.incrementa("misses")
+            return None
+        self.stats.incrementa("hits")
+        return json.loads(valor)
+
+    def set(self, chave: str, valor: dict):
+        self.client.set(self.prefixo + chave, json.dumps(valor), ex=max(1, int(self.ttl)))
+
+    def get_many(self, chaves):
+        # Um único MGET em vez de uma ida ao Redis por chave
+        chaves = list(chaves)
+        if not chaves:
+            return {}
+        valores = {
+            chave: json.loads(valor)
+            for chave, valor in zip(chaves, self.client.mget([self.prefixo + chave for chave in chaves]))
+            if valor
+        }
+        self.stats.incrementa("hits", len(valores))
+        self.stats.incrementa("misses", len(chaves) - len(valores))
+        return valores
+
+    def _set_many(self, valores: dict, nx: bool):
+        if not valores:
+            return
+        pipeline = self.client.pipeline()
+        for chave, valor in valores.items():
+            pipeline.set(self.prefixo + chave, json.dumps(valor), ex=max(1, int(self.ttl)), nx=nx)
+        pipeline.execute()
+
+    def set_many(self, valores: dict):
+        self._set_many(valores, nx=False)
+
+    def add(self, chave: str, valor: dict):
+        self.client.set(self.prefixo + chave, json.dumps(valor), ex=max(1, int(self.ttl)), nx=True)
+
+    def add_many(self, valores: dict):
+        self._set_many(valores, nx=True)
+
+    def delete(self, *chaves: str):
+        if not chaves:
+            return
+        pipeline = self.client.pipeline()
+        for chave in chaves:
+            pipeline.set(self.prefixo + chave, "", ex=max(1, int(self.invalidacao_ttl)))
+        pipeline.execute()
+
+    def __len__(self):
+        # O tamanho é controlado pelo próprio Redis (maxmemory-policy)
+        return 0
+
+
+def create_cache(backend: str = CACHE_BACKEND):
+    if backend == "memory":
+        return MemoryCache()
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requer o pacote redis instalado")
+        return RedisCache(redis.Redis.from_url(CACHE_REDIS_URL))
+    if backend == "none":
+        return NullCache()
+    raise ValueError(f"CACHE_BACKEND inválido: {backend}")
+
+
+backend = create_cache()
\ No newline at end of file
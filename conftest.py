@@ -0,0 +1,332 @@
+"""Fixtures dos testes com banco de verdade.
+
+Os testes que usam `db`, `api` ou `sql` rodam contra um banco real: SQLite
+em um arquivo temporário por padrão, o Postgres de TEST_DATABASE_URL (o
+usuário precisa poder criar bancos; o nome do banco na URL é o prefixo dos
+bancos criados) ou, com TEST_POSTGRES_TEMPORARIO=true, um servidor Postgres
+descartável iniciado pelo `testing.postgresql` (requirements-dev.txt; os
+binários do Postgres precisam estar instalados). O esquema é criado pelas migrações
+do Alembic, uma vez por processo, e cada teste roda dentro de uma transação
+desfeita no fim: os commits dos repositórios viram savepoints. Com
+DB_ASYNC=true a `api` usa sessões assíncronas, em uma conexão do driver
+assíncrono (aiosqlite, asyncpg) no mesmo banco. Com o pytest-xdist
+(`pytest -n auto`) cada worker usa o próprio banco.
+
+`sql` registra as instruções executadas no teste, para conferir a
+quantidade exata por rota (`sql.exatamente(2, commits=1)`), e
+`sql.varreduras` devolve as tabelas que o plano de uma instrução percorre
+inteiras, para que a falta de um índice quebre o teste.
+"""
+import json
+import os
+import re
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
+
+import database
+
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+TEST_POSTGRES_TEMPORARIO = os.getenv("TEST_POSTGRES_TEMPORARIO", "false").lower() in ("1", "true", "yes")
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+# Instruções geradas pela própria fixture (transação do teste, savepoints
+# dos commits, planos), fora das contagens
+CONTROLE = re.compile(r"\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|EXPLAIN|SET|RESET|SELECT setval)\b", re.IGNORECASE)
+# O setval não é desfeito pelo rollback; cada teste começa do 1
+REINICIA_SEQUENCIAS = "SELECT setval(c.oid, 1, false) FROM pg_class c WHERE c.relkind = 'S'"
+
+
+def _prepara_sqlite(engine):
+    database.habilita_foreign_keys(engine)
+
+    # O pysqlite (e o aiosqlite) abre e fecha transações por conta própria,
+    # o que quebra os savepoints; a transação passa a ser aberta pelo
+    # SQLAlchemy
+    @event.listens_for(engine, "connect")
+    def _sem_transacao_implicita(conexao, _):
+        conexao.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin(conexao):
+        conexao.exec_driver_sql("BEGIN")
+
+
+def _sqlite(caminho):
+    engine = create_engine(f"sqlite:///{caminho}", connect_args={"check_same_thread": False})
+    _prepara_sqlite(engine)
+    return engine, lambda: None
+
+
+def _postgres(url, trabalhador):
+    url = make_url(url)
+    nome = f"{url.database}_{trabalhador}"
+    administracao = create_engine(url.set(database="postgres"), isolation_level="AUTOCOMMIT", poolclass=NullPool)
+
+    def recria(cria=True):
+        with administracao.connect() as conexao:
+            conexao.exec_driver_sql(f'DROP DATABASE IF EXISTS "{nome}" WITH (FORCE)')
+            if cria:
+                conexao.exec_driver_sql(f'CREATE DATABASE "{nome}"')
+
+    recria()
+    return create_engine(url.set(database=nome)), lambda: recria(cria=False)
+
+
+def _postgres_temporario(trabalhador):
+    try:
+        import testing.postgresql
+    except ImportError:
+        raise RuntimeError("TEST_POSTGRES_TEMPORARIO requer o pacote testing.postgresql (pip install -r requirements-dev.txt)")
+    servidor = testing.postgresql.Postgresql()
+    engine, remove = _postgres(servidor.url(), trabalhador)
+
+    def encerra():
+        remove()
+        servidor.stop()
+
+    return engine, encerra
+
+
+def _migra(engine):
+    config = Config()
+    config.set_main_option("script_location", RAIZ)
+    config.set_main_option("version_locations", os.path.join(RAIZ, "versions"))
+    # Conexão sem transação aberta: o Alembic controla as transações (e os
+    # blocos em autocommit, como o CREATE INDEX CONCURRENTLY)
+    with engine.connect() as conexao:
+        config.attributes["connection"] = conexao
+        command.upgrade(config, "head")
+        conexao.commit()
+
+
+@pytest.fixture(scope="session")
+def banco(tmp_path_factory):
+    trabalhador = os.getenv("PYTEST_XDIST_WORKER", "principal")
+    if TEST_DATABASE_URL:
+        engine, remove = _postgres(TEST_DATABASE_URL, trabalhador)
+    elif TEST_POSTGRES_TEMPORARIO:
+        engine, remove = _postgres_temporario(trabalhador)
+    else:
+        engine, remove = _sqlite(tmp_path_factory.mktemp(f"banco_{trabalhador}") / "teste.db")
+    _migra(engine)
+    yield engine
+    engine.dispose()
+    remove()
+
+
+@pytest.fixture
+def conexao(banco):
+    with banco.connect() as conexao:
+        transacao = conexao.begin()
+        if conexao.dialect.name == "postgresql":
+            conexao.exec_driver_sql(REINICIA_SEQUENCIAS)
+        try:
+            yield conexao
+        finally:
+            transacao.rollback()
+
+
+@pytest.fixture
+def sessoes(conexao):
+    # Mesma configuração de database.SessionLocal, na transação do teste
+    return sessionmaker(bind=conexao, autoflush=False, join_transaction_mode="create_savepoint")
+
+
+@pytest.fixture
+def db(sessoes):
+    with sessoes() as sessao:
+        yield sessao
+
+
+@pytest.fixture(scope="session")
+def banco_async(banco):
+    # Engine assíncrona no mesmo banco; sem pool, cada teste abre a sua conexão
+    engine = create_async_engine(database.async_url(banco.url), poolclass=NullPool)
+    if engine.dialect.name == "sqlite":
+        _prepara_sqlite(engine.sync_engine)
+    return engine
+
+
+class TransacaoAsync:
+    """Conexão assíncrona com a transação do teste, no event loop do
+    TestClient (as conexões do asyncpg ficam presas ao loop em que abriram)."""
+
+    def __init__(self, cliente, conexao):
+        self.cliente = cliente
+        self.conexao = conexao
+        # Classe própria do teste, para registrar os eventos das sessões
+        self.Sessao = type("Sessao", (Session,), {})
+        self.sessoes = async_sessionmaker(
+            bind=conexao, class_=AsyncSession, sync_session_class=self.Sessao,
+            autoflush=False, expire_on_commit=False, join_transaction_mode="create_savepoint",
+        )
+
+    def executa(self, funcao):
+        """Executa `funcao(conexao síncrona)` na conexão do teste."""
+        return self.cliente.portal.call(self.conexao.run_sync, funcao)
+
+
+@pytest.fixture
+def transacao_async(banco_async):
+    from fastapi.testclient import TestClient
+    import main
+
+    async def abre():
+        conexao = await banco_async.connect()
+        await conexao.begin()
+        if conexao.dialect.name == "postgresql":
+            await conexao.exec_driver_sql(REINICIA_SEQUENCIAS)
+        return conexao
+
+    async def fecha(conexao):
+        await conexao.rollback()
+        await conexao.close()
+
+    # Com o `with` o TestClient usa um único event loop até o fim do teste
+    with TestClient(main.app) as cliente:
+        conexao = cliente.portal.call(abre)
+        try:
+            yield TransacaoAsync(cliente, conexao)
+        finally:
+            cliente.portal.call(fecha, conexao)
+
+
+@pytest.fixture
+def api(request):
+    """TestClient da aplicação com todas as sessões (get_db, streaming e
+    agrupamento) abertas na transação do teste, sem cache de entidades, no
+    modo de DB_ASYNC."""
+    from fastapi.testclient import TestClient
+    import cache
+    import main
+
+    override = main.app.dependency_overrides.pop(main.get_db, None)
+    try:
+        with patch.object(cache, "backend", cache.NullCache()):
+            if main.DB_ASYNC:
+                transacao = request.getfixturevalue("transacao_async")
+                with patch("main.AsyncSessionLocal", transacao.sessoes):
+                    yield transacao.cliente
+            else:
+                with patch("main.SessionLocal", request.getfixturevalue("sessoes")):
+                    yield TestClient(main.app)
+    finally:
+        if override is not None:
+            main.app.dependency_overrides[main.get_db] = override
+
+
+class Instrucoes:
+    """Instruções SQL e commits de sessão executados durante o teste."""
+
+    def __init__(self, conexao, executa=None):
+        self.conexao = conexao
+        # Os planos rodam na conexão do teste; a assíncrona precisa do loop dela
+        self._executa = executa or (lambda funcao: funcao(conexao))
+        self.executadas = []
+        self.commits = 0
+
+    def _registra(self, conn, cursor, statement, parameters, context, executemany):
+        if not CONTROLE.match(statement):
+            self.executadas.append((statement, parameters))
+
+    def _commit(self, sessao):
+        # Só o commit da transação da sessão; os de begin_nested não contam
+        if sessao.get_nested_transaction() is None:
+            self.commits += 1
+
+    def conta(self, funcao) -> int:
+        inicio = len(self.executadas)
+        funcao()
+        return len(self.executadas) - inicio
+
+    @contextmanager
+    def exatamente(self, instrucoes: int, commits: int = None):
+        """Falha se o bloco não executar exatamente `instrucoes` instruções
+        (e `commits` commits, quando informado)."""
+        inicio, commits_inicio = len(self.executadas), self.commits
+        bloco = []
+        yield bloco
+        bloco.extend(self.executadas[inicio:])
+        listagem = "\n".join(f"  {instrucao}" for instrucao, _ in bloco)
+        assert len(bloco) == instrucoes, f"{len(bloco)} instruções SQL, esperadas {instrucoes}:\n{listagem}"
+        if commits is not None:
+            assert self.commits - commits_inicio == commits, f"{self.commits - commits_inicio} commits, esperados {commits}"
+
+    def _nos_postgres(self, instrucao: str, parametros) -> list:
+        # Com o seq scan desligado o planejador só percorre a tabela inteira
+        # quando não há índice que sirva
+        def explain(conexao):
+            conexao.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            try:
+                return conexao.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {instrucao}", parametros).scalar()
+            finally:
+                conexao.exec_driver_sql("SET LOCAL enable_seqscan = on")
+
+        plano = self._executa(explain)
+        if isinstance(plano, str):
+            plano = json.loads(plano)
+        nos = []
+
+        def percorre(no):
+            nos.append(no)
+            for filho in no.get("Plans", []):
+                percorre(filho)
+
+        percorre(plano[0]["Plan"])
+        return nos
+
+    def plano(self, instrucao: str, parametros=()) -> list:
+        """Plano de execução da instrução, uma linha por nó."""
+        if self.conexao.dialect.name == "postgresql":
+            return [
+                " ".join(filter(None, (no["Node Type"], no.get("Relation Name"), no.get("Index Name"), no.get("Index Cond"))))
+                for no in self._nos_postgres(instrucao, parametros)
+            ]
+        return self._executa(lambda conexao: [linha[-1] for linha in conexao.exec_driver_sql(f"EXPLAIN QUERY PLAN {instrucao}", parametros)])
+
+    def varreduras(self, instrucao: str, parametros=()) -> set:
+        """Tabelas lidas por inteiro no plano da instrução: sem índice, ou
+        percorrendo um índice inteiro (sem condição sobre a chave)."""
+        if self.conexao.dialect.name == "postgresql":
+            return {
+                no["Relation Name"]
+                for no in self._nos_postgres(instrucao, parametros)
+                if no["Node Type"] == "Seq Scan" or (no["Node Type"] in ("Index Scan", "Index Only Scan") and "Index Cond" not in no)
+            }
+        tabelas = set()
+        for linha in self.plano(instrucao, parametros):
+            # SEARCH usa a chave do índice; SCAN lê a tabela (ou o índice) inteira
+            encontrada = re.match(r"SCAN (\w+)(?: USING .+)?$", linha)
+            if encontrada:
+                tabelas.add(encontrada.group(1))
+        return tabelas
+
+
+@pytest.fixture
+def sql(request):
+    import main
+
+    # Com a `api` assíncrona, as instruções da conexão e os commits das
+    # sessões dela; senão, os da transação síncrona (`db`, `sessoes`)
+    if main.DB_ASYNC and "api" in request.fixturenames:
+        transacao = request.getfixturevalue("transacao_async")
+        instrucoes = Instrucoes(transacao.conexao.sync_connection, transacao.executa)
+        sessoes = transacao.Sessao
+    else:
+        instrucoes = Instrucoes(request.getfixturevalue("conexao"))
+        sessoes = request.getfixturevalue("sessoes")
+    event.listen(instrucoes.conexao, "before_cursor_execute", instrucoes._registra)
+    event.listen(sessoes, "after_commit", instrucoes._commit)
+    yield instrucoes
+    event.remove(sessoes, "after_commit", instrucoes._commit)
+    event.remove(instrucoes.conexao, "before_cursor_execute", instrucoes._registra)
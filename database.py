@@ -1,21 +1,366 @@
+import itertools
+import logging
 import os
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import declarative_base
 
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+def _env_bool(nome: str, padrao: bool):
+    return os.getenv(nome, str(padrao)).lower() in ("1", "true", "yes")
+
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
-URL_DB = f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+# DATABASE_URL, quando definida, substitui a URL montada a partir das variáveis DB_*
+URL_DB = os.getenv("DATABASE_URL") or f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+
+# DB_ASYNC=true faz a API usar AsyncSession (asyncpg / aiosqlite) em vez do threadpool
+DB_ASYNC = _env_bool("DB_ASYNC", False)
+
+# Pool de conexões
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+
+# Threads para os trechos síncronos (sessões no modo síncrono); por padrão
+# uma por conexão que o pool pode abrir, para que nenhuma thread fique
+# parada esperando conexão
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE") or DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+# Compatível com o PgBouncer em modo transaction: sem reaproveitar prepared statements
+DB_PGBOUNCER = _env_bool("DB_PGBOUNCER", False)
+
+# Réplicas de leitura (URLs separadas por vírgula). As rotas GET leem delas,
+# em rodízio entre as saudáveis; as escritas e o restante vão ao primário
+DB_REPLICA_URLS = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+# Segundos entre as verificações das réplicas e atraso de replicação máximo
+# (em segundos) para uma réplica continuar recebendo leituras
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "10"))
+# Janela, em segundos, em que um cliente que escreveu lê do primário
+DB_STICKY_SECONDS = float(os.getenv("DB_STICKY_SECONDS", "5"))
+
+def valida_configuracao():
+    erros = []
+    if DB_POOL_SIZE < 1:
+        erros.append("DB_POOL_SIZE deve ser maior que zero")
+    if DB_MAX_OVERFLOW < 0:
+        erros.append("DB_MAX_OVERFLOW não pode ser negativo")
+    if DB_POOL_TIMEOUT <= 0:
+        erros.append("DB_POOL_TIMEOUT deve ser maior que zero")
+    if THREADPOOL_SIZE < 1:
+        erros.append("THREADPOOL_SIZE deve ser maior que zero")
+    if DB_REPLICA_URLS and DB_REPLICA_CHECK_INTERVAL <= 0:
+        erros.append("DB_REPLICA_CHECK_INTERVAL deve ser maior que zero")
+    if erros:
+        raise ValueError("Configuração do banco inválida: " + "; ".join(erros))
+
+    if not DB_ASYNC and THREADPOOL_SIZE > DB_POOL_SIZE + DB_MAX_OVERFLOW:
+        logger.warning(
+            "THREADPOOL_SIZE (%d) maior que DB_POOL_SIZE + DB_MAX_OVERFLOW (%d): as threads excedentes vão esperar no checkout do pool",
+            THREADPOOL_SIZE, DB_POOL_SIZE + DB_MAX_OVERFLOW,
+        )
+
+valida_configuracao()
+
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+def async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS.get(url.get_backend_name(), url.get_driver_name())}")
+
+# Funções chamadas com o tempo (em segundos) que cada checkout esperou por uma conexão livre
+pool_wait_listeners = []
+# Funções chamadas com cada engine criada (a síncrona, ou a sync_engine da assíncrona)
+engine_listeners = []
+
+class _CheckoutTimer:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            espera = time.perf_counter() - inicio
+            with self._stats_lock:
+                self.checkouts += 1
+                self.espera_total += espera
+                self.espera_max = max(self.espera_max, espera)
+            for listener in pool_wait_listeners:
+                listener(espera)
+
+class InstrumentedQueuePool(_CheckoutTimer, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(_CheckoutTimer, AsyncAdaptedQueuePool):
+    pass
+
+def _usa_queue_pool(url: str):
+    # SQLite em memória usa SingletonThreadPool; os demais bancos, QueuePool
+    url = make_url(url)
+    return not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"))
+
+def _engine_options(url, poolclass):
+    opcoes = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if _usa_queue_pool(url):
+        opcoes.update(
+            poolclass=poolclass,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    if DB_PGBOUNCER and make_url(url).get_driver_name() == "asyncpg":
+        # O psycopg2 não usa prepared statements no servidor; o asyncpg sim
+        opcoes["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return opcoes
+
+def pool_stats(engine):
+    # engine None (ainda não criada): tudo zerado
+    pool = engine.pool if engine is not None else None
+    return {
+        "pool_size": pool.size() if isinstance(pool, QueuePool) else 0,
+        "max_overflow": DB_MAX_OVERFLOW if isinstance(pool, QueuePool) else 0,
+        "checked_out": pool.checkedout() if isinstance(pool, QueuePool) else 0,
+        "checked_in": pool.checkedin() if isinstance(pool, QueuePool) else 0,
+        "overflow": max(pool.overflow(), 0) if isinstance(pool, QueuePool) else 0,
+        "checkouts": getattr(pool, "checkouts", 0),
+        "espera_total": getattr(pool, "espera_total", 0.0),
+        "espera_max": getattr(pool, "espera_max", 0.0),
+    }
+
+def habilita_foreign_keys(engine):
+    # O SQLite só aplica as foreign keys (e o ON DELETE CASCADE das
+    # obrigações) com o PRAGMA ligado em cada conexão
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _foreign_keys(conexao, _):
+            cursor = conexao.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+
+# Engines síncronas (ou sync_engine das assíncronas) já criadas no processo
+_criadas = []
+
+def _prepara(engine):
+    habilita_foreign_keys(engine)
+    _criadas.append(engine)
+    for listener in engine_listeners:
+        listener(engine)
+
+def _cria_engine(url: str):
+    engine = create_engine(url, **_engine_options(url, InstrumentedQueuePool))
+    _prepara(engine)
+    return engine
+
+def _cria_async_engine(url: str):
+    engine = create_async_engine(async_url(url), **_engine_options(async_url(url), InstrumentedAsyncQueuePool))
+    _prepara(engine.sync_engine)
+    return engine
+
+class _Preguicosa:
+    """Cria o valor na primeira chamada e devolve sempre o mesmo.
+
+    As engines só são criadas quando a primeira sessão é aberta: importar a
+    aplicação não carrega o driver nem abre conexões, e um master que
+    importa a aplicação antes do fork (gunicorn --preload) não passa
+    conexões para os workers."""
+
+    def __init__(self, cria):
+        self._cria = cria
+        self._valor = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self._valor is None:
+            with self._lock:
+                if self._valor is None:
+                    self._valor = self._cria()
+        return self._valor
+
+    def criada(self):
+        return self._valor is not None
+
+class _LigaNaPrimeiraSessao:
+    def __init__(self, engine, **kw):
+        super().__init__(**kw)
+        self._engine = engine
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=self._engine())
+        return super().__call__(**local_kw)
+
+class _Sessionmaker(_LigaNaPrimeiraSessao, sessionmaker):
+    pass
+
+class _AsyncSessionmaker(_LigaNaPrimeiraSessao, async_sessionmaker):
+    pass
+
+get_engine = _Preguicosa(lambda: _cria_engine(URL_DB))
+get_async_engine = _Preguicosa(lambda: _cria_async_engine(URL_DB))
+
+SessionLocal = _Sessionmaker(get_engine, autocommit=False, autoflush=False)
+AsyncSessionLocal = _AsyncSessionmaker(get_async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def engine_da_api(cria: bool = True):
+    # Engine cujas conexões atendem as requisições no modo configurado. Com
+    # cria=False devolve None enquanto ela não existe: as estatísticas e as
+    # métricas não criam a engine (nem falham com o banco mal configurado)
+    preguicosa = get_async_engine if DB_ASYNC else get_engine
+    if not cria and not preguicosa.criada():
+        return None
+    return preguicosa().sync_engine if DB_ASYNC else preguicosa()
+
+def descarta_engines():
+    # Depois do fork: o processo filho não reaproveita conexões do pai
+    for engine in _criadas:
+        engine.dispose(close=False)
+
+def aquece(conexoes: int = DB_POOL_SIZE):
+    """Abre `conexoes` conexões do pool síncrono, todas ao mesmo tempo, e as
+    devolve ao pool: as primeiras requisições não pagam o connect."""
+    abertas = []
+    try:
+        for _ in range(max(conexoes, 1)):
+            conexao = get_engine().connect()
+            abertas.append(conexao)
+            conexao.execute(text("SELECT 1"))
+    finally:
+        for conexao in abertas:
+            conexao.close()
+    return len(abertas)
+
+async def aquece_async(conexoes: int = DB_POOL_SIZE):
+    """Versão de `aquece` para o pool da engine assíncrona."""
+    abertas = []
+    try:
+        for _ in range(max(conexoes, 1)):
+            conexao = await get_async_engine().connect()
+            abertas.append(conexao)
+            await conexao.execute(text("SELECT 1"))
+    finally:
+        for conexao in abertas:
+            await conexao.close()
+    return len(abertas)
+
+# Atraso de replicação no Postgres; 0 quando a réplica já aplicou tudo o que
+# recebeu (um primário ocioso não faz a réplica parecer atrasada) ou quando
+# o banco não é uma réplica
+_ATRASO_REPLICACAO = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = make_url(url).render_as_string(hide_password=True)
+        self._engine = _Preguicosa(lambda: _cria_engine(url))
+        self._async_engine = _Preguicosa(lambda: _cria_async_engine(url))
+        # session.info["replica"] marca as sessões da réplica: o que elas leem
+        # pode estar atrasado e não vai para o cache compartilhado
+        self.SessionLocal = _Sessionmaker(self._engine, autocommit=False, autoflush=False, info={"replica": True})
+        self.AsyncSessionLocal = _AsyncSessionmaker(self._async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False, info={"replica": True})
+        self.saudavel = True
+        self.atraso = 0.0
+
+    @property
+    def engine(self):
+        return self._engine()
+
+    def engine_da_api(self, cria: bool = True):
+        preguicosa = self._async_engine if DB_ASYNC else self._engine
+        if not cria and not preguicosa.criada():
+            return None
+        return preguicosa().sync_engine if DB_ASYNC else preguicosa()
+
+    def verifica(self):
+        # A verificação usa sempre a engine síncrona, fora do event loop
+        try:
+            with self.engine.connect() as conexao:
+                self.atraso = float(conexao.scalar(_ATRASO_REPLICACAO if self.engine.dialect.name == "postgresql" else text("SELECT 0")))
+        except Exception as exc:
+            if self.saudavel:
+                logger.warning("Réplica %s indisponível: %s", self.url, exc)
+            self.saudavel = False
+            return
+        saudavel = self.atraso <= DB_REPLICA_MAX_LAG
+        if saudavel != self.saudavel:
+            logger.warning("Réplica %s %s (atraso de %.1fs)", self.url, "de volta" if saudavel else "atrasada", self.atraso)
+        self.saudavel = saudavel
+
+    def falhou(self):
+        # Conexão perdida durante uma requisição: sai do rodízio até a
+        # próxima verificação
+        self.saudavel = False
+
+class Replicas:
+    """Réplicas de leitura em rodízio, com verificação periódica de saúde e
+    de atraso em uma thread de fundo (iniciada na primeira escolha)."""
+
+    def __init__(self, urls, intervalo: float = DB_REPLICA_CHECK_INTERVAL):
+        self.replicas = [Replica(url) for url in urls]
+        self.intervalo = intervalo
+        self._rodizio = itertools.count()
+        self._lock = threading.Lock()
+        self._verificador = None
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def _inicia_verificador(self):
+        with self._lock:
+            if self._verificador is None:
+                self._verificador = threading.Thread(target=self._verifica_sempre, name="verifica-replicas", daemon=True)
+                self._verificador.start()
+
+    def _verifica_sempre(self):
+        while True:
+            self.verifica()
+            time.sleep(self.intervalo)
+
+    def verifica(self):
+        for replica in self.replicas:
+            replica.verifica()
+
+    def escolhe(self):
+        # Próxima réplica saudável; None (primário) quando não há nenhuma
+        if not self.replicas:
+            return None
+        if self._verificador is None:
+            self._inicia_verificador()
+        saudaveis = [replica for replica in self.replicas if replica.saudavel]
+        if not saudaveis:
+            return None
+        return saudaveis[next(self._rodizio) % len(saudaveis)]
 
-engine = create_engine(URL_DB)
-SessionLocal = sessionmaker(autocommit=False,autoflush=False, bind=engine)
+replicas = Replicas(DB_REPLICA_URLS)
 
 Base = declarative_base()
\ No newline at end of file
@@ -1,39 +1,27 @@
-import os
-from models import Empresa, ObrigacaoAcessoria
 from logging.config import fileConfig
 from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from dotenv import load_dotenv
+from sqlalchemy.pool import NullPool
 from alembic import context
 
+import models
+from database import URL_DB, habilita_foreign_keys
 
-# Carregar variáveis de ambiente do arquivo .env
-load_dotenv()
 
-# Leia o arquivo de configuração alembic.ini
-fileConfig('alembic.ini')
+# Leia o arquivo de configuração alembic.ini (ausente quando as migrações
+# são aplicadas por código, como nos testes com banco real)
+if context.config.config_file_name is not None:
+    fileConfig(context.config.config_file_name)
 
-# Obter variáveis do .env
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_SCHEMA = os.getenv("DB_SCHEMA")
+# Mesmo banco da aplicação: DATABASE_URL ou as variáveis DB_* do .env
+DATABASE_URL = URL_DB
 
-# Construir a URL de conexão PostgreSQL
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}?schema={DB_SCHEMA}"
-
-# Criar o engine com a URL do banco
-engine = create_engine(DATABASE_URL)
-
-Base = declarative_base()
+target_metadata = models.Base.metadata
 
 # Chame a função que executa as migrações
 def run_migrations_offline():
     context.configure(
-        url=DATABASE_URL,  # Usando a URL construída
-        target_metadata=Base.metadata,
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -41,23 +29,30 @@ def run_migrations_offline():
     with context.begin_transaction():
         context.run_migrations()
 
+def _migra(connectable):
+    context.configure(
+        connection=connectable,
+        target_metadata=target_metadata,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
 def run_migrations_online():
-    connectable = engine.connect()
+    # Conexão recebida de quem chamou (config.attributes["connection"])
+    connectable = context.config.attributes.get("connection")
+    if connectable is not None:
+        _migra(connectable)
+        return
+
+    # Engine própria, sem pool: a migração roda uma vez, antes dos workers
+    engine = create_engine(DATABASE_URL, poolclass=NullPool)
+    habilita_foreign_keys(engine)
 
-    with connectable.begin():
-        context.configure(
-            connection=connectable,
-            target_metadata=Base.metadata,
-        )
-        with context.begin_transaction():
-            context.run_migrations()
+    with engine.connect() as connectable:
+        _migra(connectable)
 
 # Escolha o modo de migração (online ou offline)
-def run():
-    if context.is_offline_mode():
-        run_migrations_offline()
-    else:
-        run_migrations_online()
-
-if __name__ == "__main__":
-    run()
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,152 @@
+"""Exportação de empresas com as suas obrigações acessórias.
+
+Gera o JOIN empresas x obrigações (uma linha por obrigação; empresas sem
+obrigação aparecem uma vez, com as colunas da obrigação vazias) em CSV,
+NDJSON ou Parquet, lendo o banco em blocos com cursor no servidor e
+escrevendo cada bloco assim que ele chega, então a memória usada não depende
+do tamanho da tabela. A mesma lógica atende `GET /v1/export/empresas` e
+esta linha de comando.
+
+Para retomar uma exportação interrompida, passe em --cursor o id da última
+empresa recebida por completo: a exportação recomeça na empresa seguinte.
+
+Exemplos:
+    python export.py --formato csv --saida empresas.csv
+    python export.py --formato ndjson --gzip --saida empresas.ndjson.gz
+    python export.py --formato parquet --cursor 250000 --saida empresas-2.parquet
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import zlib
+
+
+FORMATOS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class Exportador:
+    """Converte blocos de linhas do JOIN em bytes no formato pedido, com
+    compressão gzip opcional. Chame lote() a cada bloco e fim() no final."""
+
+    def __init__(self, formato: str, colunas: list, gzip: bool = False):
+        if formato not in FORMATOS:
+            raise ValueError(f"Formato inválido: {formato}")
+        self.formato = formato
+        self.colunas = [nome for nome, _ in colunas]
+        self._gzip = zlib.compressobj(wbits=31) if gzip else None
+        self._inicio = True
+        if formato == "parquet":
+            try:
+                import pyarrow, pyarrow.parquet
+            except ImportError:
+                raise RuntimeError("O formato parquet requer o pacote pyarrow instalado")
+            self._pa = pyarrow
+            tipos = {int: pyarrow.int64(), str: pyarrow.string()}
+            self._schema = pyarrow.schema([(nome, tipos[tipo]) for nome, tipo in colunas])
+            self._buffer = io.BytesIO()
+            self._writer = pyarrow.parquet.ParquetWriter(self._buffer, self._schema)
+
+    @property
+    def media_type(self):
+        return "application/gzip" if self._gzip else FORMATOS[self.formato][0]
+
+    @property
+    def extensao(self):
+        return FORMATOS[self.formato][1] + (".gz" if self._gzip else "")
+
+    def lote(self, linhas) -> bytes:
+        return self._comprime(getattr(self, f"_{self.formato}")(linhas))
+
+    def fim(self) -> bytes:
+        dados = b""
+        if self.formato == "parquet":
+            # O rodapé do Parquet só é gravado ao fechar o writer
+            self._writer.close()
+            dados = self._esvazia()
+        elif self._inicio and self.formato == "csv":
+            dados = self._csv([])
+        if self._gzip:
+            return self._gzip.compress(dados) + self._gzip.flush()
+        return dados
+
+    def _comprime(self, dados: bytes):
+        return self._gzip.compress(dados) if self._gzip else dados
+
+    def _csv(self, linhas):
+        saida = io.StringIO()
+        escritor = csv.writer(saida, lineterminator="\n")
+        if self._inicio:
+            escritor.writerow(self.colunas)
+            self._inicio = False
+        escritor.writerows(linhas)
+        return saida.getvalue().encode()
+
+    def _ndjson(self, linhas):
+        return "".join(json.dumps(dict(zip(self.colunas, linha)), ensure_ascii=False) + "\n" for linha in linhas).encode()
+
+    def _parquet(self, linhas):
+        # Um row group por bloco lido do banco
+        if linhas:
+            colunas = list(zip(*linhas))
+            self._writer.write_table(self._pa.table(
+                [self._pa.array(valores, tipo.type) for valores, tipo in zip(colunas, self._schema)],
+                schema=self._schema,
+            ))
+        return self._esvazia()
+
+    def _esvazia(self):
+        dados = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return dados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta empresas com as suas obrigações acessórias")
+    parser.add_argument("--formato", choices=sorted(FORMATOS), default="csv")
+    parser.add_argument("--gzip", action="store_true", help="Comprime a saída com gzip")
+    parser.add_argument("--cursor", type=int, help="Começa depois desta empresa (para retomar uma exportação)")
+    parser.add_argument("--saida", help="Arquivo de saída (padrão: saída padrão)")
+    parser.add_argument("--database-url", help="URL do banco (padrão: DATABASE_URL / variáveis DB_* do .env)")
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    import database, repositories
+
+    exportador = Exportador(args.formato, repositories.colunas_export(), args.gzip)
+    arquivo = open(args.saida, "wb") if args.saida else sys.stdout.buffer
+    db = database.SessionLocal()
+    ultima_empresa = args.cursor
+    try:
+        for lote in repositories.stream_export(db, args.cursor):
+            arquivo.write(exportador.lote(lote))
+            ultima_empresa = lote[-1][0]
+        arquivo.write(exportador.fim())
+    except BaseException:
+        # Com a saída incompleta, informa de onde retomar (a última empresa
+        # pode ter sido escrita pela metade, então recomeça nela)
+        print(f"Exportação interrompida; retome com --cursor {_anterior(ultima_empresa, args.cursor)}", file=sys.stderr)
+        raise
+    finally:
+        db.close()
+        if args.saida:
+            arquivo.close()
+    return 0
+
+
+def _anterior(ultima_empresa, cursor):
+    if ultima_empresa is None or ultima_empresa == cursor:
+        return cursor if cursor is not None else 0
+    return ultima_empresa - 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -1,22 +1,265 @@
-from fastapi import FastAPI, Depends, APIRouter, HTTPException, status
+import json
+import orjson
+import time
+from datetime import date, timedelta
+from contextlib import asynccontextmanager
+import anyio
+from typing import AsyncIterator, List, Literal, Optional, Union
+from fastapi import FastAPI, Depends, APIRouter, Header, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError, IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-import models, schemas
-from database import SessionLocal, engine
-import repositories
+import schemas
+from database import AsyncSessionLocal, DB_ASYNC, DB_POOL_SIZE, DB_STICKY_SECONDS, SessionLocal, THREADPOOL_SIZE, aquece, aquece_async, engine_da_api, pool_stats, replicas
+import admissao, agrupamento, async_repositories, cache, export, metrics, mudancas, repositories, vencimentos
 
-models.Base.metadata.create_all(bind=engine)
+# O esquema é criado e alterado pelas migrações do Alembic (alembic upgrade
+# head), e as engines só são criadas na primeira sessão: importar a
+# aplicação não abre conexões
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Limita o threadpool do Starlette de acordo com o pool de conexões
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    yield
+    if agrupador_obrigacoes is not None:
+        await agrupador_obrigacoes.encerra()
+    await difusor.para()
 
-def get_db():
-    db = SessionLocal()
+# orjson como serializador padrão das respostas JSON; as leituras por id e
+# as listagens montam a resposta direto das linhas (ORJSONResponse), sem a
+# validação do response_model, que só documenta o contrato no OpenAPI
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Leitura do próprio write: depois de uma escrita o cliente recebe este
+# cookie e, enquanto ele vale, as suas leituras vão ao primário
+COOKIE_PRIMARIO = "leitura_primario"
+
+def somente_leitura(endpoint):
+    """Marca uma rota POST que só consulta (os lookups em lote): ela vai para
+    a réplica como um GET e não prende o cliente ao primário."""
+    endpoint.somente_leitura = True
+    return endpoint
+
+def _replica_da_requisicao(request: Optional[Request], response: Optional[Response]):
+    if request is None or not replicas:
+        return None
+    leitura = request.method in ("GET", "HEAD") or getattr(request.scope.get("endpoint"), "somente_leitura", False)
+    if not leitura:
+        ate = time.time() + DB_STICKY_SECONDS
+        response.set_cookie(COOKIE_PRIMARIO, f"{ate:.3f}", max_age=max(int(DB_STICKY_SECONDS), 1), httponly=True)
+        return None
+    try:
+        if float(request.cookies.get(COOKIE_PRIMARIO, 0)) > time.time():
+            return None
+    except ValueError:
+        pass
+    return replicas.escolhe()
+
+async def get_db(request: Request = None, response: Response = None) -> AsyncIterator[Union[AsyncSession, Session]]:
+    # GET, HEAD e as rotas `somente_leitura` leem de uma réplica, quando
+    # configuradas; o restante (e as sessões abertas fora de uma requisição)
+    # usa o primário
+    replica = _replica_da_requisicao(request, response)
+    try:
+        if DB_ASYNC:
+            async with (replica.AsyncSessionLocal if replica is not None else AsyncSessionLocal)() as db:
+                yield db
+        else:
+            db = (replica.SessionLocal if replica is not None else SessionLocal)()
+            try:
+                yield db
+            finally:
+                await run_in_threadpool(db.close)
+    except DBAPIError as exc:
+        if replica is not None and exc.connection_invalidated:
+            replica.falhou()
+        raise
+
+# Sessão fora de uma requisição, no modo configurado
+_sessao = asynccontextmanager(get_db)
+
+# Listagens
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def _ndjson(lote, schema=None):
+    if schema is None:
+        # Linhas já no formato do schema de leitura
+        return b"".join(orjson.dumps(dict(linha)) + b"\n" for linha in lote)
+    return "".join(schema.model_validate(item).model_dump_json() + "\n" for item in lote)
+
+def _em_streaming(stream, async_stream, formata, fim=None, **filtros):
+    # A sessão de get_db é encerrada antes do corpo ser enviado, por isso o
+    # streaming abre a própria sessão
+    if DB_ASYNC:
+        async def linhas():
+            async with AsyncSessionLocal() as db:
+                async for lote in async_stream(db, **filtros):
+                    yield formata(lote)
+            if fim is not None:
+                yield fim()
+    else:
+        def linhas():
+            db = SessionLocal()
+            try:
+                for lote in stream(db, **filtros):
+                    yield formata(lote)
+            finally:
+                db.close()
+            if fim is not None:
+                yield fim()
+    return linhas()
+
+def _stream_ndjson(stream, async_stream, schema=None, **filtros):
+    return StreamingResponse(_em_streaming(stream, async_stream, lambda lote: _ndjson(lote, schema), **filtros), media_type=NDJSON_MEDIA_TYPE)
+
+# Cargas em lote
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+def _bulk_openapi(schema_name: str):
+    item = {"$ref": f"#/components/schemas/{schema_name}"}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"type": "array", "items": item}},
+                NDJSON_MEDIA_TYPE: {"schema": item},
+            },
+        }
+    }
+
+async def _ler_lote(request: Request):
+    corpo = await request.body()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+
+    if content_type in NDJSON_CONTENT_TYPES:
+        # Uma linha inválida vira erro só daquela linha
+        registros = []
+        for linha in corpo.splitlines():
+            if not linha.strip():
+                continue
+            try:
+                registros.append(json.loads(linha))
+            except ValueError as exc:
+                registros.append(exc)
+        return registros
+
+    try:
+        registros = json.loads(corpo)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON inválido")
+    if not isinstance(registros, list):
+        raise HTTPException(status_code=400, detail="O corpo da requisição deve ser uma lista")
+    return registros
+
+def _mensagem_erro(exc: Exception):
+    if isinstance(exc, ValidationError):
+        return "; ".join(f"{'.'.join(str(p) for p in erro['loc'])}: {erro['msg']}" for erro in exc.errors())
+    return str(exc)
+
+async def _criar_em_lote(request: Request, db: Session, schema, criar):
+    registros = await _ler_lote(request)
+
+    validos, posicoes, resultados = [], [], []
+    for indice, registro in enumerate(registros):
+        try:
+            if isinstance(registro, Exception):
+                raise registro
+            validos.append(schema.model_validate(registro))
+            posicoes.append(indice)
+        except ValueError as exc:
+            resultados.append(schemas.BulkItemResult(indice=indice, erro=_mensagem_erro(exc)))
+
+    if validos:
+        for resultado in await criar(db, validos):
+            resultados.append(schemas.BulkItemResult(indice=posicoes[resultado.indice], id=resultado.id, erro=resultado.erro))
+
+    resultados.sort(key=lambda resultado: resultado.indice)
+    inseridos = sum(resultado.id is not None for resultado in resultados)
+    return schemas.BulkResult(inseridos=inseridos, falhas=len(resultados) - inseridos, resultados=resultados)
+
+# Buscas por lista de ids
+LOOKUP_MAX_ITENS = 1000
+
+def _le_ids(ids: str):
     try:
-        yield db
-    finally:
-        db.close()
+        valores = [int(id) for id in ids.split(",") if id.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="O parâmetro ids deve ser uma lista de inteiros separados por vírgula")
+    _valida_tamanho_lookup(valores)
+    return valores
+
+def _valida_tamanho_lookup(chaves: list):
+    if len(chaves) > LOOKUP_MAX_ITENS:
+        raise HTTPException(status_code=400, detail=f"A busca aceita no máximo {LOOKUP_MAX_ITENS} itens")
+
+def _resultado_lookup(chaves: list, entidades: list, schema_item, schema_resultado, campo: str):
+    itens = [schema_item(**{"chave": chave, campo: entidade}) for chave, entidade in zip(chaves, entidades)]
+    nao_encontrados = [chave for chave, entidade in zip(chaves, entidades) if entidade is None]
+    return schema_resultado(itens=itens, nao_encontrados=nao_encontrados)
+
+def _resultado_remocao(chaves: list, removidos: list):
+    removidos = set(removidos)
+    chaves = list(dict.fromkeys(chaves))
+    return schemas.BulkDeleteResult(
+        removidos=[chave for chave in chaves if chave in removidos],
+        nao_encontrados=[chave for chave in chaves if chave not in removidos],
+    )
+
+# Requisições condicionais
+def _etag(versao: int):
+    return f'"{versao}"'
+
+def _etags(cabecalho: str, fraca: bool):
+    # Versões de um If-None-Match/If-Match ("*" vira None). Na comparação
+    # fraca (If-None-Match) o prefixo W/ é ignorado; na forte (If-Match)
+    # ETags fracas nunca correspondem
+    versoes = []
+    for etag in cabecalho.split(","):
+        etag = etag.strip()
+        if etag == "*":
+            return None
+        if etag.startswith("W/"):
+            if not fraca:
+                continue
+            etag = etag[2:]
+        if len(etag) > 2 and etag[0] == etag[-1] == '"' and etag[1:-1].isdigit():
+            versoes.append(int(etag[1:-1]))
+    return versoes
+
+async def _nao_modificado(if_none_match: Optional[str], versao_atual, db: Session, id: str):
+    # Resolve o 304 só com a versão, sem carregar nem serializar a entidade
+    if if_none_match is None:
+        return None
+    versao = await versao_atual(db, id)
+    if versao is None:
+        return None
+    versoes = _etags(if_none_match, fraca=True)
+    if versoes is None or versao in versoes:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": _etag(versao)})
+    return None
+
+async def _atualiza_condicional(response: Response, atualiza, db: Session, patch, id: str, if_match: Optional[str], nao_encontrada: str):
+    versoes = _etags(if_match, fraca=False) if if_match is not None else None
+    try:
+        entidade = await atualiza(db, patch, id, versoes)
+    except repositories.VersaoDivergente as exc:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="A versão informada em If-Match não é mais a atual",
+            headers={"ETag": _etag(exc.versao_atual)},
+        )
+    if entidade is None:
+        raise HTTPException(status_code=400, detail=nao_encontrada)
+    response.headers["ETag"] = _etag(entidade.versao)
+    return entidade
 
 # Repository Empresa
-empresa_router = APIRouter(prefix="/empresas", tags=["Empresas v1"])
+empresa_router = APIRouter(prefix="/empresas", tags=["Empresas v1"], route_class=admissao.RotaAdmitida)
 
 @empresa_router.post(
     "",
@@ -26,24 +269,112 @@ empresa_router = APIRouter(prefix="/empresas", tags=["Empresas v1"])
     status_code=status.HTTP_201_CREATED,
     response_model=schemas.Empresa
 )
-def create_empresa(empresa: schemas.Empresa, db: Session = Depends(get_db)):
-    db_empresa = repositories.create_empresa(db, empresa)
+async def create_empresa(empresa: schemas.Empresa, db: Session = Depends(get_db)):
+    db_empresa = await async_repositories.create_empresa(db, empresa)
     return db_empresa
 
+@empresa_router.post(
+    "/bulk",
+    summary="Cria empresas em lote",
+    description="Esta rota permite criar várias empresas em uma única requisição. O corpo pode ser uma lista JSON ou NDJSON (`application/x-ndjson`, uma empresa por linha) no formato especificado pelo schema `Empresa`. As linhas são inseridas em blocos com INSERT multi-linha; erros de uma linha, como CNPJ já cadastrado, não impedem a inserção das demais.",
+    response_description="Retorna o id gerado ou o erro de cada linha, na ordem de envio.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.BulkResult,
+    openapi_extra=_bulk_openapi("Empresa")
+)
+async def bulk_create_empresas(request: Request, db: Session = Depends(get_db)):
+    return await _criar_em_lote(request, db, schemas.Empresa, async_repositories.bulk_create_empresas)
+
+@empresa_router.post(
+    "/lookup",
+    summary="Busca várias empresas de uma vez",
+    description=f"Esta rota busca até {LOOKUP_MAX_ITENS} empresas em uma única requisição, por `ids` ou por `cnpjs` (apenas um dos dois). A busca é feita com uma única consulta, usando o cache quando habilitado.",
+    response_description="Retorna uma entrada por chave enviada, na mesma ordem, com `empresa` nula e a chave listada em `nao_encontrados` quando a empresa não existe.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.EmpresaLookupResult
+)
+@somente_leitura
+async def lookup_empresas(lookup: schemas.EmpresaLookup, db: Session = Depends(get_db)):
+    if (lookup.ids is None) == (lookup.cnpjs is None):
+        raise HTTPException(status_code=400, detail="Informe ids ou cnpjs")
+    if lookup.ids is not None:
+        chaves = lookup.ids
+        _valida_tamanho_lookup(chaves)
+        empresas = await async_repositories.get_empresas(db, chaves)
+    else:
+        chaves = lookup.cnpjs
+        _valida_tamanho_lookup(chaves)
+        empresas = await async_repositories.get_empresas_por_cnpj(db, chaves)
+    return _resultado_lookup(chaves, empresas, schemas.EmpresaLookupItem, schemas.EmpresaLookupResult, "empresa")
+
+@empresa_router.get(
+    "",
+    summary="Lista empresas",
+    description="Esta rota lista as empresas ordenadas por `id`, com filtro opcional por `cnpj`. A paginação é feita por cursor: envie em `cursor` o valor de `proximo_cursor` da página anterior. Com `formato=ndjson` a tabela inteira é enviada em streaming, uma empresa por linha, sem paginação. Com `include=obrigacoes` cada empresa traz também a lista das suas obrigações acessórias. Com `ids` (lista separada por vírgulas) a rota se comporta como `POST /v1/empresas/lookup`.",
+    response_description="Retorna uma página de empresas e o cursor da próxima página.",
+    status_code=status.HTTP_200_OK,
+    response_model=Union[schemas.EmpresaComObrigacoesPage, schemas.EmpresaPage, schemas.EmpresaLookupResult]
+)
+async def list_empresas(cnpj: Optional[str] = None, cursor: Optional[int] = None, limit: int = Query(100, ge=1, le=1000), formato: Literal["json", "ndjson"] = "json", include: Optional[Literal["obrigacoes"]] = None, ids: Optional[str] = None, db: Session = Depends(get_db)):
+    if ids is not None:
+        chaves = _le_ids(ids)
+        empresas = await async_repositories.get_empresas(db, chaves)
+        return _resultado_lookup(chaves, empresas, schemas.EmpresaLookupItem, schemas.EmpresaLookupResult, "empresa")
+    include_obrigacoes = include == "obrigacoes"
+    if formato == "ndjson":
+        schema = schemas.EmpresaComObrigacoesRead if include_obrigacoes else None
+        return _stream_ndjson(repositories.stream_empresas, async_repositories.stream_empresas, schema, cnpj=cnpj, include_obrigacoes=include_obrigacoes)
+    itens, proximo_cursor = await async_repositories.list_empresas(db, cnpj, cursor, limit, include_obrigacoes)
+    if include_obrigacoes:
+        return schemas.EmpresaComObrigacoesPage(itens=itens, proximo_cursor=proximo_cursor)
+    return ORJSONResponse({"itens": itens, "proximo_cursor": proximo_cursor})
+
+@empresa_router.get(
+    "/search",
+    summary="Busca empresas por nome, CNPJ ou e-mail",
+    description="Esta rota busca empresas pelo termo `q`: termos só com dígitos (com ou sem a pontuação do CNPJ) buscam pelo início do CNPJ, termos com `@` pelo início do e-mail e os demais por nome, sem diferenciar maiúsculas nem acentos e tolerando erros de digitação (similaridade por trigramas). No Postgres a busca usa os índices do `pg_trgm`; nos demais bancos, um índice de n-gramas em memória.",
+    response_description="Retorna até `limit` empresas, das mais relevantes para as menos relevantes.",
+    status_code=status.HTTP_200_OK,
+    response_model=List[schemas.EmpresaRead]
+)
+async def search_empresas(q: str = Query(..., min_length=2), limit: int = Query(20, ge=1, le=100), db: Session = Depends(get_db)):
+    return await async_repositories.search_empresas(db, q, limit)
+
 @empresa_router.get(
     "/{empresa_id}",
     summary="Obtém os dados de uma empresa",
-    description="Esta rota retorna os dados de uma empresa específica, identificada pelo `empresa_id`.",
+    description="Esta rota retorna os dados de uma empresa específica, identificada pelo `empresa_id`. Com `include=obrigacoes` a resposta traz também a lista das obrigações acessórias da empresa. Sem `include`, a resposta traz o `ETag` da versão da empresa; enviado de volta em `If-None-Match`, a rota responde `304 Not Modified` enquanto a empresa não mudar.",
     response_description="Retorna os dados da empresa encontrada.",
     status_code=status.HTTP_200_OK,
-    response_model=schemas.EmpresaRead
+    response_model=Union[schemas.EmpresaComObrigacoesRead, schemas.EmpresaRead]
 )
-def read_empresa(empresa_id: str, db: Session = Depends(get_db)):
-    db_empresa = repositories.get_empresa(db, empresa_id)
-    if db_empresa is not None:
-        return db_empresa
-    else:
+async def read_empresa(empresa_id: int, include: Optional[Literal["obrigacoes"]] = None, if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    if include == "obrigacoes":
+        # A versão da empresa não cobre as obrigações: sem ETag
+        db_empresa = await async_repositories.get_empresa_com_obrigacoes(db, empresa_id)
+        if db_empresa is None:
+            raise HTTPException(status_code=400, detail="Empresa não encontrada")
+        return schemas.EmpresaComObrigacoesRead.model_validate(db_empresa)
+
+    nao_modificado = await _nao_modificado(if_none_match, async_repositories.versao_empresa, db, empresa_id)
+    if nao_modificado is not None:
+        return nao_modificado
+    linha = await async_repositories.get_empresa_linha(db, empresa_id)
+    if linha is None:
         raise HTTPException(status_code=400, detail="Empresa não encontrada")
+    return ORJSONResponse(linha, headers={"ETag": _etag(linha["versao"])})
+
+@empresa_router.delete(
+    "",
+    summary="Remove empresas em lote",
+    description=f"Esta rota remove as empresas cujos ids são enviados em `ids` (lista separada por vírgulas, no máximo {LOOKUP_MAX_ITENS}) com um único DELETE. As obrigações acessórias das empresas removidas são apagadas junto, pelo `ON DELETE CASCADE` do banco.",
+    response_description="Retorna os ids removidos e os que não foram encontrados.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.BulkDeleteResult
+)
+async def delete_empresas(ids: str, db: Session = Depends(get_db)):
+    chaves = _le_ids(ids)
+    return _resultado_remocao(chaves, await async_repositories.delete_empresas(db, chaves))
 
 @empresa_router.delete(
     "/{empresa_id}",
@@ -52,11 +383,8 @@ def read_empresa(empresa_id: str, db: Session = Depends(get_db)):
     response_description="Nenhum conteúdo é retornado.",
     status_code=status.HTTP_204_NO_CONTENT
 )
-def delete_empresa(empresa_id: str, db: Session = Depends(get_db)):
-    empresa = repositories.get_empresa(db, empresa_id)
-    if empresa is not None:
-        db.delete(empresa)
-        db.commit()
+async def delete_empresa(empresa_id: int, db: Session = Depends(get_db)):
+    if await async_repositories.delete_empresa(db, empresa_id):
         return
     else:
         raise HTTPException(status_code=400, detail="Empresa não encontrada")
@@ -64,46 +392,143 @@ def delete_empresa(empresa_id: str, db: Session = Depends(get_db)):
 @empresa_router.put(
     "/{empresa_id}",
     summary="Atualiza os dados de uma empresa",
-    description="Esta rota permite atualizar os dados de uma empresa existente, identificada pelo `empresa_id`. O corpo da requisição deve conter os campos a serem atualizados no formato especificado pelo schema `EmpresaPatch`.",
+    description="Esta rota permite atualizar os dados de uma empresa existente, identificada pelo `empresa_id`. O corpo da requisição deve conter os campos a serem atualizados no formato especificado pelo schema `EmpresaPatch`. Com `If-Match`, a atualização só é feita se a empresa ainda estiver na versão informada; caso contrário a rota responde `412 Precondition Failed` com o `ETag` atual.",
     response_description="Retorna os dados atualizados da empresa.",
     status_code=status.HTTP_200_OK,
     response_model=schemas.EmpresaRead
 )
-def update_empresa(empresa_id: str, update_empresa: schemas.EmpresaPatch, db: Session = Depends(get_db)):
-    empresa = repositories.get_empresa(db, empresa_id)
-    if empresa is not None:
-        repositories.update_empresa(db, update_empresa, empresa_id)
-        db.commit()
-        db.refresh(empresa)
-        return empresa
-    else:
-        raise HTTPException(status_code=400, detail="Empresa não encontrada")
+async def update_empresa(empresa_id: int, update_empresa: schemas.EmpresaPatch, response: Response, if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    return await _atualiza_condicional(response, async_repositories.update_empresa, db, update_empresa, empresa_id, if_match, "Empresa não encontrada")
 
 # Repository Obrigação Acessória
-obrigacao_acessoria_router = APIRouter(prefix="/obrigacaoAcessoria", tags=["Obrigacao Acessoria v1"])
+obrigacao_acessoria_router = APIRouter(prefix="/obrigacaoAcessoria", tags=["Obrigacao Acessoria v1"], route_class=admissao.RotaAdmitida)
+
+async def _cria_obrigacoes_agrupadas(obrigacoes_acessorias: List[schemas.ObrigacaoAcessoria]):
+    async with _sessao() as db:
+        return await async_repositories.bulk_create_obrigacoes_acessorias(db, obrigacoes_acessorias)
+
+# Com AGRUPA_OBRIGACOES, as inclusões unitárias concorrentes são gravadas em lote
+agrupador_obrigacoes = agrupamento.Agrupador(_cria_obrigacoes_agrupadas) if agrupamento.AGRUPA_OBRIGACOES else None
 
 @obrigacao_acessoria_router.post(
     "",
     summary="Cria uma nova obrigação acessória",
-    description="Esta rota permite criar uma nova obrigação acessória no banco de dados. O corpo da requisição deve conter os dados da obrigação acessória no formato especificado pelo schema `ObrigacaoAcessoria`.",
+    description=f"Esta rota permite criar uma nova obrigação acessória no banco de dados. O corpo da requisição deve conter os dados da obrigação acessória no formato especificado pelo schema `ObrigacaoAcessoria`. Com `AGRUPA_OBRIGACOES=true`, as inclusões que chegam com até `AGRUPA_ESPERA_MS` milissegundos de diferença (no máximo `AGRUPA_LOTE_MAX` por vez) são gravadas com um único INSERT e um único commit; cada requisição recebe a sua obrigação ou o seu erro (`400` quando a empresa não existe).",
     response_description="Retorna os dados da obrigação acessória criada.",
     status_code=status.HTTP_201_CREATED
 )
-def create_obrigacao_acessoria(obrigacao_acessoria: schemas.ObrigacaoAcessoria, db: Session = Depends(get_db)):
-    db_obrigacao_acessoria = repositories.create_obrigacao_acessoria(db, obrigacao_acessoria)
+async def create_obrigacao_acessoria(obrigacao_acessoria: schemas.ObrigacaoAcessoria, db: Session = Depends(get_db)):
+    if agrupador_obrigacoes is not None:
+        resultado = await agrupador_obrigacoes.envia(obrigacao_acessoria)
+        if resultado.erro is not None:
+            raise HTTPException(status_code=400, detail=resultado.erro)
+        return schemas.ObrigacaoAcessoriaRead(
+            id=resultado.id,
+            periodicidade_meses=vencimentos.periodicidade_meses(obrigacao_acessoria.periodicidade),
+            **obrigacao_acessoria.model_dump(),
+        )
+    try:
+        db_obrigacao_acessoria = await async_repositories.create_obrigacao_acessoria(db, obrigacao_acessoria)
+    except IntegrityError:
+        # Foreign key da empresa: mesma resposta do caminho agrupado
+        raise HTTPException(status_code=400, detail="Empresa não encontrada")
     return db_obrigacao_acessoria
 
+@obrigacao_acessoria_router.post(
+    "/bulk",
+    summary="Cria obrigações acessórias em lote",
+    description="Esta rota permite criar várias obrigações acessórias em uma única requisição. O corpo pode ser uma lista JSON ou NDJSON (`application/x-ndjson`, uma obrigação por linha) no formato especificado pelo schema `ObrigacaoAcessoria`. Linhas que referenciam uma empresa inexistente são reportadas sem impedir a inserção das demais.",
+    response_description="Retorna o id gerado ou o erro de cada linha, na ordem de envio.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.BulkResult,
+    openapi_extra=_bulk_openapi("ObrigacaoAcessoria")
+)
+async def bulk_create_obrigacoes_acessorias(request: Request, db: Session = Depends(get_db)):
+    return await _criar_em_lote(request, db, schemas.ObrigacaoAcessoria, async_repositories.bulk_create_obrigacoes_acessorias)
+
+@obrigacao_acessoria_router.post(
+    "/lookup",
+    summary="Busca várias obrigações acessórias de uma vez",
+    description=f"Esta rota busca até {LOOKUP_MAX_ITENS} obrigações acessórias pelos `ids` em uma única requisição. A busca é feita com uma única consulta, usando o cache quando habilitado.",
+    response_description="Retorna uma entrada por id enviado, na mesma ordem, com `obrigacao_acessoria` nula e o id listado em `nao_encontrados` quando a obrigação não existe.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.ObrigacaoAcessoriaLookupResult
+)
+@somente_leitura
+async def lookup_obrigacoes_acessorias(lookup: schemas.ObrigacaoAcessoriaLookup, db: Session = Depends(get_db)):
+    _valida_tamanho_lookup(lookup.ids)
+    obrigacoes_acessorias = await async_repositories.get_obrigacoes_acessorias(db, lookup.ids)
+    return _resultado_lookup(lookup.ids, obrigacoes_acessorias, schemas.ObrigacaoAcessoriaLookupItem, schemas.ObrigacaoAcessoriaLookupResult, "obrigacao_acessoria")
+
+@obrigacao_acessoria_router.get(
+    "",
+    summary="Lista obrigações acessórias",
+    description="Esta rota lista as obrigações acessórias ordenadas por `id`, com filtros opcionais por `empresa_id` e `periodicidade`. A paginação é feita por cursor: envie em `cursor` o valor de `proximo_cursor` da página anterior. Com `formato=ndjson` o resultado inteiro é enviado em streaming, uma obrigação por linha, sem paginação. Com `ids` (lista separada por vírgulas) a rota se comporta como `POST /v1/obrigacaoAcessoria/lookup`.",
+    response_description="Retorna uma página de obrigações acessórias e o cursor da próxima página.",
+    status_code=status.HTTP_200_OK,
+    response_model=Union[schemas.ObrigacaoAcessoriaPage, schemas.ObrigacaoAcessoriaLookupResult]
+)
+async def list_obrigacoes_acessorias(empresa_id: Optional[int] = None, periodicidade: Optional[str] = None, cursor: Optional[int] = None, limit: int = Query(100, ge=1, le=1000), formato: Literal["json", "ndjson"] = "json", ids: Optional[str] = None, db: Session = Depends(get_db)):
+    if ids is not None:
+        chaves = _le_ids(ids)
+        obrigacoes_acessorias = await async_repositories.get_obrigacoes_acessorias(db, chaves)
+        return _resultado_lookup(chaves, obrigacoes_acessorias, schemas.ObrigacaoAcessoriaLookupItem, schemas.ObrigacaoAcessoriaLookupResult, "obrigacao_acessoria")
+    if formato == "ndjson":
+        return _stream_ndjson(repositories.stream_obrigacoes_acessorias, async_repositories.stream_obrigacoes_acessorias, empresa_id=empresa_id, periodicidade=periodicidade)
+    itens, proximo_cursor = await async_repositories.list_obrigacoes_acessorias(db, empresa_id, periodicidade, cursor, limit)
+    return ORJSONResponse({"itens": itens, "proximo_cursor": proximo_cursor})
+
+@obrigacao_acessoria_router.get(
+    "/vencimentos",
+    summary="Lista os vencimentos das obrigações acessórias",
+    description=f"Esta rota calcula as datas de vencimento das obrigações acessórias entre `de` e `ate` (por padrão, de hoje até daqui a 30 dias), com filtro opcional por `empresa_id`. As ocorrências são geradas a partir da periodicidade normalizada, do `dia_vencimento` e do `mes_inicial` de cada obrigação; obrigações sem dia de vencimento ou com periodicidade não reconhecida não aparecem. A janela é de no máximo {vencimentos.JANELA_MAXIMA_DIAS} dias e a paginação é feita por cursor, como nas listagens.",
+    response_description="Retorna uma página de vencimentos ordenados por data e o cursor da próxima página.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.VencimentoPage
+)
+async def list_vencimentos(de: Optional[date] = None, ate: Optional[date] = None, empresa_id: Optional[int] = None, cursor: Optional[str] = None, limit: int = Query(1000, ge=1, le=10000), db: Session = Depends(get_db)):
+    de = de or date.today()
+    ate = ate or de + timedelta(days=30)
+    if ate < de:
+        raise HTTPException(status_code=400, detail="A data final deve ser igual ou posterior à inicial")
+    if (ate - de).days > vencimentos.JANELA_MAXIMA_DIAS:
+        raise HTTPException(status_code=400, detail=f"A janela deve ter no máximo {vencimentos.JANELA_MAXIMA_DIAS} dias")
+    if cursor is not None:
+        try:
+            vencimentos.le_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+    itens, proximo_cursor = await async_repositories.list_vencimentos(db, de, ate, empresa_id, cursor, limit)
+    return schemas.VencimentoPage(itens=itens, proximo_cursor=proximo_cursor)
+
 @obrigacao_acessoria_router.get(
     "/{obrigacao_acessoria_id}",
     summary="Obtém os dados de uma obrigação acessória",
-    description="Esta rota retorna os dados de uma obrigação acessória específica, identificada pelo `obrigacao_acessoria_id`.",
+    description="Esta rota retorna os dados de uma obrigação acessória específica, identificada pelo `obrigacao_acessoria_id`. A resposta traz o `ETag` da versão da obrigação; enviado de volta em `If-None-Match`, a rota responde `304 Not Modified` enquanto ela não mudar.",
     response_description="Retorna os dados da obrigação acessória encontrada.",
     status_code=status.HTTP_200_OK,
     response_model=schemas.ObrigacaoAcessoriaRead
 )
-def read_obrigacao_acessoria(obrigacao_acessoria_id: str, db: Session = Depends(get_db)):
-    db_obrigacao_acessoria = repositories.get_obrigacao_acessoria(db, obrigacao_acessoria_id)
-    return db_obrigacao_acessoria
+async def read_obrigacao_acessoria(obrigacao_acessoria_id: int, if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    nao_modificado = await _nao_modificado(if_none_match, async_repositories.versao_obrigacao_acessoria, db, obrigacao_acessoria_id)
+    if nao_modificado is not None:
+        return nao_modificado
+    linha = await async_repositories.get_obrigacao_acessoria_linha(db, obrigacao_acessoria_id)
+    if linha is None:
+        raise HTTPException(status_code=400, detail="Obrigação Acessória não encontrada")
+    return ORJSONResponse(linha, headers={"ETag": _etag(linha["versao"])})
+
+@obrigacao_acessoria_router.delete(
+    "",
+    summary="Remove obrigações acessórias em lote",
+    description=f"Esta rota remove as obrigações acessórias cujos ids são enviados em `ids` (lista separada por vírgulas, no máximo {LOOKUP_MAX_ITENS}) com um único DELETE.",
+    response_description="Retorna os ids removidos e os que não foram encontrados.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.BulkDeleteResult
+)
+async def delete_obrigacoes_acessorias(ids: str, db: Session = Depends(get_db)):
+    chaves = _le_ids(ids)
+    return _resultado_remocao(chaves, await async_repositories.delete_obrigacoes_acessorias(db, chaves))
 
 @obrigacao_acessoria_router.delete(
     "/{obrigacao_acessoria_id}",
@@ -112,11 +537,8 @@ def read_obrigacao_acessoria(obrigacao_acessoria_id: str, db: Session = Depends(
     response_description="Nenhum conteúdo é retornado.",
     status_code=status.HTTP_204_NO_CONTENT
 )
-def delete_obrigacao_acessoria(obrigacao_acessoria_id: str, db: Session = Depends(get_db)):
-    obrigacao_acessoria = repositories.get_obrigacao_acessoria(db, obrigacao_acessoria_id)
-    if obrigacao_acessoria is not None:
-        db.delete(obrigacao_acessoria)
-        db.commit()
+async def delete_obrigacao_acessoria(obrigacao_acessoria_id: int, db: Session = Depends(get_db)):
+    if await async_repositories.delete_obrigacao_acessoria(db, obrigacao_acessoria_id):
         return
     else:
         raise HTTPException(status_code=400, detail="Obrigação Acessória não encontrada")
@@ -124,20 +546,175 @@ def delete_obrigacao_acessoria(obrigacao_acessoria_id: str, db: Session = Depend
 @obrigacao_acessoria_router.put(
     "/{obrigacao_acessoria_id}",
     summary="Atualiza os dados de uma obrigação acessória",
-    description="Esta rota permite atualizar os dados de uma obrigação acessória existente, identificada pelo `obrigacao_acessoria_id`. O corpo da requisição deve conter os campos a serem atualizados no formato especificado pelo schema `ObrigacaoAcessoriaPatch`.",
+    description="Esta rota permite atualizar os dados de uma obrigação acessória existente, identificada pelo `obrigacao_acessoria_id`. O corpo da requisição deve conter os campos a serem atualizados no formato especificado pelo schema `ObrigacaoAcessoriaPatch`. Com `If-Match`, a atualização só é feita se a obrigação ainda estiver na versão informada; caso contrário a rota responde `412 Precondition Failed` com o `ETag` atual.",
     response_description="Retorna os dados atualizados da obrigação acessória.",
     status_code=status.HTTP_200_OK,
     response_model=schemas.ObrigacaoAcessoriaRead
 )
-def update_obrigacao_acessoria(obrigacao_acessoria_id: str, update_obrigacao_acessoria: schemas.ObrigacaoAcessoriaPatch, db: Session = Depends(get_db)):
-    obrigacao_acessoria = repositories.get_obrigacao_acessoria(db, obrigacao_acessoria_id)
-    if obrigacao_acessoria is not None:
-        repositories.update_obrigacao_acessoria(db, update_obrigacao_acessoria, obrigacao_acessoria_id)
-        db.commit()
-        db.refresh(obrigacao_acessoria)
-        return obrigacao_acessoria
-    else:
-        raise HTTPException(status_code=400, detail="Obrigação Acessória não encontrada")
+async def update_obrigacao_acessoria(obrigacao_acessoria_id: int, update_obrigacao_acessoria: schemas.ObrigacaoAcessoriaPatch, response: Response, if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    return await _atualiza_condicional(response, async_repositories.update_obrigacao_acessoria, db, update_obrigacao_acessoria, obrigacao_acessoria_id, if_match, "Obrigação Acessória não encontrada")
+
+# Relatórios
+relatorio_router = APIRouter(prefix="/relatorios", tags=["Relatórios v1"], route_class=admissao.RotaAdmitida)
+
+@relatorio_router.get(
+    "/obrigacoes",
+    summary="Resumo das obrigações acessórias por empresa e periodicidade",
+    description="Esta rota retorna a quantidade de obrigações acessórias por periodicidade no total e por empresa, com filtro opcional por `empresa_id` e paginação por cursor (o id da última empresa da página). As contagens vêm de um resumo atualizado na mesma transação de cada inclusão, alteração ou remoção de obrigação, sem percorrer as obrigações; obrigações sem periodicidade aparecem com a chave vazia. Em caso de divergência, o resumo é reconstruído com `python relatorios.py`.",
+    response_description="Retorna os totais por periodicidade, uma página de empresas com as suas contagens e o cursor da próxima página.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.RelatorioObrigacoes
+)
+async def relatorio_obrigacoes(empresa_id: Optional[int] = None, cursor: Optional[int] = None, limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db)):
+    return await async_repositories.relatorio_obrigacoes(db, empresa_id, cursor, limit)
+
+# Feed de mudanças
+# Fora do controle de admissão: o long-polling espera sem ocupar conexões
+mudanca_router = APIRouter(prefix="/changes", tags=["Mudanças v1"], route_class=metrics.InstrumentedRoute)
+
+SSE_MEDIA_TYPE = "text/event-stream"
+# Espera máxima de um long-poll e intervalo dos comentários de keep-alive do SSE
+ESPERA_MAXIMA = 60
+SSE_KEEPALIVE = 15
+
+async def _le_mudancas(since: int, limite: int):
+    async with _sessao() as db:
+        return await async_repositories.list_mudancas(db, since, limite)
+
+async def _ultima_mudanca():
+    async with _sessao() as db:
+        return await async_repositories.ultima_mudanca(db)
+
+# Um leitor do outbox por processo, compartilhado por todos os assinantes
+difusor = mudancas.Difusor(_le_mudancas, _ultima_mudanca)
+
+def _evento(mudanca: dict):
+    return b"id: %d\nevent: mudanca\ndata: %s\n\n" % (mudanca["seq"], orjson.dumps(mudanca))
+
+async def _eventos(since: int, limite: int):
+    while True:
+        itens = await difusor.espera(since, limite, SSE_KEEPALIVE)
+        if not itens:
+            yield b": keep-alive\n\n"
+            continue
+        yield b"".join(_evento(mudanca) for mudanca in itens)
+        since = itens[-1]["seq"]
+
+@mudanca_router.get(
+    "",
+    summary="Feed de mudanças de empresas e obrigações acessórias",
+    description=f"Esta rota entrega, em ordem, as inclusões, alterações e remoções de empresas e obrigações acessórias com `seq` maior que `since`. Cada mudança é gravada na mesma transação da escrita e traz a entidade, o id, a operação e a versão resultante (o mesmo valor do `ETag`); a remoção de uma empresa remove também as suas obrigações, sem uma mudança por obrigação. Sem mudanças novas, a rota espera até `espera` segundos (no máximo {ESPERA_MAXIMA}) antes de responder com a lista vazia (long-polling); o `proximo_cursor` da resposta vai no `since` da requisição seguinte. Com `Accept: text/event-stream` a resposta é um stream de Server-Sent Events, com o `seq` no `id` de cada evento e retomada pelo cabeçalho `Last-Event-ID`. As requisições não ocupam conexões do pool enquanto esperam: um único leitor por processo consulta as mudanças novas e as distribui.",
+    response_description="Retorna as mudanças seguintes a `since` e o cursor para a próxima requisição.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.MudancaPage
+)
+async def list_mudancas(request: Request, since: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000), espera: float = Query(25, ge=0, le=ESPERA_MAXIMA), last_event_id: Optional[int] = Header(None)):
+    if SSE_MEDIA_TYPE in request.headers.get("accept", ""):
+        return StreamingResponse(
+            _eventos(last_event_id if last_event_id is not None else since, limit),
+            media_type=SSE_MEDIA_TYPE,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    itens = await difusor.espera(since, limit, espera)
+    return ORJSONResponse({"itens": itens, "proximo_cursor": itens[-1]["seq"] if itens else since})
+
+# Exportação
+export_router = APIRouter(prefix="/export", tags=["Exportação v1"], route_class=admissao.RotaAdmitida)
+
+@export_router.get(
+    "/empresas",
+    summary="Exporta as empresas com as suas obrigações acessórias",
+    description="Esta rota exporta o JOIN de empresas e obrigações acessórias (uma linha por obrigação; empresas sem obrigações aparecem uma vez, com as colunas da obrigação vazias) em `csv`, `ndjson` ou `parquet` (requer o pacote `pyarrow`), opcionalmente comprimido com `gzip`. O resultado é lido com cursor no servidor e enviado em streaming, ordenado por empresa. Para retomar uma exportação interrompida, envie em `cursor` o id da última empresa recebida por completo.",
+    response_description="Retorna o arquivo exportado em streaming.",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse
+)
+async def export_empresas(formato: Literal["csv", "ndjson", "parquet"] = "csv", gzip: bool = False, cursor: Optional[int] = None):
+    try:
+        exportador = export.Exportador(formato, repositories.colunas_export(), gzip)
+    except RuntimeError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return StreamingResponse(
+        _em_streaming(repositories.stream_export, async_repositories.stream_export, exportador.lote, exportador.fim, cursor=cursor),
+        media_type=exportador.media_type,
+        headers={"Content-Disposition": f'attachment; filename="empresas.{exportador.extensao}"'},
+    )
+
+# Cache
+cache_router = APIRouter(prefix="/cache", tags=["Cache v1"], route_class=metrics.InstrumentedRoute)
+
+@cache_router.get(
+    "/stats",
+    summary="Obtém as estatísticas do cache de entidades",
+    description="Esta rota retorna os contadores do cache de leitura de empresas e obrigações acessórias (acertos, faltas, remoções por limite de tamanho e por TTL), configurado por `CACHE_BACKEND`.",
+    response_description="Retorna os contadores do cache.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.CacheStats
+)
+async def cache_stats():
+    stats = cache.backend.stats
+    return schemas.CacheStats(backend=cache.backend.nome, entradas=len(cache.backend), hits=stats.hits, misses=stats.misses, evictions=stats.evictions, expirations=stats.expirations)
+
+# Pool de conexões
+pool_router = APIRouter(prefix="/pool", tags=["Pool v1"], route_class=metrics.InstrumentedRoute)
+
+@pool_router.get(
+    "/stats",
+    summary="Obtém as estatísticas do pool de conexões",
+    description="Esta rota retorna o estado do pool de conexões (tamanho, conexões em uso, overflow), o tempo de espera acumulado e máximo nos checkouts e a ocupação do threadpool. Com réplicas de leitura configuradas, traz também a saúde, o atraso de replicação e o uso do pool de cada uma.",
+    response_description="Retorna as estatísticas do pool de conexões, do threadpool e das réplicas.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.PoolStats
+)
+async def read_pool_stats():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    replicas_stats = [
+        schemas.ReplicaStats(url=replica.url, saudavel=replica.saudavel, atraso=replica.atraso, **{campo: pool_stats(replica.engine_da_api(cria=False))[campo] for campo in ("checked_out", "checkouts")})
+        for replica in replicas.replicas
+    ]
+    # Antes da primeira sessão a engine não existe e o pool aparece zerado
+    return schemas.PoolStats(**pool_stats(engine_da_api(cria=False)), threadpool_size=limiter.total_tokens, threadpool_em_uso=limiter.borrowed_tokens, replicas=replicas_stats)
+
+# Prontidão
+_pool_aquecido = False
+
+@app.get(
+    "/ready",
+    summary="Verifica se o worker está pronto para receber tráfego",
+    description=f"Esta rota abre conexões com o banco e responde `503` enquanto ele não estiver acessível. A primeira chamada bem-sucedida aquece o pool, abrindo DB_POOL_SIZE ({DB_POOL_SIZE}) conexões de uma vez; as seguintes testam uma conexão. Use como readiness probe do balanceador ou do orquestrador.",
+    response_description="Retorna o estado do worker, as conexões testadas e o tempo da verificação.",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.Prontidao,
+    responses={503: {"description": "Banco inacessível"}},
+    tags=["Prontidão"]
+)
+async def read_ready():
+    global _pool_aquecido
+    inicio = time.perf_counter()
+    conexoes = 1 if _pool_aquecido else DB_POOL_SIZE
+    try:
+        conexoes = await aquece_async(conexoes) if DB_ASYNC else await run_in_threadpool(aquece, conexoes)
+    except SQLAlchemyError as exc:
+        return ORJSONResponse({"status": "indisponivel", "detail": str(getattr(exc, "orig", None) or exc)}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    _pool_aquecido = True
+    return schemas.Prontidao(status="pronto", conexoes=conexoes, duracao_ms=(time.perf_counter() - inicio) * 1000)
+
+# Métricas
+@app.get(
+    "/metrics",
+    summary="Métricas no formato do Prometheus",
+    description="Esta rota retorna, por rota, a contagem de requisições e histogramas de latência, tempo em SQL, instruções SQL, espera por conexão no pool e tempo de serialização da resposta, além dos contadores do cache de entidades.",
+    response_description="Retorna as métricas no formato de exposição de texto do Prometheus.",
+    response_class=PlainTextResponse,
+    tags=["Métricas"]
+)
+async def read_metrics():
+    return PlainTextResponse(metrics.exposicao(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 app.include_router(empresa_router, prefix="/v1")
-app.include_router(obrigacao_acessoria_router, prefix="/v1")
\ No newline at end of file
+app.include_router(obrigacao_acessoria_router, prefix="/v1")
+app.include_router(relatorio_router, prefix="/v1")
+app.include_router(mudanca_router, prefix="/v1")
+app.include_router(export_router, prefix="/v1")
+app.include_router(cache_router, prefix="/v1")
+app.include_router(pool_router, prefix="/v1")
\ No newline at end of file
@@ -0,0 +1,291 @@
+import anyio
+import bisect
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+from dotenv import load_dotenv
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+import cache
+import database
+
+
+load_dotenv()
+
+# Instruções mais lentas que SLOW_QUERY_MS vão para o log "metrics.slow_query" (0 desliga)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+slow_query_logger = logging.getLogger("metrics.slow_query")
+
+
+class RequestStats:
+    """Medições da requisição em andamento, acumuladas pelos hooks do SQLAlchemy."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.endpoint_fim = None
+        self.serializacao = 0.0
+
+    def server_timing(self):
+        total = time.perf_counter() - self.inicio
+        return ", ".join([
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.statements} statements"',
+            f"pool;dur={self.pool_wait * 1000:.2f}",
+            f"ser;dur={self.serializacao * 1000:.2f}",
+            f"total;dur={total * 1000:.2f}",
+        ])
+
+
+_requisicao: ContextVar[Optional[RequestStats]] = ContextVar("requisicao", default=None)
+
+
+def requisicao_atual() -> Optional[RequestStats]:
+    return _requisicao.get()
+
+
+# Métricas no formato de exposição do Prometheus
+
+def _escapa(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(nomes, valores):
+    if not nomes:
+        return ""
+    return "{" + ",".join(f'{nome}="{_escapa(valor)}"' for nome, valor in zip(nomes, valores)) + "}"
+
+
+class Counter:
+    def __init__(self, nome: str, ajuda: str, labels=()):
+        self.nome, self.ajuda, self.labels = nome, ajuda, labels
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def inc(self, *labels, valor: float = 1):
+        with self._lock:
+            self._valores[labels] = self._valores.get(labels, 0) + valor
+
+    def value(self, *labels):
+        return self._valores.get(labels, 0)
+
+    def exposicao(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        with self._lock:
+            for labels, valor in sorted(self._valores.items()):
+                linhas.append(f"{self.nome}{_labels(self.labels, labels)} {valor}")
+        return linhas
+
+
+class Histogram:
+    def __init__(self, nome: str, ajuda: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.nome, self.ajuda, self.labels, self.buckets = nome, ajuda, labels, buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, valor: float, *labels):
+        with self._lock:
+            contagens, soma = self._series.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            contagens[bisect.bisect_left(self.buckets, valor)] += 1
+            self._series[labels] = (contagens, soma + valor)
+
+    def count(self, *labels):
+        serie = self._series.get(labels)
+        return sum(serie[0]) if serie else 0
+
+    def exposicao(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            for labels, (contagens, soma) in sorted(self._series.items()):
+                acumulado = 0
+                for limite, contagem in zip(self.buckets + (float("inf"),), contagens):
+                    acumulado += contagem
+                    le = "+Inf" if limite == float("inf") else repr(limite)
+                    linhas.append(f"{self.nome}_bucket{_labels(self.labels + ('le',), labels + (le,))} {acumulado}")
+                linhas.append(f"{self.nome}_sum{_labels(self.labels, labels)} {soma}")
+                linhas.append(f"{self.nome}_count{_labels(self.labels, labels)} {acumulado}")
+        return linhas
+
+
+class Gauge:
+    def __init__(self, nome: str, ajuda: str, labels=()):
+        self.nome, self.ajuda, self.labels = nome, ajuda, labels
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def inc(self, *labels, valor: float = 1):
+        with self._lock:
+            self._valores[labels] = self._valores.get(labels, 0) + valor
+
+    def dec(self, *labels, valor: float = 1):
+        self.inc(*labels, valor=-valor)
+
+    def value(self, *labels):
+        return self._valores.get(labels, 0)
+
+    def exposicao(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} gauge"]
+        with self._lock:
+            for labels, valor in sorted(self._valores.items()):
+                linhas.append(f"{self.nome}{_labels(self.labels, labels)} {valor}")
+        return linhas
+
+
+class Collected:
+    """Valor mantido em outro módulo e lido no momento da coleta."""
+
+    def __init__(self, nome: str, ajuda: str, leitura, tipo: str = "gauge"):
+        self.nome, self.ajuda, self.leitura, self.tipo = nome, ajuda, leitura, tipo
+
+    def exposicao(self):
+        return [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}", f"{self.nome} {self.leitura()}"]
+
+
+REQUESTS = Counter("http_requests_total", "Requisições atendidas.", ("method", "route", "status"))
+LATENCY = Histogram("http_request_duration_seconds", "Latência das requisições.", ("method", "route"))
+DB_TIME = Histogram("http_request_db_seconds", "Tempo gasto em instruções SQL por requisição.", ("method", "route"))
+DB_STATEMENTS = Histogram("http_request_db_statements", "Instruções SQL por requisição.", ("method", "route"), COUNT_BUCKETS)
+SERIALIZATION = Histogram("http_request_serialization_seconds", "Tempo entre o retorno do endpoint e o início da resposta (validação e serialização do response_model).", ("method", "route"))
+POOL_WAIT = Histogram("http_request_pool_wait_seconds", "Espera por conexão livre no pool por requisição.", ("method", "route"))
+SLOW_QUERIES = Counter("db_slow_queries_total", "Instruções acima de SLOW_QUERY_MS.")
+ADMISSION_IN_FLIGHT = Gauge("http_admission_in_flight", "Requisições admitidas em execução.", ("method", "route"))
+ADMISSION_QUEUE_DEPTH = Gauge("http_admission_queue_depth", "Requisições na fila de admissão.", ("method", "route"))
+ADMISSION_QUEUE_WAIT = Histogram("http_admission_queue_seconds", "Espera na fila de admissão das requisições admitidas.", ("method", "route"))
+ADMISSION_REJECTED = Counter("http_admission_rejected_total", "Requisições recusadas com 503 pelo controle de admissão.", ("method", "route", "reason"))
+
+METRICS = [
+    REQUESTS, LATENCY, DB_TIME, DB_STATEMENTS, SERIALIZATION, POOL_WAIT, SLOW_QUERIES,
+    ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT, ADMISSION_REJECTED,
+    Collected("entity_cache_hits_total", "Acertos do cache de entidades.", lambda: cache.backend.stats.hits, "counter"),
+    Collected("entity_cache_misses_total", "Faltas do cache de entidades.", lambda: cache.backend.stats.misses, "counter"),
+    Collected("entity_cache_evictions_total", "Entradas removidas do cache por limite de tamanho.", lambda: cache.backend.stats.evictions, "counter"),
+    Collected("entity_cache_entries", "Entradas no cache de entidades.", lambda: len(cache.backend)),
+    Collected("db_pool_size", "Conexões permanentes do pool (DB_POOL_SIZE).", lambda: database.pool_stats(database.engine_da_api(cria=False))["pool_size"]),
+    Collected("db_pool_checked_out", "Conexões em uso.", lambda: database.pool_stats(database.engine_da_api(cria=False))["checked_out"]),
+    Collected("db_pool_overflow", "Conexões abertas além de DB_POOL_SIZE.", lambda: database.pool_stats(database.engine_da_api(cria=False))["overflow"]),
+    Collected("db_pool_checkouts_total", "Checkouts de conexão.", lambda: database.pool_stats(database.engine_da_api(cria=False))["checkouts"], "counter"),
+    Collected("db_pool_wait_seconds_total", "Tempo total esperando por conexão livre.", lambda: database.pool_stats(database.engine_da_api(cria=False))["espera_total"], "counter"),
+    Collected("threadpool_size", "Threads disponíveis para código síncrono (THREADPOOL_SIZE).", lambda: anyio.to_thread.current_default_thread_limiter().total_tokens),
+    Collected("threadpool_in_use", "Threads ocupadas.", lambda: anyio.to_thread.current_default_thread_limiter().borrowed_tokens),
+]
+
+
+def exposicao():
+    linhas = []
+    for metrica in METRICS:
+        linhas.extend(metrica.exposicao())
+    return "\n".join(linhas) + "\n"
+
+
+# Hooks do SQLAlchemy
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("inicio_instrucao", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duracao = time.perf_counter() - conn.info["inicio_instrucao"].pop()
+
+    stats = _requisicao.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += duracao
+
+    if SLOW_QUERY_MS and duracao * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc()
+        slow_query_logger.warning("%.1f ms: %s", duracao * 1000, statement)
+
+
+def _espera_pool(segundos: float):
+    stats = _requisicao.get()
+    if stats is not None:
+        stats.pool_wait += segundos
+
+
+def instrumenta(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+database.pool_wait_listeners.append(_espera_pool)
+database.engine_listeners.append(instrumenta)
+
+
+# Integração com o FastAPI
+
+class InstrumentedRoute(APIRoute):
+    """Marca o momento em que o endpoint retorna; o tempo até o início da
+    resposta é o gasto validando e serializando o response_model."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def instrumentado(*args, **kw):
+                try:
+                    return await endpoint(*args, **kw)
+                finally:
+                    _marca_fim_endpoint()
+        else:
+            @functools.wraps(endpoint)
+            def instrumentado(*args, **kw):
+                try:
+                    return endpoint(*args, **kw)
+                finally:
+                    _marca_fim_endpoint()
+        super().__init__(path, instrumentado, **kwargs)
+
+
+def _marca_fim_endpoint():
+    stats = _requisicao.get()
+    if stats is not None:
+        stats.endpoint_fim = time.perf_counter()
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: abre as medições da requisição, envia o cabeçalho
+    Server-Timing e agrega os valores por rota ao final."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _requisicao.set(stats)
+        status_code = 500
+
+        async def send_com_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if stats.endpoint_fim is not None:
+                    stats.serializacao = time.perf_counter() - stats.endpoint_fim
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"server-timing", stats.server_timing().encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_com_timing)
+        finally:
+            _requisicao.reset(token)
+            rota = getattr(scope.get("route"), "path", "desconhecida")
+            metodo = scope["method"]
+            REQUESTS.inc(metodo, rota, status_code)
+            LATENCY.observe(time.perf_counter() - stats.inicio, metodo, rota)
+            DB_TIME.observe(stats.db_time, metodo, rota)
+            DB_STATEMENTS.observe(stats.statements, metodo, rota)
+            SERIALIZATION.observe(stats.serializacao, metodo, rota)
+            POOL_WAIT.observe(stats.pool_wait, metodo, rota)
\ No newline at end of file
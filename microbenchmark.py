@@ -0,0 +1,141 @@
+"""Micro-benchmark da serialização das leituras.
+
+Compara, em CPU por requisição e sem HTTP nem rede, o caminho anterior das
+leituras (entidades do ORM, response_model validado e serializado pelo
+FastAPI e json da stdlib no JSONResponse) com o atual (linhas só com as
+colunas do schema de leitura, serializadas direto com orjson). Antes de
+medir, confere que os dois caminhos produzem exatamente os mesmos bytes.
+
+Exemplos:
+    python microbenchmark.py
+    python microbenchmark.py --empresas 5000 --repeticoes 5000 --limit 1000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Union
+
+import orjson
+from alembic import command
+from alembic.config import Config
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import cache, models, repositories, schemas
+
+
+def _json_stdlib(conteudo) -> bytes:
+    # Mesmos parâmetros do JSONResponse do Starlette
+    return json.dumps(conteudo, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _response_model(tipo):
+    # O que o FastAPI faz com o retorno de uma rota com response_model:
+    # model_dump, validação contra o response_model e serialização em modo JSON
+    adapter = TypeAdapter(tipo)
+    return lambda modelo: _json_stdlib(adapter.dump_python(adapter.validate_python(modelo.model_dump()), mode="json"))
+
+
+_empresa = _response_model(schemas.EmpresaRead)
+_empresa_page = _response_model(Union[schemas.EmpresaComObrigacoesPage, schemas.EmpresaPage, schemas.EmpresaLookupResult])
+_obrigacao = _response_model(schemas.ObrigacaoAcessoriaRead)
+_obrigacao_page = _response_model(Union[schemas.ObrigacaoAcessoriaPage, schemas.ObrigacaoAcessoriaLookupResult])
+
+
+def _pagina_orm(db, model, limit: int):
+    itens = db.scalars(select(model).order_by(model.id).limit(limit + 1)).all()
+    return itens[:limit], (itens[limit - 1].id if len(itens) > limit else None)
+
+
+def cenarios(limit: int = 100):
+    """Rota -> (caminho anterior, caminho atual), funções de Session em bytes."""
+    return {
+        "GET /v1/empresas/{empresa_id}": (
+            lambda db: _empresa(schemas.EmpresaRead.model_validate(db.query(models.Empresa).filter(models.Empresa.id == 1).first())),
+            lambda db: orjson.dumps(repositories.get_empresa_linha(db, 1)),
+        ),
+        "GET /v1/empresas": (
+            lambda db: _empresa_page(schemas.EmpresaPage(**dict(zip(("itens", "proximo_cursor"), _pagina_orm(db, models.Empresa, limit))))),
+            lambda db: orjson.dumps(dict(zip(("itens", "proximo_cursor"), repositories.list_empresas(db, limit=limit)))),
+        ),
+        "GET /v1/obrigacaoAcessoria/{obrigacao_acessoria_id}": (
+            lambda db: _obrigacao(schemas.ObrigacaoAcessoriaRead.model_validate(db.query(models.ObrigacaoAcessoria).filter(models.ObrigacaoAcessoria.id == 1).first())),
+            lambda db: orjson.dumps(repositories.get_obrigacao_acessoria_linha(db, 1)),
+        ),
+        "GET /v1/obrigacaoAcessoria": (
+            lambda db: _obrigacao_page(schemas.ObrigacaoAcessoriaPage(**dict(zip(("itens", "proximo_cursor"), _pagina_orm(db, models.ObrigacaoAcessoria, limit))))),
+            lambda db: orjson.dumps(dict(zip(("itens", "proximo_cursor"), repositories.list_obrigacoes_acessorias(db, limit=limit)))),
+        ),
+    }
+
+
+def popula(db, empresas: int):
+    db.execute(insert(models.Empresa), [
+        {"nome": f"Empresa Ção {i}", "cnpj": f"{i:014d}", "endereco": "Rua Teste, 123", "email": f"empresa{i}@teste.com", "telefone": "11987654321"}
+        for i in range(1, empresas + 1)
+    ])
+    db.execute(insert(models.ObrigacaoAcessoria), [
+        {"nome": f"Obrigação {i}", "periodicidade": "Mensal", "periodicidade_meses": 1, "empresa_id": i, "dia_vencimento": 15, "mes_inicial": 1}
+        for i in range(1, empresas + 1)
+    ])
+    db.commit()
+
+
+def mede(SessionLocal, funcao, repeticoes: int) -> float:
+    """Microssegundos de CPU por requisição, com uma sessão por requisição como no get_db."""
+    inicio = time.process_time()
+    for _ in range(repeticoes):
+        db = SessionLocal()
+        try:
+            funcao(db)
+        finally:
+            db.close()
+    return (time.process_time() - inicio) / repeticoes * 1e6
+
+
+def cria_engine():
+    """Banco SQLite em memória com o esquema das migrações."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    config = Config()
+    config.set_main_option("script_location", raiz)
+    config.set_main_option("version_locations", os.path.join(raiz, "versions"))
+    with engine.connect() as conexao:
+        config.attributes["connection"] = conexao
+        command.upgrade(config, "head")
+        conexao.commit()
+    return engine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark da serialização das leituras")
+    parser.add_argument("--empresas", type=int, default=1000)
+    parser.add_argument("--repeticoes", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=100, help="Tamanho das páginas das listagens")
+    args = parser.parse_args(argv)
+
+    # Banco em memória e sem cache: mede só leitura e serialização
+    engine = cria_engine()
+    SessionLocal = sessionmaker(autoflush=False, bind=engine)
+    cache.backend = cache.NullCache()
+    with SessionLocal() as db:
+        popula(db, args.empresas)
+
+    print(f"{'rota':<52} {'antes (us)':>11} {'depois (us)':>12} {'economia':>9}")
+    for rota, (antes, depois) in cenarios(args.limit).items():
+        with SessionLocal() as db:
+            if antes(db) != depois(db):
+                print(f"{rota}: as saídas dos dois caminhos diferem", file=sys.stderr)
+                return 1
+        us_antes = mede(SessionLocal, antes, args.repeticoes)
+        us_depois = mede(SessionLocal, depois, args.repeticoes)
+        print(f"{rota:<52} {us_antes:>11.1f} {us_depois:>12.1f} {1 - us_depois / us_antes:>9.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -1,6 +1,6 @@
 from database import Base
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, Integer, ForeignKey, String
+from sqlalchemy import BigInteger, Column, DateTime, Integer, ForeignKey, String, func
 
 
 class Empresa(Base):
@@ -13,7 +13,18 @@ class Empresa(Base):
     email = Column(String)
     telefone = Column(String)
 
-    obrigacoes = relationship("ObrigacaoAcessoria", back_populates="empresa", cascade="all, delete-orphan") 
+    # Colunas de busca, preenchidas na gravação: nome minúsculo e sem
+    # acentos e CNPJ só com dígitos (índices trigram/prefixo na migração 003)
+    nome_normalizado = Column(String)
+    cnpj_digitos = Column(String)
+
+    # Versão da linha, incrementada a cada atualização: ETag forte nos GETs
+    # e controle otimista (If-Match) nos PUTs
+    versao = Column(Integer, nullable=False, default=1, server_default="1")
+
+    # passive_deletes: ao remover a empresa pelo ORM as obrigações não são
+    # carregadas; o ON DELETE CASCADE da foreign key as apaga no banco
+    obrigacoes = relationship("ObrigacaoAcessoria", back_populates="empresa", cascade="all, delete-orphan", passive_deletes=True) 
 
 
 class ObrigacaoAcessoria(Base):
@@ -22,6 +33,48 @@ class ObrigacaoAcessoria(Base):
     id = Column(Integer, primary_key=True, index=True)
     nome = Column(String)
     periodicidade = Column(String)
-    empresa_id = Column(Integer, ForeignKey("empresas.id"))
+    empresa_id = Column(Integer, ForeignKey("empresas.id", ondelete="CASCADE"), index=True)
+
+    # Calendário de vencimentos: periodicidade normalizada em meses, dia do
+    # vencimento e um mês (1-12) em que há ocorrência; as demais se repetem
+    # a cada periodicidade_meses a partir dele
+    periodicidade_meses = Column(Integer)
+    dia_vencimento = Column(Integer)
+    mes_inicial = Column(Integer)
+
+    versao = Column(Integer, nullable=False, default=1, server_default="1")
 
     empresa = relationship("Empresa", back_populates="obrigacoes") 
+
+
+# Contagens de obrigações por empresa e periodicidade e totais gerais (em
+# fatias), mantidas pelas escritas de repositories.py; ver relatorios.py
+class ResumoObrigacoes(Base):
+    __tablename__ = "resumo_obrigacoes"
+
+    empresa_id = Column(Integer, ForeignKey("empresas.id", ondelete="CASCADE"), primary_key=True, autoincrement=False)
+    periodicidade = Column(String, primary_key=True)
+    quantidade = Column(Integer, nullable=False, default=0)
+
+
+class TotalObrigacoes(Base):
+    __tablename__ = "totais_obrigacoes"
+
+    fatia = Column(Integer, primary_key=True, autoincrement=False)
+    periodicidade = Column(String, primary_key=True)
+    quantidade = Column(Integer, nullable=False, default=0)
+
+
+# Outbox do feed de mudanças: uma linha por entidade escrita, gravada na
+# mesma transação da escrita; `seq` é a posição no feed (ver mudancas.py)
+class Mudanca(Base):
+    __tablename__ = "mudancas"
+    # Sem AUTOINCREMENT o SQLite pode reaproveitar o maior id removido
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    entidade = Column(String, nullable=False)
+    entidade_id = Column(Integer, nullable=False)
+    operacao = Column(String, nullable=False)
+    versao = Column(Integer)
+    criada_em = Column(DateTime, nullable=False, server_default=func.now())
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""Feed de mudanças de empresas e obrigações acessórias.
+
+Cada escrita de repositories.py grava, na mesma transação, uma linha por
+entidade afetada na tabela `mudancas` (o outbox). O `seq` dessas linhas
+cresce na ordem dos commits: no Postgres a gravação no outbox é a última
+instrução da transação e fica atrás de um advisory lock, então quem já leu
+até o `seq` N nunca recebe depois uma mudança com `seq` menor.
+
+`GET /v1/changes` entrega o feed por long-polling ou Server-Sent Events.
+Os assinantes de um processo compartilham um único leitor (`Difusor`): uma
+consulta ao outbox por intervalo, e não uma por cliente, com as mudanças
+recentes guardadas em memória.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Intervalo, em segundos, entre as leituras do outbox enquanto há assinantes
+MUDANCAS_INTERVALO = float(os.getenv("MUDANCAS_INTERVALO", "0.25"))
+# Mudanças recentes guardadas em memória pelo leitor compartilhado
+MUDANCAS_BUFFER = int(os.getenv("MUDANCAS_BUFFER", "10000"))
+# Segundos sem assinantes até o leitor parar
+MUDANCAS_OCIOSO = float(os.getenv("MUDANCAS_OCIOSO", "30"))
+# Linhas por leitura do outbox
+MUDANCAS_LOTE = 1000
+
+# Chave do advisory lock que ordena as gravações no outbox (Postgres)
+CHAVE_LOCK = 0x6D756461
+
+CRIADA = "criada"
+ATUALIZADA = "atualizada"
+REMOVIDA = "removida"
+
+
+def linhas(entidade: str, operacao: str, itens) -> list:
+    """Linhas do outbox para os pares (id, versao) de uma entidade."""
+    return [{"entidade": entidade, "entidade_id": id, "operacao": operacao, "versao": versao} for id, versao in itens]
+
+
+class Difusor:
+    """Leitor do outbox compartilhado pelos assinantes de um processo.
+
+    `le(since, limite)` devolve as mudanças com `seq` maior que `since`, em
+    ordem; `ultimo()` devolve o maior `seq` gravado. As duas são corrotinas
+    e abrem a própria sessão. O leitor só roda enquanto há assinantes (e por
+    mais `ocioso` segundos depois do último).
+    """
+
+    def __init__(self, le, ultimo, intervalo: float = MUDANCAS_INTERVALO, capacidade: int = MUDANCAS_BUFFER, ocioso: float = MUDANCAS_OCIOSO):
+        self._le = le
+        self._ultimo_seq = ultimo
+        self.intervalo = intervalo
+        self.ocioso = ocioso
+        self.assinantes = 0
+        self.leituras = 0
+        self._recentes = deque(maxlen=capacidade)
+        # _recentes tem todas as mudanças com seq em (_base, _ultimo]
+        self._base = None
+        self._ultimo = None
+        self._pronto = None
+        self._novas = None
+        self._tarefa = None
+        self._ultimo_uso = 0.0
+
+    def _garante_leitor(self):
+        if self._tarefa is None or self._tarefa.done():
+            self._pronto = asyncio.Event()
+            self._novas = asyncio.Event()
+            self._tarefa = asyncio.create_task(self._executa())
+
+    def _ativo(self):
+        return self.assinantes > 0 or time.monotonic() - self._ultimo_uso < self.ocioso
+
+    async def _executa(self):
+        try:
+            while self._ativo():
+                try:
+                    if self._ultimo is None:
+                        self._base = self._ultimo = await self._ultimo_seq()
+                        self._pronto.set()
+                    else:
+                        await self._le_novas()
+                except Exception:
+                    logger.exception("Falha ao ler o feed de mudanças")
+                await asyncio.sleep(self.intervalo)
+        finally:
+            self._recentes.clear()
+            self._base = self._ultimo = None
+
+    async def _le_novas(self):
+        while True:
+            novas = await self._le(self._ultimo, MUDANCAS_LOTE)
+            self.leituras += 1
+            if not novas:
+                return
+            self._recentes.extend(novas)
+            if len(self._recentes) == self._recentes.maxlen:
+                # As mais antigas saíram da memória
+                self._base = max(self._base, self._recentes[0]["seq"] - 1)
+            self._ultimo = novas[-1]["seq"]
+            # Acorda quem espera e arma o evento da próxima leitura
+            self._novas.set()
+            self._novas = asyncio.Event()
+            if len(novas) < MUDANCAS_LOTE:
+                return
+
+    def _depois_de(self, since: int, limite: int):
+        itens = []
+        for mudanca in reversed(self._recentes):
+            if mudanca["seq"] <= since:
+                break
+            itens.append(mudanca)
+        itens.reverse()
+        return itens[:limite]
+
+    async def espera(self, since: int, limite: int, timeout: float) -> list:
+        """Mudanças com `seq` maior que `since` (no máximo `limite`). Sem
+        nenhuma, espera até `timeout` segundos pela próxima leitura que
+        trouxer alguma; no fim do prazo devolve uma lista vazia."""
+        self.assinantes += 1
+        try:
+            self._garante_leitor()
+            prazo = time.monotonic() + timeout
+            try:
+                await asyncio.wait_for(self._pronto.wait(), timeout)
+            except asyncio.TimeoutError:
+                # Leitor ainda iniciando: responde direto do outbox
+                return await self._le(since, limite)
+
+            while True:
+                if since < self._base:
+                    # Anterior ao que está em memória: lê direto do outbox
+                    antigas = await self._le(since, limite)
+                    if antigas:
+                        return antigas
+                    since = self._base
+                itens = self._depois_de(since, limite)
+                if itens:
+                    return itens
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    return []
+                try:
+                    await asyncio.wait_for(self._novas.wait(), restante)
+                except asyncio.TimeoutError:
+                    return []
+        finally:
+            self.assinantes -= 1
+            self._ultimo_uso = time.monotonic()
+
+    async def para(self):
+        if self._tarefa is not None and not self._tarefa.done():
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+        self._tarefa = None
\ No newline at end of file
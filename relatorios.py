@@ -0,0 +1,62 @@
+"""Resumo das obrigações acessórias por empresa e periodicidade.
+
+As contagens ficam em `resumo_obrigacoes` (uma linha por empresa e
+periodicidade) e em `totais_obrigacoes` (os totais gerais, divididos em
+FATIAS_TOTAIS linhas por periodicidade para que escritas de empresas
+diferentes não disputem a mesma linha). As escritas de repositories.py
+ajustam as duas tabelas na mesma transação da obrigação; esta linha de
+comando reconstrói ambas a partir de `obrigacoes_acessorias` para corrigir
+divergências.
+
+Exemplos:
+    python relatorios.py
+    python relatorios.py --database-url sqlite:///./dev.db
+"""
+import argparse
+import os
+import sys
+from collections import Counter
+
+
+FATIAS_TOTAIS = 16
+
+
+def fatia(empresa_id: int) -> int:
+    return empresa_id % FATIAS_TOTAIS
+
+
+def chave_periodicidade(periodicidade) -> str:
+    # Obrigações antigas podem não ter periodicidade (a coluna aceita nulos)
+    return periodicidade or ""
+
+
+def deltas(linhas, sinal: int = 1) -> Counter:
+    """Variação das contagens por (empresa_id, periodicidade) para as linhas
+    (mapeamentos com empresa_id e periodicidade) inseridas ou removidas."""
+    resultado = Counter()
+    for linha in linhas:
+        if linha["empresa_id"] is not None:
+            resultado[(linha["empresa_id"], chave_periodicidade(linha["periodicidade"]))] += sinal
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconstrói o resumo das obrigações acessórias por empresa e periodicidade")
+    parser.add_argument("--database-url", help="URL do banco (padrão: DATABASE_URL / variáveis DB_* do .env)")
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    import database, repositories
+
+    db = database.SessionLocal()
+    try:
+        linhas = repositories.reconstroi_resumo_obrigacoes(db)
+    finally:
+        db.close()
+    print(f"Resumo reconstruído: {linhas} linhas (empresa x periodicidade)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
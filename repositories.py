@@ -1,11 +1,302 @@
+import busca, cache, mudancas, relatorios, vencimentos
 import models, schemas
-from sqlalchemy.orm import Session
+from collections import Counter
+from datetime import date
+from typing import List, Optional
+from sqlalchemy import case, delete, func, insert, or_, select, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+
+
+# Quantidade de linhas por INSERT multi-linha nas cargas em lote
+BULK_CHUNK_SIZE = 1000
+
+# Quantidade de linhas lidas por vez do cursor no servidor nas listagens em streaming
+STREAM_YIELD_PER = 1000
+
+
+def _colunas(model, schema):
+    # Colunas na ordem dos campos do schema de leitura: dict(linha) tem as
+    # mesmas chaves, na mesma ordem, que schema.model_dump() e pode ser
+    # serializado direto, sem entidade do ORM nem nova validação
+    return [model.__table__.c[campo] for campo in schema.model_fields]
+
+
+def _pagina(db: Session, stmt, model, cursor: Optional[int], limit: int, linhas: bool = False):
+    # Paginação por keyset: a página seguinte começa depois do último id
+    # retornado, então o custo não cresce com a profundidade (sem OFFSET)
+    if cursor is not None:
+        stmt = stmt.where(model.id > cursor)
+    stmt = stmt.order_by(model.id).limit(limit + 1)
+    if linhas:
+        itens = [dict(linha) for linha in db.execute(stmt).mappings()]
+        proximo_cursor = itens[limit - 1]["id"] if len(itens) > limit else None
+    else:
+        itens = db.scalars(stmt).all()
+        proximo_cursor = itens[limit - 1].id if len(itens) > limit else None
+    return itens[:limit], proximo_cursor
+
+
+def _stream(db: Session, stmt, model, yield_per: int, linhas: bool = False):
+    # Lê a tabela em blocos com cursor no servidor (yield_per), sem
+    # carregar o resultado inteiro na memória
+    stmt = stmt.order_by(model.id).execution_options(yield_per=yield_per)
+    resultado = db.execute(stmt).mappings() if linhas else db.scalars(stmt)
+    yield from resultado.partitions()
+
+
+def _preenche_cache(db: Session) -> bool:
+    # Linhas lidas de uma réplica podem estar atrasadas: não entram no cache,
+    # que também atende as leituras do primário (inclusive as de quem acabou
+    # de escrever e está preso ao primário)
+    return cache.backend.enabled and "replica" not in db.info
+
+
+def _get_linha(db: Session, model, entidade: str, id: int, colunas: list):
+    # Leitura por id via cache, devolvendo o dict no formato do schema de
+    # leitura (o mesmo guardado no cache)
+    chave = cache.chave(entidade, id)
+    valor = cache.backend.get(chave)
+    if valor is not None:
+        return valor
+
+    linha = db.execute(select(*colunas).where(model.id == id)).mappings().first()
+    if linha is None:
+        return None
+    valor = dict(linha)
+    if _preenche_cache(db):
+        # Só grava se a chave estiver vazia: uma escrita que invalidou a
+        # entrada depois deste SELECT não tem a linha antiga regravada
+        cache.backend.add(chave, valor)
+    return valor
+
+
+class VersaoDivergente(Exception):
+    """A linha existe, mas não está mais em nenhuma das versões esperadas
+    (If-Match de uma atualização concorrente)."""
+
+    def __init__(self, versao_atual: int):
+        super().__init__(f"Versão atual: {versao_atual}")
+        self.versao_atual = versao_atual
+
+
+def _confere_versao(entidade, versoes: Optional[List[int]]):
+    if entidade is not None and versoes is not None and entidade.versao not in versoes:
+        raise VersaoDivergente(entidade.versao)
+    return entidade
+
+
+def _versao(db: Session, model, entidade: str, id: int):
+    # Só a versão, para responder 304 sem carregar a entidade: vem do cache
+    # quando ela está lá ou de um SELECT de uma coluna pela chave primária.
+    # Como as leituras só preenchem chaves vazias (`add`), a entrada nunca é
+    # anterior à última invalidação feita por uma escrita
+    valor = cache.backend.get(cache.chave(entidade, id))
+    if valor is not None and "versao" in valor:
+        return valor["versao"]
+    return db.scalar(select(model.versao).where(model.id == id))
+
+
+def _update_returning(db: Session, model, id: int, valores: dict, schema, versoes: Optional[List[int]] = None, antes_do_commit=None):
+    # UPDATE ... RETURNING com apenas os campos enviados: uma instrução e uma
+    # transação, sem carregar a linha antes nem dar refresh depois. Cada
+    # atualização incrementa a versão; com `versoes` (If-Match) a linha só é
+    # atualizada se ainda estiver em uma delas. `antes_do_commit` recebe a
+    # linha atualizada, dentro da mesma transação
+    stmt = update(model).where(model.id == id)
+    if versoes is not None:
+        stmt = stmt.where(model.versao.in_(versoes))
+    stmt = (
+        stmt
+        .values(**valores, versao=model.versao + 1)
+        .returning(*model.__table__.c)
+        .execution_options(synchronize_session=False)
+    )
+    linha = db.execute(stmt).mappings().one_or_none()
+    if linha is not None and antes_do_commit is not None:
+        antes_do_commit(linha)
+    db.commit()
+    if linha is None and versoes is not None:
+        _confere_versao(db.scalars(select(model).where(model.id == id)).first(), versoes)
+    return schema(**linha) if linha is not None else None
+
+
+def _get_many(db: Session, model, entidade: str, ids: List[int], schema):
+    # Multi-get: primeiro o cache, depois um único SELECT ... WHERE id IN (...)
+    # com as faltas. Devolve uma entrada por id, na ordem recebida, com None
+    # para os ids inexistentes
+    chaves = {id: cache.chave(entidade, id) for id in ids}
+    cacheados = cache.backend.get_many(chaves.values())
+    encontrados = {id: schema(**cacheados[chave]) for id, chave in chaves.items() if chave in cacheados}
+
+    faltantes = [id for id in chaves if id not in encontrados]
+    if faltantes:
+        stmt = select(*_colunas(model, schema)).where(model.id.in_(faltantes))
+        lidos = {linha["id"]: schema(**linha) for linha in db.execute(stmt).mappings()}
+        if _preenche_cache(db):
+            cache.backend.add_many({chaves[id]: item.model_dump() for id, item in lidos.items()})
+        encontrados.update(lidos)
+
+    return [encontrados.get(id) for id in ids]
+
+
+def _chunks(itens: list, tamanho: int):
+    for inicio in range(0, len(itens), tamanho):
+        yield inicio, itens[inicio:inicio + tamanho]
+
+
+def _insert_linha_a_linha(db: Session, model, pendentes: dict, resultados: dict, antes_do_commit=None):
+    # Fallback quando o INSERT multi-linha viola alguma restrição: cada linha
+    # roda em um SAVEPOINT para que só as linhas inválidas sejam descartadas
+    inseridas = []
+    for indice, linha in pendentes.items():
+        try:
+            with db.begin_nested():
+                id = db.execute(insert(model).values(**linha).returning(model.id)).scalar_one()
+            resultados[indice] = schemas.BulkItemResult(indice=indice, id=id)
+            inseridas.append({**linha, "id": id})
+        except IntegrityError as exc:
+            resultados[indice] = schemas.BulkItemResult(indice=indice, erro=str(exc.orig))
+    if antes_do_commit is not None:
+        antes_do_commit(inseridas)
+    db.commit()
+
+
+def _registra_mudancas(db: Session, entidade: str, operacao: str, itens):
+    # Grava no outbox os pares (id, versao) escritos pela transação; deve ser
+    # a última instrução antes do commit. No Postgres o advisory lock, solto
+    # no commit, serializa só este trecho final das transações: os `seq`
+    # ficam visíveis na ordem em que foram gerados e o feed não pula as
+    # mudanças de uma transação mais lenta
+    linhas = mudancas.linhas(entidade, operacao, itens)
+    if not linhas:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(select(func.pg_advisory_xact_lock(mudancas.CHAVE_LOCK)))
+    db.execute(insert(models.Mudanca), linhas)
+
+
+def _incrementa(db: Session, model, chaves: List[str], linhas: List[dict]):
+    # Soma `quantidade` às linhas de contagem, criando as que faltam:
+    # INSERT ... ON CONFLICT DO UPDATE quando o banco suporta
+    dialeto = db.get_bind().dialect.name
+    if dialeto in ("postgresql", "sqlite"):
+        stmt = (postgresql if dialeto == "postgresql" else sqlite).insert(model).values(linhas)
+        db.execute(stmt.on_conflict_do_update(index_elements=chaves, set_={"quantidade": model.quantidade + stmt.excluded.quantidade}))
+        return
+    for linha in linhas:
+        filtro = [getattr(model, chave) == linha[chave] for chave in chaves]
+        if db.execute(update(model).where(*filtro).values(quantidade=model.quantidade + linha["quantidade"])).rowcount == 0:
+            db.execute(insert(model).values(**linha))
+
+
+def _aplica_resumo(db: Session, deltas: Counter):
+    # Ajusta o resumo por empresa e os totais na transação corrente. As
+    # linhas vão ordenadas pela chave para que transações concorrentes as
+    # travem sempre na mesma ordem
+    deltas = sorted((chave, n) for chave, n in deltas.items() if n)
+    if not deltas:
+        return
+    _incrementa(db, models.ResumoObrigacoes, ["empresa_id", "periodicidade"], [
+        {"empresa_id": empresa_id, "periodicidade": periodicidade, "quantidade": n} for (empresa_id, periodicidade), n in deltas
+    ])
+    totais = Counter()
+    for (empresa_id, periodicidade), n in deltas:
+        totais[(relatorios.fatia(empresa_id), periodicidade)] += n
+    _incrementa(db, models.TotalObrigacoes, ["fatia", "periodicidade"], [
+        {"fatia": fatia, "periodicidade": periodicidade, "quantidade": n} for (fatia, periodicidade), n in sorted(totais.items()) if n
+    ])
 
 
 # Empresas
 
+COLUNAS_EMPRESA = _colunas(models.Empresa, schemas.EmpresaRead)
+
+
+def get_empresa_linha(db: Session, empresa_id: int):
+    return _get_linha(db, models.Empresa, "empresa", empresa_id, COLUNAS_EMPRESA)
+
+
 def get_empresa(db: Session, empresa_id: int):
-    return db.query(models.Empresa).filter(models.Empresa.id == empresa_id).first()
+    valor = get_empresa_linha(db, empresa_id)
+    return schemas.EmpresaRead(**valor) if valor is not None else None
+
+
+def get_empresas(db: Session, empresa_ids: List[int]):
+    return _get_many(db, models.Empresa, "empresa", empresa_ids, schemas.EmpresaRead)
+
+
+def get_empresas_por_cnpj(db: Session, cnpjs: List[str]):
+    # O cache é indexado por id, então a busca por CNPJ vai sempre ao banco
+    # (um SELECT pelo índice único de cnpj, só com as colunas do schema de
+    # leitura) e aproveita para preencher o cache
+    stmt = select(*COLUNAS_EMPRESA).where(models.Empresa.cnpj.in_(set(cnpjs)))
+    lidos = {linha["cnpj"]: schemas.EmpresaRead(**linha) for linha in db.execute(stmt).mappings()}
+    if lidos and _preenche_cache(db):
+        cache.backend.add_many({cache.chave("empresa", empresa.id): empresa.model_dump() for empresa in lidos.values()})
+    return [lidos.get(cnpj) for cnpj in cnpjs]
+
+
+def get_empresa_com_obrigacoes(db: Session, empresa_id: int):
+    # Não passa pelo cache, que guarda só as colunas da empresa
+    return db.scalars(_filtra_empresas(include_obrigacoes=True).where(models.Empresa.id == empresa_id)).first()
+
+
+def _filtra_empresas(cnpj: Optional[str] = None, include_obrigacoes: bool = False):
+    if include_obrigacoes:
+        # As obrigações de todas as empresas do resultado (ou de cada bloco do
+        # streaming) vêm em um único SELECT ... WHERE empresa_id IN (...),
+        # então o número de consultas não depende da quantidade de empresas
+        stmt = select(models.Empresa).options(selectinload(models.Empresa.obrigacoes))
+    else:
+        # Sem as obrigações bastam as colunas: linhas em vez de entidades
+        stmt = select(*COLUNAS_EMPRESA)
+    if cnpj is not None:
+        stmt = stmt.where(models.Empresa.cnpj == cnpj)
+    return stmt
+
+
+def list_empresas(db: Session, cnpj: Optional[str] = None, cursor: Optional[int] = None, limit: int = 100, include_obrigacoes: bool = False):
+    return _pagina(db, _filtra_empresas(cnpj, include_obrigacoes), models.Empresa, cursor, limit, linhas=not include_obrigacoes)
+
+
+def stream_empresas(db: Session, cnpj: Optional[str] = None, yield_per: int = STREAM_YIELD_PER, include_obrigacoes: bool = False):
+    return _stream(db, _filtra_empresas(cnpj, include_obrigacoes), models.Empresa, yield_per, linhas=not include_obrigacoes)
+
+
+def search_empresas(db: Session, q: str, limit: int = 20):
+    if db.get_bind().dialect.name != "postgresql":
+        # Fora do Postgres a busca usa o índice de n-gramas em memória e
+        # lê as empresas encontradas em uma única consulta
+        return [empresa for empresa in get_empresas(db, busca.indice(db).busca(q, limit)) if empresa is not None]
+
+    empresa = models.Empresa
+    campo, termo = busca.classifica(q)
+    if not termo:
+        return []
+    if campo == "cnpj":
+        stmt = select(empresa).where(empresa.cnpj_digitos.startswith(termo)).order_by(empresa.cnpj_digitos, empresa.id)
+    elif campo == "email":
+        stmt = select(empresa).where(func.lower(empresa.email).startswith(termo, autoescape=True)).order_by(func.lower(empresa.email), empresa.id)
+    else:
+        # O operador % do pg_trgm e o LIKE '%termo%' usam o índice GIN de
+        # trigramas; o ranking põe primeiro os nomes que começam pelo termo
+        stmt = (
+            select(empresa)
+            .where(or_(empresa.nome_normalizado.bool_op("%")(termo), empresa.nome_normalizado.contains(termo, autoescape=True)))
+            .order_by(empresa.nome_normalizado.startswith(termo, autoescape=True).desc(), func.similarity(empresa.nome_normalizado, termo).desc(), empresa.id)
+        )
+    return db.scalars(stmt.limit(limit)).all()
+
+
+def _normaliza_busca(valores: dict):
+    # As colunas de busca acompanham sempre nome e cnpj
+    if "nome" in valores:
+        valores["nome_normalizado"] = busca.normaliza_nome(valores["nome"])
+    if "cnpj" in valores:
+        valores["cnpj_digitos"] = busca.digitos(valores["cnpj"])
+    return valores
 
 
 def create_empresa(db: Session, empresa: schemas.Empresa):
@@ -13,67 +304,452 @@ def create_empresa(db: Session, empresa: schemas.Empresa):
                              cnpj = empresa.cnpj,
                              endereco = empresa.endereco,
                              email = empresa.email,
-                             telefone = empresa.telefone)
+                             telefone = empresa.telefone,
+                             nome_normalizado = busca.normaliza_nome(empresa.nome),
+                             cnpj_digitos = busca.digitos(empresa.cnpj))
     db.add(db_empresa)
+    db.flush()
+    _registra_mudancas(db, "empresa", mudancas.CRIADA, [(db_empresa.id, db_empresa.versao)])
     db.commit()
     db.refresh(db_empresa)
+    cache.backend.delete(cache.chave("empresa", db_empresa.id))
+    busca.atualiza(db, db_empresa)
     return db_empresa
 
 
+def _insert_empresas_ignorando_conflito(db: Session):
+    # INSERT ... ON CONFLICT (cnpj) DO NOTHING nos bancos que suportam
+    dialeto = db.get_bind().dialect.name
+    if dialeto == "postgresql":
+        return postgresql.insert(models.Empresa).on_conflict_do_nothing(index_elements=["cnpj"])
+    if dialeto == "sqlite":
+        return sqlite.insert(models.Empresa).on_conflict_do_nothing(index_elements=["cnpj"])
+    return None
+
+
+def bulk_create_empresas(db: Session, empresas: List[schemas.Empresa], chunk_size: int = BULK_CHUNK_SIZE):
+    resultados = {}
+    vistos = set()
+
+    for inicio, lote in _chunks(empresas, chunk_size):
+        pendentes = {}
+        for deslocamento, empresa in enumerate(lote):
+            indice = inicio + deslocamento
+            if empresa.cnpj in vistos:
+                resultados[indice] = schemas.BulkItemResult(indice=indice, erro="CNPJ duplicado no lote")
+            else:
+                vistos.add(empresa.cnpj)
+                pendentes[indice] = _normaliza_busca(empresa.model_dump())
+
+        stmt = _insert_empresas_ignorando_conflito(db)
+        if stmt is None:
+            # Sem ON CONFLICT: descarta antes do INSERT os CNPJs que já existem
+            cnpjs = [linha["cnpj"] for linha in pendentes.values()]
+            existentes = set(db.scalars(select(models.Empresa.cnpj).where(models.Empresa.cnpj.in_(cnpjs))))
+            pendentes = {i: l for i, l in pendentes.items() if l["cnpj"] not in existentes}
+            stmt = insert(models.Empresa)
+
+        if pendentes:
+            try:
+                retorno = db.execute(stmt.values(list(pendentes.values())).returning(models.Empresa.id, models.Empresa.cnpj))
+                ids_por_cnpj = {cnpj: id for id, cnpj in retorno}
+                _registra_mudancas(db, "empresa", mudancas.CRIADA, [(id, 1) for id in ids_por_cnpj.values()])
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                _insert_linha_a_linha(db, models.Empresa, pendentes, resultados, lambda inseridas: _registra_mudancas(db, "empresa", mudancas.CRIADA, [(linha["id"], 1) for linha in inseridas]))
+                continue
+
+            for indice, linha in pendentes.items():
+                id = ids_por_cnpj.get(linha["cnpj"])
+                if id is not None:
+                    resultados[indice] = schemas.BulkItemResult(indice=indice, id=id)
+
+    # O que não voltou no RETURNING (ou foi descartado antes) já existia no banco
+    for indice in range(len(empresas)):
+        resultados.setdefault(indice, schemas.BulkItemResult(indice=indice, erro="CNPJ já cadastrado"))
+
+    inseridas = [r for r in resultados.values() if r.id is not None]
+    cache.backend.delete(*(cache.chave("empresa", r.id) for r in inseridas))
+    busca.atualiza(db, *(schemas.EmpresaRead(id=r.id, **empresas[r.indice].model_dump()) for r in inseridas))
+
+    return [resultados[indice] for indice in range(len(empresas))]
+
+
+def delete_empresas(db: Session, empresa_ids: List[int]):
+    # Um único DELETE para todas as empresas, sem carregá-las na sessão; as
+    # obrigações saem pelo ON DELETE CASCADE da foreign key. Com cache, elas
+    # são apagadas antes, na mesma transação, para que o RETURNING informe
+    # quais entradas invalidar. As empresas são travadas antes de apagar o
+    # resumo: uma obrigação nova para elas espera esta transação (e falha na
+    # foreign key) em vez de entrar no resumo depois da leitura
+    db.execute(select(models.Empresa.id).where(models.Empresa.id.in_(empresa_ids)).with_for_update())
+    resumo = db.execute(
+        delete(models.ResumoObrigacoes)
+        .where(models.ResumoObrigacoes.empresa_id.in_(empresa_ids))
+        .returning(models.ResumoObrigacoes.empresa_id, models.ResumoObrigacoes.periodicidade, models.ResumoObrigacoes.quantidade)
+    ).all()
+    totais = Counter()
+    for empresa_id, periodicidade, quantidade in resumo:
+        totais[(relatorios.fatia(empresa_id), periodicidade)] -= quantidade
+    totais = [{"fatia": f, "periodicidade": p, "quantidade": n} for (f, p), n in sorted(totais.items()) if n]
+    if totais:
+        _incrementa(db, models.TotalObrigacoes, ["fatia", "periodicidade"], totais)
+
+    obrigacao_ids = []
+    if cache.backend.enabled:
+        obrigacao_ids = db.execute(
+            delete(models.ObrigacaoAcessoria)
+            .where(models.ObrigacaoAcessoria.empresa_id.in_(empresa_ids))
+            .returning(models.ObrigacaoAcessoria.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+    removidos = db.execute(
+        delete(models.Empresa)
+        .where(models.Empresa.id.in_(empresa_ids))
+        .returning(models.Empresa.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    _registra_mudancas(db, "empresa", mudancas.REMOVIDA, [(id, None) for id in removidos])
+    db.commit()
+
+    if removidos:
+        cache.backend.delete(*(cache.chave("empresa", id) for id in removidos), *(cache.chave("obrigacao_acessoria", id) for id in obrigacao_ids))
+        busca.remove(db, *removidos)
+    return removidos
+
+
 def delete_empresa(db: Session, empresa_id: int):
-    return db.query(models.Empresa).filter(models.Empresa.id == empresa_id).delete()
+    return bool(delete_empresas(db, [empresa_id]))
 
 
+def versao_empresa(db: Session, empresa_id: int):
+    return _versao(db, models.Empresa, "empresa", empresa_id)
 
-def update_empresa(db: Session, update_empresa: models.Empresa, empresa_id: int):
-    empresa = get_empresa(db, empresa_id)
 
-    if empresa is not None:        
-        empresa.nome = update_empresa.nome if update_empresa.nome != None else empresa.nome
-        empresa.cnpj = update_empresa.cnpj if update_empresa.cnpj != None else empresa.cnpj
-        empresa.endereco = update_empresa.endereco if update_empresa.endereco != None else empresa.endereco
-        empresa.email = update_empresa.email if update_empresa.email != None else empresa.email
-        empresa.telefone = update_empresa.telefone if update_empresa.telefone != None else empresa.telefone
-        
-        db.commit()
-        db.refresh(empresa)        
-        return empresa
-    else:
-        return None
+def update_empresa(db: Session, update_empresa: schemas.EmpresaPatch, empresa_id: int, versoes: Optional[List[int]] = None):
+    # Campos ausentes ou nulos no patch mantêm o valor atual
+    valores = update_empresa.model_dump(exclude_unset=True, exclude_none=True)
+    if not valores:
+        return _confere_versao(get_empresa(db, empresa_id), versoes)
+
+    empresa = _update_returning(
+        db, models.Empresa, empresa_id, _normaliza_busca(valores), schemas.EmpresaRead, versoes,
+        lambda linha: _registra_mudancas(db, "empresa", mudancas.ATUALIZADA, [(linha["id"], linha["versao"])]),
+    )
+    if empresa is not None:
+        cache.backend.delete(cache.chave("empresa", empresa_id))
+        busca.atualiza(db, empresa)
+    return empresa
 
 
 # Obrigação Acessória
 
+COLUNAS_OBRIGACAO_ACESSORIA = _colunas(models.ObrigacaoAcessoria, schemas.ObrigacaoAcessoriaRead)
+
+
+def get_obrigacao_acessoria_linha(db: Session, obrigacao_acessoria_id: int):
+    return _get_linha(db, models.ObrigacaoAcessoria, "obrigacao_acessoria", obrigacao_acessoria_id, COLUNAS_OBRIGACAO_ACESSORIA)
+
+
 def get_obrigacao_acessoria(db: Session, obrigacao_acessoria_id: int):
-    return db.query(models.ObrigacaoAcessoria).filter(models.ObrigacaoAcessoria.id == obrigacao_acessoria_id).first()
+    valor = get_obrigacao_acessoria_linha(db, obrigacao_acessoria_id)
+    return schemas.ObrigacaoAcessoriaRead(**valor) if valor is not None else None
+
+
+def get_obrigacoes_acessorias(db: Session, obrigacao_acessoria_ids: List[int]):
+    return _get_many(db, models.ObrigacaoAcessoria, "obrigacao_acessoria", obrigacao_acessoria_ids, schemas.ObrigacaoAcessoriaRead)
+
+
+def _filtra_obrigacoes_acessorias(empresa_id: Optional[int] = None, periodicidade: Optional[str] = None):
+    stmt = select(*COLUNAS_OBRIGACAO_ACESSORIA)
+    if empresa_id is not None:
+        stmt = stmt.where(models.ObrigacaoAcessoria.empresa_id == empresa_id)
+    if periodicidade is not None:
+        stmt = stmt.where(models.ObrigacaoAcessoria.periodicidade == periodicidade)
+    return stmt
+
+
+def list_obrigacoes_acessorias(db: Session, empresa_id: Optional[int] = None, periodicidade: Optional[str] = None, cursor: Optional[int] = None, limit: int = 100):
+    return _pagina(db, _filtra_obrigacoes_acessorias(empresa_id, periodicidade), models.ObrigacaoAcessoria, cursor, limit, linhas=True)
+
+
+def stream_obrigacoes_acessorias(db: Session, empresa_id: Optional[int] = None, periodicidade: Optional[str] = None, yield_per: int = STREAM_YIELD_PER):
+    return _stream(db, _filtra_obrigacoes_acessorias(empresa_id, periodicidade), models.ObrigacaoAcessoria, yield_per, linhas=True)
+
+
+def _normaliza_periodicidade(valores: dict):
+    # periodicidade_meses acompanha sempre o texto da periodicidade
+    if "periodicidade" in valores:
+        valores["periodicidade_meses"] = vencimentos.periodicidade_meses(valores["periodicidade"])
+    return valores
 
 
 def create_obrigacao_acessoria(db: Session, obrigacao_acessoria: schemas.ObrigacaoAcessoria):
     db_obrigacao_acessoria = models.ObrigacaoAcessoria(nome = obrigacao_acessoria.nome,
                                            periodicidade = obrigacao_acessoria.periodicidade,
-                                           empresa_id = obrigacao_acessoria.empresa_id)
+                                           empresa_id = obrigacao_acessoria.empresa_id,
+                                           periodicidade_meses = vencimentos.periodicidade_meses(obrigacao_acessoria.periodicidade),
+                                           dia_vencimento = obrigacao_acessoria.dia_vencimento,
+                                           mes_inicial = obrigacao_acessoria.mes_inicial)
     db.add(db_obrigacao_acessoria)
+    try:
+        db.flush()
+    except IntegrityError:
+        # Empresa inexistente
+        db.rollback()
+        raise
+    _aplica_resumo(db, relatorios.deltas([obrigacao_acessoria.model_dump()]))
+    _registra_mudancas(db, "obrigacao_acessoria", mudancas.CRIADA, [(db_obrigacao_acessoria.id, db_obrigacao_acessoria.versao)])
     db.commit()
     db.refresh(db_obrigacao_acessoria)
+    cache.backend.delete(cache.chave("obrigacao_acessoria", db_obrigacao_acessoria.id))
 
     return db_obrigacao_acessoria
 
 
+def bulk_create_obrigacoes_acessorias(db: Session, obrigacoes_acessorias: List[schemas.ObrigacaoAcessoria], chunk_size: int = BULK_CHUNK_SIZE):
+    resultados = {}
+
+    for inicio, lote in _chunks(obrigacoes_acessorias, chunk_size):
+        # Uma consulta por lote para validar as empresas referenciadas
+        empresa_ids = {obrigacao.empresa_id for obrigacao in lote}
+        existentes = set(db.scalars(select(models.Empresa.id).where(models.Empresa.id.in_(empresa_ids))))
+
+        pendentes = {}
+        for deslocamento, obrigacao in enumerate(lote):
+            indice = inicio + deslocamento
+            if obrigacao.empresa_id not in existentes:
+                resultados[indice] = schemas.BulkItemResult(indice=indice, erro="Empresa não encontrada")
+            else:
+                pendentes[indice] = _normaliza_periodicidade(obrigacao.model_dump())
+
+        if not pendentes:
+            continue
+
+        try:
+            stmt = insert(models.ObrigacaoAcessoria).returning(models.ObrigacaoAcessoria.id, sort_by_parameter_order=True)
+            ids = db.scalars(stmt, list(pendentes.values())).all()
+            _aplica_resumo(db, relatorios.deltas(pendentes.values()))
+            _registra_mudancas(db, "obrigacao_acessoria", mudancas.CRIADA, [(id, 1) for id in ids])
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+
+            def antes_do_commit(inseridas):
+                _aplica_resumo(db, relatorios.deltas(inseridas))
+                _registra_mudancas(db, "obrigacao_acessoria", mudancas.CRIADA, [(linha["id"], 1) for linha in inseridas])
+
+            _insert_linha_a_linha(db, models.ObrigacaoAcessoria, pendentes, resultados, antes_do_commit)
+            continue
+
+        for indice, id in zip(pendentes, ids):
+            resultados[indice] = schemas.BulkItemResult(indice=indice, id=id)
+
+    cache.backend.delete(*(cache.chave("obrigacao_acessoria", r.id) for r in resultados.values() if r.id is not None))
+
+    return [resultados[indice] for indice in range(len(obrigacoes_acessorias))]
+
+
+def delete_obrigacoes_acessorias(db: Session, obrigacao_acessoria_ids: List[int]):
+    linhas = db.execute(
+        delete(models.ObrigacaoAcessoria)
+        .where(models.ObrigacaoAcessoria.id.in_(obrigacao_acessoria_ids))
+        .returning(models.ObrigacaoAcessoria.id, models.ObrigacaoAcessoria.empresa_id, models.ObrigacaoAcessoria.periodicidade)
+        .execution_options(synchronize_session=False)
+    ).mappings().all()
+    _aplica_resumo(db, relatorios.deltas(linhas, -1))
+    _registra_mudancas(db, "obrigacao_acessoria", mudancas.REMOVIDA, [(linha["id"], None) for linha in linhas])
+    db.commit()
+
+    removidos = [linha["id"] for linha in linhas]
+    if removidos:
+        cache.backend.delete(*(cache.chave("obrigacao_acessoria", id) for id in removidos))
+    return removidos
+
+
 def delete_obrigacao_acessoria(db: Session, obrigacao_acessoria_id: int):
-    return db.query(models.ObrigacaoAcessoria).filter(models.ObrigacaoAcessoria.id == obrigacao_acessoria_id).delete()
+    return bool(delete_obrigacoes_acessorias(db, [obrigacao_acessoria_id]))
+
+
+def versao_obrigacao_acessoria(db: Session, obrigacao_acessoria_id: int):
+    return _versao(db, models.ObrigacaoAcessoria, "obrigacao_acessoria", obrigacao_acessoria_id)
+
 
+def update_obrigacao_acessoria(db: Session, update_obrigacao_acessoria: schemas.ObrigacaoAcessoriaPatch, obrigacao_acessoria_id: int, versoes: Optional[List[int]] = None):
+    valores = update_obrigacao_acessoria.model_dump(exclude_unset=True, exclude_none=True)
+    if not valores:
+        return _confere_versao(get_obrigacao_acessoria(db, obrigacao_acessoria_id), versoes)
 
-def update_obrigacao_acessoria(db: Session, update_obrigacao_acessoria: models.ObrigacaoAcessoria, obrigacao_acessoria_id: int):
-    obrigacao_acessoria = get_obrigacao_acessoria(db, obrigacao_acessoria_id)
+    anterior = None
+    if "periodicidade" in valores:
+        # Mudança de periodicidade move a obrigação no resumo: a linha
+        # anterior é lida (e travada) antes do UPDATE
+        anterior = db.execute(
+            select(models.ObrigacaoAcessoria.empresa_id, models.ObrigacaoAcessoria.periodicidade)
+            .where(models.ObrigacaoAcessoria.id == obrigacao_acessoria_id)
+            .with_for_update()
+        ).mappings().first()
 
+    def antes_do_commit(linha):
+        if anterior is not None:
+            deltas = relatorios.deltas([linha])
+            deltas.update(relatorios.deltas([anterior], -1))
+            _aplica_resumo(db, deltas)
+        _registra_mudancas(db, "obrigacao_acessoria", mudancas.ATUALIZADA, [(linha["id"], linha["versao"])])
+
+    obrigacao_acessoria = _update_returning(db, models.ObrigacaoAcessoria, obrigacao_acessoria_id, _normaliza_periodicidade(valores), schemas.ObrigacaoAcessoriaRead, versoes, antes_do_commit)
     if obrigacao_acessoria is not None:
-        print(update_obrigacao_acessoria.nome)        
-        obrigacao_acessoria.nome = update_obrigacao_acessoria.nome if update_obrigacao_acessoria.nome != None else obrigacao_acessoria.nome
+        cache.backend.delete(cache.chave("obrigacao_acessoria", obrigacao_acessoria_id))
+    return obrigacao_acessoria
 
-        obrigacao_acessoria.periodicidade = update_obrigacao_acessoria.periodicidade if update_obrigacao_acessoria.periodicidade != None else obrigacao_acessoria.periodicidade
 
-        db.commit()
-        db.refresh(obrigacao_acessoria)        
-        return obrigacao_acessoria
-    else:
-        return None
\ No newline at end of file
+# Vencimentos
+
+def list_vencimentos(db: Session, de: date, ate: date, empresa_id: Optional[int] = None, cursor: Optional[str] = None, limit: int = 1000):
+    # As ocorrências são calculadas no banco, em uma única consulta: cada
+    # obrigação é cruzada com os meses da janela e só sobram os meses em que
+    # (mês - mes_inicial) é múltiplo de periodicidade_meses. O dia é limitado
+    # ao último dia do mês (dia 31 vence em 30/04, 28/02...)
+    obrigacao = models.ObrigacaoAcessoria
+    meses = vencimentos.meses(de, ate)
+    dia = case((obrigacao.dia_vencimento > meses.c.ultimo_dia, meses.c.ultimo_dia), else_=obrigacao.dia_vencimento)
+    stmt = (
+        select(obrigacao.id, obrigacao.empresa_id, obrigacao.nome, obrigacao.periodicidade, meses.c.indice, dia)
+        .select_from(obrigacao)
+        .join(meses, (meses.c.indice - (func.coalesce(obrigacao.mes_inicial, 1) - 1)) % obrigacao.periodicidade_meses == 0)
+        .where(obrigacao.dia_vencimento.is_not(None), dia.between(meses.c.dia_min, meses.c.dia_max))
+    )
+    if empresa_id is not None:
+        stmt = stmt.where(obrigacao.empresa_id == empresa_id)
+    if cursor is not None:
+        stmt = stmt.where(tuple_(meses.c.indice, dia, obrigacao.id) > tuple_(*vencimentos.le_cursor(cursor)))
+    linhas = db.execute(stmt.order_by(meses.c.indice, dia, obrigacao.id).limit(limit + 1)).all()
+
+    itens = [
+        schemas.Vencimento(obrigacao_acessoria_id=id, empresa_id=empresa_id, nome=nome, periodicidade=periodicidade, vencimento=vencimentos.data_vencimento(indice, dia))
+        for id, empresa_id, nome, periodicidade, indice, dia in linhas[:limit]
+    ]
+    proximo_cursor = vencimentos.formata_cursor(itens[-1].vencimento, itens[-1].obrigacao_acessoria_id) if len(linhas) > limit else None
+    return itens, proximo_cursor
+
+
+# Mudanças
+
+def list_mudancas(db: Session, since: int = 0, limit: int = mudancas.MUDANCAS_LOTE):
+    mudanca = models.Mudanca
+    stmt = select(*mudanca.__table__.c).where(mudanca.seq > since).order_by(mudanca.seq).limit(limit)
+    return [dict(linha) for linha in db.execute(stmt).mappings()]
+
+
+def ultima_mudanca(db: Session):
+    return db.scalar(select(func.coalesce(func.max(models.Mudanca.seq), 0)))
+
+
+# Relatórios
+
+def relatorio_obrigacoes(db: Session, empresa_id: Optional[int] = None, cursor: Optional[int] = None, limit: int = 100):
+    # Lido só das tabelas de resumo: os totais somam FATIAS_TOTAIS linhas por
+    # periodicidade e cada empresa custa as suas poucas linhas de resumo,
+    # independente de quantas obrigações tenha
+    resumo, total = models.ResumoObrigacoes, models.TotalObrigacoes
+    por_periodicidade = {
+        periodicidade: quantidade
+        for periodicidade, quantidade in db.execute(
+            select(total.periodicidade, func.sum(total.quantidade)).group_by(total.periodicidade).order_by(total.periodicidade)
+        ).all()
+        if quantidade
+    }
+
+    empresas = select(resumo.empresa_id).where(resumo.quantidade > 0).distinct().order_by(resumo.empresa_id)
+    if empresa_id is not None:
+        empresas = empresas.where(resumo.empresa_id == empresa_id)
+    if cursor is not None:
+        empresas = empresas.where(resumo.empresa_id > cursor)
+    ids = db.scalars(empresas.limit(limit + 1)).all()
+    proximo_cursor = ids[limit - 1] if len(ids) > limit else None
+    ids = ids[:limit]
+
+    itens = {id: schemas.ResumoEmpresaObrigacoes(empresa_id=id, total=0, por_periodicidade={}) for id in ids}
+    if ids:
+        linhas = db.execute(
+            select(resumo.empresa_id, resumo.periodicidade, resumo.quantidade)
+            .where(resumo.empresa_id.in_(ids), resumo.quantidade > 0)
+            .order_by(resumo.empresa_id, resumo.periodicidade)
+        ).all()
+        for id, periodicidade, quantidade in linhas:
+            itens[id].por_periodicidade[periodicidade] = quantidade
+            itens[id].total += quantidade
+
+    return schemas.RelatorioObrigacoes(
+        total=sum(por_periodicidade.values()),
+        por_periodicidade=por_periodicidade,
+        empresas=list(itens.values()),
+        proximo_cursor=proximo_cursor,
+    )
+
+
+def reconstroi_resumo_obrigacoes(db: Session):
+    # Recalcula o resumo e os totais a partir de obrigacoes_acessorias. No
+    # Postgres as tabelas ficam travadas contra escritas até o commit, para
+    # que nenhuma obrigação entre ou saia durante a contagem
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE obrigacoes_acessorias, resumo_obrigacoes, totais_obrigacoes IN EXCLUSIVE MODE"))
+    obrigacao, resumo, total = models.ObrigacaoAcessoria, models.ResumoObrigacoes, models.TotalObrigacoes
+    db.execute(delete(total))
+    db.execute(delete(resumo))
+
+    periodicidade = func.coalesce(obrigacao.periodicidade, "")
+    db.execute(insert(resumo).from_select(
+        ["empresa_id", "periodicidade", "quantidade"],
+        select(obrigacao.empresa_id, periodicidade, func.count())
+        .where(obrigacao.empresa_id.is_not(None))
+        .group_by(obrigacao.empresa_id, periodicidade),
+    ))
+    fatia = resumo.empresa_id % relatorios.FATIAS_TOTAIS
+    db.execute(insert(total).from_select(
+        ["fatia", "periodicidade", "quantidade"],
+        select(fatia, resumo.periodicidade, func.sum(resumo.quantidade)).group_by(fatia, resumo.periodicidade),
+    ))
+    linhas = db.scalar(select(func.count()).select_from(resumo))
+    db.commit()
+    return linhas
+
+
+# Exportação
+
+def _export_stmt(cursor: Optional[int] = None):
+    # Uma linha por obrigação, com LEFT JOIN para manter as empresas sem
+    # obrigações; a ordem por empresa permite retomar a partir de um id
+    empresa, obrigacao = models.Empresa, models.ObrigacaoAcessoria
+    stmt = (
+        select(
+            empresa.id.label("empresa_id"),
+            empresa.nome.label("empresa_nome"),
+            empresa.cnpj,
+            empresa.endereco,
+            empresa.email,
+            empresa.telefone,
+            obrigacao.id.label("obrigacao_acessoria_id"),
+            obrigacao.nome.label("obrigacao_acessoria_nome"),
+            obrigacao.periodicidade,
+            obrigacao.periodicidade_meses,
+            obrigacao.dia_vencimento,
+            obrigacao.mes_inicial,
+        )
+        .outerjoin(obrigacao, obrigacao.empresa_id == empresa.id)
+        .order_by(empresa.id, obrigacao.id)
+    )
+    if cursor is not None:
+        stmt = stmt.where(empresa.id > cursor)
+    return stmt
+
+
+def colunas_export():
+    return [(coluna.name, coluna.type.python_type) for coluna in _export_stmt().selected_columns]
+
+
+def stream_export(db: Session, cursor: Optional[int] = None, yield_per: int = STREAM_YIELD_PER):
+    resultado = db.execute(_export_stmt(cursor).execution_options(yield_per=yield_per))
+    for lote in resultado.partitions():
+        yield [tuple(linha) for linha in lote]
\ No newline at end of file
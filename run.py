@@ -1,4 +1,145 @@
+"""Inicia a API.
+
+    python run.py                        # desenvolvimento: um processo com reload
+    python run.py --producao             # WEB_WORKERS workers, sem reload
+    python run.py --producao --migra     # aplica as migrações antes de subir
+    python run.py --mede-partida         # mede a partida a frio de um worker
+
+Em produção, com o gunicorn instalado, o master importa a aplicação uma vez
+(preload) e faz fork dos workers uvicorn, que começam já com o código
+carregado; sem o gunicorn, o supervisor do uvicorn inicia os workers. Nos
+dois casos SIGHUP reinicia os workers um a um e SIGTERM espera as
+requisições em andamento por até WEB_GRACEFUL_TIMEOUT segundos. O
+balanceador deve mandar tráfego a um worker só depois de `GET /ready`.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
 import uvicorn
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS") or os.cpu_count() or 1)
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+# Recicla cada worker depois de N requisições (0 desliga; só com o gunicorn)
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+# Orçamento da partida a frio de um worker: do início do processo até o
+# primeiro `GET /ready` com sucesso (pool aquecido)
+PARTIDA_ORCAMENTO_MS = float(os.getenv("PARTIDA_ORCAMENTO_MS", "3000"))
+
+
+def migra():
+    # Em outro processo: o fileConfig do env.py desligaria os loggers daqui
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], check=True, cwd=raiz)
+
+
+def _gunicorn(workers: int):
+    from gunicorn.app.base import BaseApplication
+    import database
+    import main
+
+    class Aplicacao(BaseApplication):
+        def load_config(self):
+            opcoes = {
+                "bind": f"{WEB_HOST}:{WEB_PORT}",
+                "workers": workers,
+                "worker_class": "uvicorn.workers.UvicornWorker",
+                "preload_app": True,
+                "graceful_timeout": WEB_GRACEFUL_TIMEOUT,
+                "max_requests": WEB_MAX_REQUESTS,
+                "max_requests_jitter": WEB_MAX_REQUESTS // 10,
+                # As engines são criadas na primeira sessão; se o master
+                # tiver criado alguma, o worker não herda as conexões
+                "post_fork": lambda server, worker: database.descarta_engines(),
+            }
+            for chave, valor in opcoes.items():
+                self.cfg.set(chave, valor)
+
+        def load(self):
+            return main.app
+
+    Aplicacao().run()
+
+
+def producao(workers: int):
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        uvicorn.run("main:app", host=WEB_HOST, port=WEB_PORT, workers=workers, timeout_graceful_shutdown=WEB_GRACEFUL_TIMEOUT)
+    else:
+        _gunicorn(workers)
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def mede_partida(repeticoes: int = 3, limite: float = 30.0) -> list:
+    """Sobe `repeticoes` workers do zero, um de cada vez, e devolve quanto
+    cada um levou, em milissegundos, do início do processo até o primeiro
+    `GET /ready` com sucesso."""
+    import httpx
+
+    tempos = []
+    for _ in range(repeticoes):
+        porta = _porta_livre()
+        inicio = time.perf_counter()
+        processo = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(porta), "--log-level", "warning"],
+            env=os.environ.copy(),
+        )
+        try:
+            while True:
+                if time.perf_counter() - inicio > limite:
+                    raise RuntimeError(f"O worker não ficou pronto em {limite:.0f} segundos")
+                if processo.poll() is not None:
+                    raise RuntimeError(f"O worker terminou com código {processo.returncode}")
+                try:
+                    if httpx.get(f"http://127.0.0.1:{porta}/ready", timeout=limite).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+        finally:
+            processo.terminate()
+            processo.wait()
+    return tempos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inicia a API")
+    parser.add_argument("--producao", action="store_true", help="Vários workers, sem reload")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--migra", action="store_true", help="Aplica as migrações do Alembic antes de subir")
+    parser.add_argument("--mede-partida", action="store_true", help="Mede a partida a frio de um worker e compara com PARTIDA_ORCAMENTO_MS")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.mede_partida:
+        tempos = mede_partida(args.repeticoes)
+        print(f"partida a frio: mediana {statistics.median(tempos):.0f} ms, máxima {max(tempos):.0f} ms (orçamento {PARTIDA_ORCAMENTO_MS:.0f} ms)")
+        return 0 if max(tempos) <= PARTIDA_ORCAMENTO_MS else 1
+
+    if args.migra:
+        migra()
+    if args.producao:
+        producao(args.workers)
+    else:
+        uvicorn.run("main:app", host=WEB_HOST, port=WEB_PORT, reload=True)
+    return 0
+
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    sys.exit(main())
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, ConfigDict
-from typing import Optional
+from datetime import date, datetime
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Dict, List, Optional, Union
 
 
 class Empresa(BaseModel):
@@ -12,6 +13,7 @@ class Empresa(BaseModel):
 
 class EmpresaRead(Empresa):
     id : int
+    versao : int = 1
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -28,22 +30,170 @@ class EmpresaDelete(BaseModel):
     id : int
 
 
+class EmpresaPage(BaseModel):
+    itens : List[EmpresaRead]
+    proximo_cursor : Optional[int] = None
+
+
 class ObrigacaoAcessoria(BaseModel):
     nome : str
     periodicidade : str
     empresa_id : int
+    dia_vencimento : Optional[int] = Field(None, ge=1, le=31)
+    mes_inicial : Optional[int] = Field(None, ge=1, le=12)
 
 
 class ObrigacaoAcessoriaRead(ObrigacaoAcessoria):
     id : int
+    periodicidade_meses : Optional[int] = None
+    versao : int = 1
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class EmpresaComObrigacoesRead(EmpresaRead):
+    obrigacoes : List[ObrigacaoAcessoriaRead]
+
+
+class EmpresaComObrigacoesPage(BaseModel):
+    itens : List[EmpresaComObrigacoesRead]
+    proximo_cursor : Optional[int] = None
+
+
+class EmpresaLookup(BaseModel):
+    ids : Optional[List[int]] = None
+    cnpjs : Optional[List[str]] = None
+
+
+class EmpresaLookupItem(BaseModel):
+    chave : Union[int, str]
+    empresa : Optional[EmpresaRead] = None
+
+
+class EmpresaLookupResult(BaseModel):
+    itens : List[EmpresaLookupItem]
+    nao_encontrados : List[Union[int, str]]
+
+
+class ObrigacaoAcessoriaPage(BaseModel):
+    itens : List[ObrigacaoAcessoriaRead]
+    proximo_cursor : Optional[int] = None
+
+
+class ObrigacaoAcessoriaLookup(BaseModel):
+    ids : List[int]
+
+
+class ObrigacaoAcessoriaLookupItem(BaseModel):
+    chave : int
+    obrigacao_acessoria : Optional[ObrigacaoAcessoriaRead] = None
+
+
+class ObrigacaoAcessoriaLookupResult(BaseModel):
+    itens : List[ObrigacaoAcessoriaLookupItem]
+    nao_encontrados : List[int]
+
+
 class ObrigacaoAcessoriaPatch(BaseModel):
     nome : Optional[str] = None
     periodicidade : Optional[str] = None
+    dia_vencimento : Optional[int] = Field(None, ge=1, le=31)
+    mes_inicial : Optional[int] = Field(None, ge=1, le=12)
 
 
 class ObrigacaoAcessoriaDelete(BaseModel):
-    id : int
\ No newline at end of file
+    id : int
+
+
+class Vencimento(BaseModel):
+    obrigacao_acessoria_id : int
+    empresa_id : int
+    nome : str
+    periodicidade : str
+    vencimento : date
+
+
+class VencimentoPage(BaseModel):
+    itens : List[Vencimento]
+    proximo_cursor : Optional[str] = None
+
+
+class CacheStats(BaseModel):
+    backend : str
+    entradas : int
+    hits : int
+    misses : int
+    evictions : int
+    expirations : int
+
+
+class ReplicaStats(BaseModel):
+    url : str
+    saudavel : bool
+    atraso : float
+    checked_out : int
+    checkouts : int
+
+
+class PoolStats(BaseModel):
+    pool_size : int
+    max_overflow : int
+    checked_out : int
+    checked_in : int
+    overflow : int
+    checkouts : int
+    espera_total : float
+    espera_max : float
+    threadpool_size : int
+    threadpool_em_uso : int
+    replicas : List[ReplicaStats] = []
+
+
+class Prontidao(BaseModel):
+    status : str
+    conexoes : int
+    duracao_ms : float
+
+
+class BulkItemResult(BaseModel):
+    indice : int
+    id : Optional[int] = None
+    erro : Optional[str] = None
+
+
+class BulkResult(BaseModel):
+    inseridos : int
+    falhas : int
+    resultados : List[BulkItemResult]
+
+
+class BulkDeleteResult(BaseModel):
+    removidos : List[int]
+    nao_encontrados : List[int]
+
+
+class ResumoEmpresaObrigacoes(BaseModel):
+    empresa_id : int
+    total : int
+    por_periodicidade : Dict[str, int]
+
+
+class RelatorioObrigacoes(BaseModel):
+    total : int
+    por_periodicidade : Dict[str, int]
+    empresas : List[ResumoEmpresaObrigacoes]
+    proximo_cursor : Optional[int] = None
+
+
+class Mudanca(BaseModel):
+    seq : int
+    entidade : str
+    entidade_id : int
+    operacao : str
+    versao : Optional[int] = None
+    criada_em : datetime
+
+
+class MudancaPage(BaseModel):
+    itens : List[Mudanca]
+    proximo_cursor : int
\ No newline at end of file
@@ -0,0 +1,96 @@
+import asyncio
+import time
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI
+import admissao
+from admissao import ESCRITA, LEITURA, Limitador, Rejeitada
+
+def _prazo(segundos=5):
+    return time.monotonic() + segundos
+
+def test_fila_recebe_as_vagas_liberadas_em_ordem():
+    async def cenario():
+        limitador = Limitador(1, fila=5, labels=("GET", "/teste"))
+        await limitador.entra(LEITURA, _prazo())
+        ordem = []
+
+        async def requisicao(i):
+            await limitador.entra(LEITURA, _prazo())
+            ordem.append(i)
+            limitador.sai()
+
+        tarefas = [asyncio.create_task(requisicao(i)) for i in range(3)]
+        await asyncio.sleep(0)
+        assert limitador.na_fila == 3
+        limitador.sai()
+        await asyncio.gather(*tarefas)
+        return ordem, limitador.em_uso
+
+    assert asyncio.run(cenario()) == ([0, 1, 2], 0)
+
+def test_recusa_com_fila_cheia_e_com_prazo_vencido():
+    async def cenario():
+        limitador = Limitador(1, fila=1, labels=("GET", "/teste"))
+        await limitador.entra(LEITURA, _prazo())
+        na_fila = asyncio.create_task(limitador.entra(LEITURA, _prazo(0.01)))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejeitada) as cheia:
+            await limitador.entra(LEITURA, _prazo())
+        with pytest.raises(Rejeitada) as prazo:
+            await na_fila
+        return cheia.value.motivo, prazo.value.motivo, limitador.na_fila, limitador.em_uso
+
+    assert asyncio.run(cenario()) == ("fila_cheia", "prazo", 0, 1)
+
+def test_escritas_passam_na_frente_das_leituras():
+    async def cenario():
+        limitador = Limitador(1, fila=2, prioridade=ESCRITA)
+        await limitador.entra(ESCRITA, _prazo())
+        leituras = [asyncio.create_task(limitador.entra(LEITURA, _prazo())) for _ in range(2)]
+        await asyncio.sleep(0)
+        # Fila cheia: a escrita toma o lugar da última leitura
+        escrita = asyncio.create_task(limitador.entra(ESCRITA, _prazo()))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejeitada):
+            await leituras[1]
+        limitador.sai()
+        await escrita
+        return leituras[0].done()
+
+    assert asyncio.run(cenario()) is False
+
+def test_rota_recusa_com_503_e_retry_after(monkeypatch):
+    monkeypatch.setattr(admissao, "ADMISSAO_ESCRITA", 1)
+    monkeypatch.setattr(admissao, "ADMISSAO_FILA", 0)
+    liberada = asyncio.Event()
+
+    router = APIRouter(route_class=admissao.RotaAdmitida)
+
+    @router.post("/lenta")
+    async def lenta():
+        await liberada.wait()
+        return {"ok": True}
+
+    @router.get("/leitura")
+    async def leitura():
+        return {"ok": True}
+
+    app = FastAPI()
+    app.include_router(router)
+
+    async def cenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://teste") as cliente:
+            primeira = asyncio.create_task(cliente.post("/lenta"))
+            await asyncio.sleep(0.05)
+            recusada = await cliente.post("/lenta")
+            # Rota de leitura sem limite
+            leitura = await cliente.get("/leitura")
+            liberada.set()
+            return (await primeira).status_code, recusada, leitura.status_code
+
+    status, recusada, leitura = asyncio.run(cenario())
+    assert status == 200 and leitura == 200
+    assert recusada.status_code == 503
+    assert recusada.headers["Retry-After"] == "1"
+    assert admissao.metrics.ADMISSION_REJECTED.value("POST", "/lenta", "fila_cheia") == 1
@@ -0,0 +1,45 @@
+import asyncio
+from agrupamento import Agrupador
+
+def test_chamadas_concorrentes_viram_um_lote():
+    lotes = []
+
+    async def executa(itens):
+        lotes.append(list(itens))
+        return [item * 10 for item in itens]
+
+    async def cenario():
+        agrupador = Agrupador(executa, espera=0.01, lote_max=4)
+        return await asyncio.gather(*(agrupador.envia(i) for i in range(6)))
+
+    # Cada chamada recebe o próprio resultado; o lote fecha no tamanho
+    # máximo e o restante sai quando a espera termina
+    assert asyncio.run(cenario()) == [0, 10, 20, 30, 40, 50]
+    assert lotes == [[0, 1, 2, 3], [4, 5]]
+
+def test_falha_do_lote_chega_a_todas_as_chamadas():
+    async def executa(itens):
+        raise RuntimeError("banco fora do ar")
+
+    async def cenario():
+        agrupador = Agrupador(executa, espera=0.001, lote_max=10)
+        return await asyncio.gather(agrupador.envia(1), agrupador.envia(2), return_exceptions=True)
+
+    assert [str(erro) for erro in asyncio.run(cenario())] == ["banco fora do ar"] * 2
+
+def test_encerra_grava_os_pendentes():
+    gravados = []
+
+    async def executa(itens):
+        gravados.extend(itens)
+        return itens
+
+    async def cenario():
+        agrupador = Agrupador(executa, espera=60, lote_max=10)
+        pendente = asyncio.ensure_future(agrupador.envia("a"))
+        await asyncio.sleep(0)
+        await agrupador.encerra()
+        return await pendente
+
+    assert asyncio.run(cenario()) == "a"
+    assert gravados == ["a"]
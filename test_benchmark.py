@@ -0,0 +1,33 @@
+import random
+import benchmark
+
+def _resultado(p95_ms, rps):
+    return {"rotas": {"GET /v1/empresas/{empresa_id}": {"8": {"p95_ms": p95_ms, "rps": rps}}}}
+
+def test_percentil():
+    valores = list(range(1, 101))
+
+    assert benchmark.percentil(valores, 0.50) == 50
+    assert benchmark.percentil(valores, 0.99) == 99
+    assert benchmark.percentil([], 0.99) is None
+
+def test_compara():
+    baseline = _resultado(p95_ms=10.0, rps=1000.0)
+
+    assert benchmark.compara(_resultado(p95_ms=10.5, rps=950.0), baseline, threshold=0.10) == []
+
+    regressoes = benchmark.compara(_resultado(p95_ms=12.0, rps=800.0), baseline, threshold=0.10)
+    assert len(regressoes) == 2
+    assert "p95" in regressoes[0]
+
+def test_metas_estouradas():
+    atual = {"rotas": {"GET /v1/empresas/search": {"1": {"p99_ms": 20.0}, "32": {"p99_ms": 150.0}}}}
+
+    estouradas = benchmark.metas_estouradas(atual, {"GET /v1/empresas/search": 100.0})
+
+    assert estouradas == ["GET /v1/empresas/search c=32: p99 150.00 ms (meta 100 ms)"]
+
+def test_todas_as_rotas_tem_cenario():
+    cenarios = benchmark.cenarios({"empresas": (1, 1), "obrigacoes": (1, 1)}, random.Random(), benchmark.gerador_cnpj())
+
+    assert benchmark.rotas_sem_cenario(cenarios) == []
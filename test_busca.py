@@ -0,0 +1,45 @@
+import busca
+from busca import IndiceNgram
+
+def test_classifica():
+    assert busca.classifica(" Padaria São João ") == ("nome", "padaria sao joao")
+    assert busca.classifica("12.345.678/0001") == ("cnpj", "123456780001")
+    assert busca.classifica("Contato@Empresa") == ("email", "contato@empresa")
+    assert busca.classifica("Loja 123") == ("nome", "loja 123")
+
+def test_indice_nome():
+    indice = IndiceNgram()
+    indice.carrega([
+        (1, "Mercado Central", "11111111000111", "a@mercado.com"),
+        (2, "Supermercado Norte", "22222222000122", "b@norte.com"),
+        (3, "Padaria São João", "33333333000133", "c@padaria.com"),
+    ])
+
+    # Quem começa pelo termo vem primeiro; acentos e maiúsculas não importam
+    assert indice.busca("mercado", 10) == [1, 2]
+    assert indice.busca("SAO JOAO", 10) == [3]
+    assert indice.busca("mercado", 1) == [1]
+    assert indice.busca("farmacia", 10) == []
+
+def test_indice_prefixos():
+    indice = IndiceNgram()
+    indice.carrega([
+        (1, "Mercado Central", "11.111.111/0001-11", "Vendas@Mercado.com"),
+        (2, "Supermercado Norte", "11.122.222/0001-22", "vendas@norte.com"),
+    ])
+
+    assert indice.busca("11.1", 10) == [1, 2]
+    assert indice.busca("11111", 10) == [1]
+    assert indice.busca("vendas@m", 10) == [1]
+
+def test_indice_atualiza_e_remove():
+    indice = IndiceNgram()
+    indice.carrega([(1, "Mercado Central", "111", "a@a.com")])
+
+    indice.atualiza(1, "Farmácia Central", "111", "a@a.com")
+    assert indice.busca("mercado", 10) == []
+    assert indice.busca("farmacia", 10) == [1]
+
+    indice.remove(1)
+    assert indice.busca("farmacia", 10) == []
+    assert indice.busca("111", 10) == []
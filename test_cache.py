@@ -0,0 +1,119 @@
+from unittest.mock import patch
+from cache import MemoryCache, RedisCache, create_cache
+
+# Substituto local do cliente redis-py (get/mget/set/delete/pipeline)
+class FakeRedis:
+    def __init__(self):
+        self.dados = {}
+
+    def get(self, chave):
+        return self.dados.get(chave)
+
+    def mget(self, chaves):
+        return [self.dados.get(chave) for chave in chaves]
+
+    def set(self, chave, valor, ex=None, nx=False):
+        if not (nx and chave in self.dados):
+            self.dados[chave] = valor.encode()
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+    def delete(self, *chaves):
+        for chave in chaves:
+            self.dados.pop(chave, None)
+
+def test_memory_cache_lru():
+    cache = MemoryCache(max_entries=2, ttl=60)
+
+    cache.set("empresa:1", {"id": 1})
+    cache.set("empresa:2", {"id": 2})
+    cache.get("empresa:1")
+    cache.set("empresa:3", {"id": 3})
+
+    # empresa:2 era a menos usada recentemente
+    assert cache.get("empresa:2") is None
+    assert cache.get("empresa:1") == {"id": 1}
+    assert cache.get("empresa:3") == {"id": 3}
+    assert cache.stats.evictions == 1
+    assert cache.stats.hits == 3
+    assert cache.stats.misses == 1
+
+def test_memory_cache_ttl():
+    cache = MemoryCache(max_entries=10, ttl=5)
+
+    with patch("cache.time.monotonic", return_value=100):
+        cache.set("empresa:1", {"id": 1})
+    with patch("cache.time.monotonic", return_value=104):
+        assert cache.get("empresa:1") == {"id": 1}
+    with patch("cache.time.monotonic", return_value=106):
+        assert cache.get("empresa:1") is None
+
+    assert cache.stats.expirations == 1
+    assert len(cache) == 0
+
+def test_redis_cache():
+    cache = RedisCache(FakeRedis(), ttl=60)
+
+    cache.set("empresa:1", {"id": 1, "nome": "Empresa Teste"})
+    assert cache.get("empresa:1") == {"id": 1, "nome": "Empresa Teste"}
+
+    cache.delete("empresa:1")
+    assert cache.get("empresa:1") is None
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+def test_add_nao_regrava_chave_invalidada():
+    for cache in (MemoryCache(max_entries=10, ttl=60, invalidacao_ttl=5), RedisCache(FakeRedis(), ttl=60)):
+        # Leitura anterior ao commit de uma escrita que já invalidou a chave
+        cache.add("empresa:1", {"id": 1, "versao": 1})
+        cache.delete("empresa:1")
+        cache.add("empresa:1", {"id": 1, "versao": 1})
+        assert cache.get("empresa:1") is None
+
+        # set (e add com a chave vazia) continuam gravando
+        cache.set("empresa:1", {"id": 1, "versao": 2})
+        cache.add("empresa:1", {"id": 1, "versao": 1})
+        assert cache.get("empresa:1") == {"id": 1, "versao": 2}
+        cache.add_many({"empresa:2": {"id": 2}})
+        assert cache.get_many(["empresa:1", "empresa:2"]) == {"empresa:1": {"id": 1, "versao": 2}, "empresa:2": {"id": 2}}
+
+def test_invalidacao_expira():
+    cache = MemoryCache(max_entries=10, ttl=60, invalidacao_ttl=5)
+
+    with patch("cache.time.monotonic", return_value=100):
+        cache.delete("empresa:1")
+        cache.add("empresa:1", {"id": 1})
+        assert len(cache) == 0
+    with patch("cache.time.monotonic", return_value=106):
+        cache.add("empresa:1", {"id": 1})
+        assert cache.get("empresa:1") == {"id": 1}
+    assert cache.stats.expirations == 0
+
+def test_invalidacoes_nao_tiram_entradas_do_lru():
+    cache = MemoryCache(max_entries=2, ttl=60, invalidacao_ttl=5)
+    cache.set("empresa:1", {"id": 1})
+    cache.set("empresa:2", {"id": 2})
+
+    cache.delete("empresa:3", "empresa:4", "empresa:5")
+
+    assert cache.get_many(["empresa:1", "empresa:2"]) == {"empresa:1": {"id": 1}, "empresa:2": {"id": 2}}
+    assert (len(cache), cache.stats.evictions) == (2, 0)
+    # Só as marcas mais recentes ficam, até o limite de entradas
+    cache.add("empresa:3", {"id": 3})
+    cache.add("empresa:5", {"id": 5})
+    assert cache.get("empresa:5") is None
+    assert cache.stats.evictions == 1
+
+def test_get_many():
+    for cache in (MemoryCache(max_entries=10, ttl=60), RedisCache(FakeRedis(), ttl=60)):
+        cache.set_many({"empresa:1": {"id": 1}, "empresa:3": {"id": 3}})
+
+        assert cache.get_many(["empresa:1", "empresa:2", "empresa:3"]) == {"empresa:1": {"id": 1}, "empresa:3": {"id": 3}}
+        assert (cache.stats.hits, cache.stats.misses) == (2, 1)
+
+def test_create_cache():
+    assert create_cache("none").enabled is False
+    assert isinstance(create_cache("memory"), MemoryCache)
@@ -0,0 +1,68 @@
+import pytest
+from unittest.mock import patch
+from sqlalchemy.engine import make_url
+import database
+
+def test_valida_configuracao():
+    with patch("database.DB_POOL_SIZE", 0), patch("database.DB_POOL_TIMEOUT", 0):
+        with pytest.raises(ValueError) as exc:
+            database.valida_configuracao()
+
+    assert "DB_POOL_SIZE" in str(exc.value)
+    assert "DB_POOL_TIMEOUT" in str(exc.value)
+
+def test_valida_configuracao_threadpool_maior_que_pool(caplog):
+    with patch("database.DB_ASYNC", False), patch("database.THREADPOOL_SIZE", 100):
+        database.valida_configuracao()
+
+    assert "THREADPOOL_SIZE" in caplog.text
+
+def test_engine_options():
+    with patch("database.DB_POOL_SIZE", 20), patch("database.DB_POOL_RECYCLE", 300):
+        opcoes = database._engine_options("postgresql+psycopg2://u:p@localhost/db", database.InstrumentedQueuePool)
+
+    assert opcoes["poolclass"] is database.InstrumentedQueuePool
+    assert opcoes["pool_size"] == 20
+    assert opcoes["pool_recycle"] == 300
+    assert "connect_args" not in opcoes
+
+    # SQLite em memória mantém o pool padrão do dialeto
+    assert "poolclass" not in database._engine_options("sqlite://", database.InstrumentedQueuePool)
+
+def test_engine_options_pgbouncer():
+    url = database.async_url("postgresql+psycopg2://u:p@localhost/db")
+
+    with patch("database.DB_PGBOUNCER", True):
+        opcoes = database._engine_options(url, database.InstrumentedAsyncQueuePool)
+
+    assert make_url(url).get_driver_name() == "asyncpg"
+    assert opcoes["connect_args"]["statement_cache_size"] == 0
+    assert opcoes["connect_args"]["prepared_statement_name_func"]() != opcoes["connect_args"]["prepared_statement_name_func"]()
+
+def test_replicas_em_rodizio(tmp_path):
+    replicas = database.Replicas([f"sqlite:///{tmp_path}/a.db", f"sqlite:///{tmp_path}/b.db", f"sqlite:///{tmp_path}/inexistente/c.db"])
+
+    with patch.object(database.Replicas, "_inicia_verificador"):
+        replicas.verifica()
+        # A réplica sem banco sai do rodízio
+        assert [replica.saudavel for replica in replicas.replicas] == [True, True, False]
+        escolhidas = [replicas.escolhe() for _ in range(4)]
+        assert escolhidas == [replicas.replicas[0], replicas.replicas[1]] * 2
+
+        # Conexão perdida durante uma requisição tira a réplica até a próxima verificação
+        replicas.replicas[0].falhou()
+        assert {replicas.escolhe() for _ in range(2)} == {replicas.replicas[1]}
+        replicas.replicas[1].falhou()
+        assert replicas.escolhe() is None
+
+        replicas.verifica()
+        assert replicas.escolhe() is not None
+
+def test_replica_atrasada(tmp_path):
+    replicas = database.Replicas([f"sqlite:///{tmp_path}/a.db"])
+
+    with patch("database.DB_REPLICA_MAX_LAG", -1):
+        replicas.verifica()
+
+    assert not replicas.replicas[0].saudavel
+    assert not database.Replicas([])
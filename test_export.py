@@ -0,0 +1,47 @@
+import gzip
+import io
+import json
+import pytest
+from export import Exportador
+
+COLUNAS = [("empresa_id", int), ("empresa_nome", str), ("obrigacao_acessoria_id", int)]
+LOTES = [[(1, "Empresa A", 10), (1, "Empresa A", 11)], [(2, "Empresa, B", None)]]
+
+def _exporta(exportador):
+    return b"".join([exportador.lote(lote) for lote in LOTES] + [exportador.fim()])
+
+def test_csv():
+    dados = _exporta(Exportador("csv", COLUNAS))
+
+    assert dados.decode().splitlines() == [
+        "empresa_id,empresa_nome,obrigacao_acessoria_id",
+        "1,Empresa A,10",
+        "1,Empresa A,11",
+        '2,"Empresa, B",',
+    ]
+
+def test_csv_vazio_tem_cabecalho():
+    exportador = Exportador("csv", COLUNAS)
+
+    assert exportador.fim() == b"empresa_id,empresa_nome,obrigacao_acessoria_id\n"
+
+def test_ndjson_gzip():
+    exportador = Exportador("ndjson", COLUNAS, gzip=True)
+
+    dados = gzip.decompress(_exporta(exportador))
+
+    assert exportador.media_type == "application/gzip"
+    assert exportador.extensao == "ndjson.gz"
+    assert [json.loads(linha) for linha in dados.splitlines()][-1] == {"empresa_id": 2, "empresa_nome": "Empresa, B", "obrigacao_acessoria_id": None}
+
+def test_parquet():
+    parquet = pytest.importorskip("pyarrow.parquet")
+
+    tabela = parquet.read_table(io.BytesIO(_exporta(Exportador("parquet", COLUNAS))))
+
+    assert tabela.num_rows == 3
+    assert tabela.column("obrigacao_acessoria_id").to_pylist() == [10, 11, None]
+
+def test_formato_invalido():
+    with pytest.raises(ValueError):
+        Exportador("xlsx", COLUNAS)
@@ -0,0 +1,112 @@
+import pytest
+from unittest.mock import patch
+from cache import MemoryCache
+
+EMPRESA = {"nome": "Empresa A", "cnpj": "11111111000111", "endereco": "Rua", "email": "a@empresa.com", "telefone": "1"}
+OBRIGACAO = {"nome": "DCTF", "periodicidade": "Mensal", "empresa_id": 1}
+
+def _popula(api):
+    # Duas empresas com três obrigações cada, pelas rotas de carga em lote
+    resposta = api.post("/v1/empresas/bulk", json=[EMPRESA, {**EMPRESA, "nome": "Empresa C", "cnpj": "22222222000122"}])
+    assert resposta.json()["inseridos"] == 2
+    obrigacoes = [{"nome": nome, "periodicidade": "Mensal", "empresa_id": empresa_id, "dia_vencimento": 15} for empresa_id in (1, 2) for nome in ("DCTF", "EFD", "ECD")]
+    resposta = api.post("/v1/obrigacaoAcessoria/bulk", json=obrigacoes)
+    assert resposta.json()["inseridos"] == 6
+
+@pytest.mark.parametrize("rodada", [1, 2])
+def test_cada_teste_comeca_com_o_banco_vazio(api, rodada):
+    # A transação do teste é desfeita no fim: o mesmo CNPJ entra de novo,
+    # com o mesmo id
+    resposta = api.post("/v1/empresas", json=EMPRESA)
+    assert resposta.status_code == 201
+    assert [empresa["id"] for empresa in api.get("/v1/empresas").json()["itens"]] == [1]
+
+@pytest.mark.parametrize("rota", ["/v1/empresas/{}", "/v1/obrigacaoAcessoria/{}"])
+def test_cache_por_id_ignora_zeros_a_esquerda(api, rota):
+    # /01 e /1 são a mesma entidade e a mesma chave do cache: a escrita em
+    # /1 invalida o que a leitura de /01 guardou
+    _popula(api)
+    with patch("cache.backend", MemoryCache(max_entries=10, ttl=60, invalidacao_ttl=0)):
+        assert api.get(rota.format("01")).json()["versao"] == 1
+        assert api.put(rota.format(1), json={"nome": "Novo nome"}).status_code == 200
+        resposta = api.get(rota.format("01"), headers={"If-None-Match": '"1"'})
+        assert resposta.status_code == 200
+        assert (resposta.json()["nome"], resposta.json()["versao"]) == ("Novo nome", 2)
+
+        assert api.delete(rota.format(1)).status_code == 204
+        assert api.get(rota.format("01")).status_code == 400
+
+def test_obrigacao_de_empresa_inexistente(api):
+    # Sem agrupamento a foreign key recusa a linha com a mesma resposta do
+    # caminho agrupado, e não com 500
+    _popula(api)
+    resposta = api.post("/v1/obrigacaoAcessoria", json={**OBRIGACAO, "empresa_id": 99})
+
+    assert resposta.status_code == 400
+    assert resposta.json()["detail"] == "Empresa não encontrada"
+    assert api.post("/v1/obrigacaoAcessoria", json=OBRIGACAO).status_code == 201
+
+# Instruções SQL por rota (SQLite, Postgres) e commits. No Postgres as
+# escritas também tomam o advisory lock do outbox; no SQLite o INSERT em
+# lote com RETURNING ordenado vira um INSERT por linha.
+ROTAS = [
+    ("POST", "/v1/empresas", {"json": {**EMPRESA, "cnpj": "33333333000133"}}, 201, (3, 4), 1),
+    ("POST", "/v1/empresas/bulk", {"json": [{**EMPRESA, "cnpj": "33333333000133"}, {**EMPRESA, "cnpj": "44444444000144"}]}, 200, (2, 3), 1),
+    ("POST", "/v1/empresas/lookup", {"json": {"ids": [1, 99]}}, 200, (1, 1), 0),
+    ("POST", "/v1/empresas/lookup", {"json": {"cnpjs": ["22222222000122"]}}, 200, (1, 1), 0),
+    ("GET", "/v1/empresas", {}, 200, (1, 1), 0),
+    ("GET", "/v1/empresas", {"params": {"cnpj": "11111111000111"}}, 200, (1, 1), 0),
+    ("GET", "/v1/empresas", {"params": {"ids": "1,2"}}, 200, (1, 1), 0),
+    ("GET", "/v1/empresas", {"params": {"include": "obrigacoes"}}, 200, (2, 2), 0),
+    ("GET", "/v1/empresas/1", {}, 200, (1, 1), 0),
+    ("GET", "/v1/empresas/1", {"params": {"include": "obrigacoes"}}, 200, (2, 2), 0),
+    ("PUT", "/v1/empresas/1", {"json": {"nome": "Empresa B"}}, 200, (2, 3), 1),
+    ("DELETE", "/v1/empresas/2", {}, 204, (5, 6), 1),
+    ("DELETE", "/v1/empresas", {"params": {"ids": "1,2"}}, 200, (5, 6), 1),
+    ("POST", "/v1/obrigacaoAcessoria", {"json": OBRIGACAO}, 201, (5, 6), 1),
+    ("POST", "/v1/obrigacaoAcessoria/bulk", {"json": [OBRIGACAO, OBRIGACAO]}, 200, (6, 6), 1),
+    ("POST", "/v1/obrigacaoAcessoria/lookup", {"json": {"ids": [1, 99]}}, 200, (1, 1), 0),
+    ("GET", "/v1/obrigacaoAcessoria", {"params": {"empresa_id": 1}}, 200, (1, 1), 0),
+    ("GET", "/v1/obrigacaoAcessoria/1", {}, 200, (1, 1), 0),
+    ("GET", "/v1/obrigacaoAcessoria/vencimentos", {"params": {"de": "2024-01-01", "ate": "2024-03-31", "empresa_id": 1}}, 200, (1, 1), 0),
+    ("PUT", "/v1/obrigacaoAcessoria/1", {"json": {"periodicidade": "Anual"}}, 200, (5, 6), 1),
+    ("DELETE", "/v1/obrigacaoAcessoria/1", {}, 204, (4, 5), 1),
+    ("DELETE", "/v1/obrigacaoAcessoria", {"params": {"ids": "1,2"}}, 200, (4, 5), 1),
+    ("GET", "/v1/relatorios/obrigacoes", {}, 200, (3, 3), 0),
+    ("GET", "/v1/relatorios/obrigacoes", {"params": {"empresa_id": 1}}, 200, (3, 3), 0),
+    ("GET", "/v1/export/empresas", {"params": {"formato": "ndjson"}}, 200, (1, 1), 0),
+]
+
+@pytest.mark.parametrize("metodo,rota,kwargs,status,instrucoes,commits", ROTAS)
+def test_instrucoes_por_rota(api, sql, metodo, rota, kwargs, status, instrucoes, commits):
+    _popula(api)
+    esperadas = instrucoes[sql.conexao.dialect.name == "postgresql"]
+    with sql.exatamente(esperadas, commits=commits):
+        resposta = api.request(metodo, rota, **kwargs)
+    assert resposta.status_code == status, resposta.text
+
+# Consultas que filtram por chave: nenhuma pode ler uma tabela inteira.
+# totais_obrigacoes tem uma linha por fatia e periodicidade e é sempre
+# lida inteira; meses é a CTE dos vencimentos.
+PERMITIDAS = {"totais_obrigacoes", "meses"}
+CONSULTAS = [
+    ("GET", "/v1/empresas", {"params": {"cnpj": "11111111000111"}}),
+    ("GET", "/v1/empresas", {"params": {"ids": "1,2"}}),
+    ("GET", "/v1/empresas/1", {"params": {"include": "obrigacoes"}}),
+    ("POST", "/v1/empresas/lookup", {"json": {"cnpjs": ["22222222000122"]}}),
+    ("GET", "/v1/obrigacaoAcessoria", {"params": {"empresa_id": 1}}),
+    ("GET", "/v1/obrigacaoAcessoria/vencimentos", {"params": {"de": "2024-01-01", "ate": "2024-03-31", "empresa_id": 1}}),
+    ("PUT", "/v1/obrigacaoAcessoria/1", {"json": {"periodicidade": "Anual"}}),
+    ("DELETE", "/v1/empresas/2", {}),
+    ("GET", "/v1/relatorios/obrigacoes", {"params": {"empresa_id": 1}}),
+]
+
+@pytest.mark.parametrize("metodo,rota,kwargs", CONSULTAS)
+def test_consultas_usam_indices(api, sql, metodo, rota, kwargs):
+    _popula(api)
+    inicio = len(sql.executadas)
+    assert api.request(metodo, rota, **kwargs).status_code < 300
+    for instrucao, parametros in sql.executadas[inicio:]:
+        if instrucao.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            varreduras = sql.varreduras(instrucao, parametros) - PERMITIDAS
+            assert not varreduras, f"{sorted(varreduras)} lida(s) por inteiro:\n{instrucao}\n" + "\n".join(sql.plano(instrucao, parametros))
@@ -1,9 +1,21 @@
+import asyncio
+import json
+import pytest
+from contextlib import contextmanager
 from fastapi.testclient import TestClient
-from main import app, get_db
-from sqlalchemy.orm import Session
-from unittest.mock import MagicMock, patch
-from models import Empresa, ObrigacaoAcessoria
-from schemas import EmpresaRead, ObrigacaoAcessoriaRead
+from main import COOKIE_PRIMARIO, SSE_KEEPALIVE, _eventos, app, get_db
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from unittest.mock import AsyncMock, MagicMock, patch
+from agrupamento import Agrupador
+from cache import MemoryCache
+import database
+import repositories
+from database import DB_POOL_SIZE, Replicas
+from models import Base, Empresa
+from schemas import EmpresaRead, EmpresaComObrigacoesRead, ObrigacaoAcessoriaRead, BulkItemResult, RelatorioObrigacoes, ResumoEmpresaObrigacoes
 
 # Cria o cliente de teste
 client = TestClient(app)
@@ -14,169 +26,529 @@ mock_db = MagicMock(spec=Session)
 # Sobrescreve a dependência get_db para usar o mock
 app.dependency_overrides[get_db] = lambda: mock_db
 
-# Testes para Empresa
-def test_create_empresa():
-    # Dados da empresa
-    empresa_data = {
-        "nome": "Empresa Teste",
-        "cnpj": "12345678901234",
-        "endereco": "Rua Teste, 123",
-        "email": "teste@empresa.com",
-        "telefone": "11987654321"
-    }
-
-    # Mock do retorno do repositório
-    mock_db.query.return_value.filter.return_value.first.return_value = None
-    mock_db.commit.return_value = None
-    mock_db.refresh.return_value = None
+# Linha de uma obrigação acessória no formato de ObrigacaoAcessoriaRead
+OBRIGACAO_LINHA = ObrigacaoAcessoriaRead(id=1, nome="Obrigacao Teste", periodicidade="Mensal", empresa_id=1).model_dump()
+
+# Os testes que abrem sessões, engines ou conexões fora de get_db rodam nos
+# dois modos, independente de DB_ASYNC
+@pytest.fixture(params=[False, True], ids=["sync", "async"])
+def db_async(request):
+    with patch("main.DB_ASYNC", request.param), patch("database.DB_ASYNC", request.param):
+        yield request.param
+
+@contextmanager
+def _stream(db_async, nome, lotes):
+    # Sessão falsa para o streaming e o stream do repositório do modo
+    if db_async:
+        async def lote_a_lote(db, **filtros):
+            for lote in lotes:
+                yield lote
+        with patch("main.AsyncSessionLocal", return_value=MagicMock(spec=AsyncSession)), patch(f"async_repositories.{nome}", side_effect=lote_a_lote) as stream:
+            yield stream
+    else:
+        with patch("main.SessionLocal", return_value=MagicMock(spec=Session)), patch(f"repositories.{nome}", return_value=iter(lotes)) as stream:
+            yield stream
+
+# Testes para Empresa (banco real, pela fixture `api`, no modo de DB_ASYNC)
+EMPRESA = {
+    "nome": "Empresa Teste",
+    "cnpj": "12345678901234",
+    "endereco": "Rua Teste, 123",
+    "email": "teste@empresa.com",
+    "telefone": "11987654321",
+}
+OBRIGACAO = {"nome": "Obrigacao Teste", "periodicidade": "Mensal", "empresa_id": 1}
+
+def test_create_empresa(api):
+    response = api.post("/v1/empresas", json=EMPRESA)
 
-    # Chama o endpoint
-    response = client.post("/v1/empresas", json=empresa_data)
-
-    # Verifica a resposta
     assert response.status_code == 201
     assert response.json()["nome"] == "Empresa Teste"
 
-def test_read_empresa():
-    # Mock do retorno do repositório
-    mock_empresa = MagicMock()
-    mock_empresa.id = 1
-    mock_empresa.nome = "Empresa Teste"
-    mock_empresa.cnpj = "12345678901234"
-    mock_empresa.endereco = "Rua Teste, 123"
-    mock_empresa.email = "teste@empresa.com"
-    mock_empresa.telefone = "11987654321"
+def test_read_empresa(api):
+    api.post("/v1/empresas", json=EMPRESA)
+
+    response = api.get("/v1/empresas/1")
 
-    mock_db.query.return_value.filter.return_value.first.return_value = mock_empresa
+    assert response.status_code == 200
+    assert response.json() == {**EMPRESA, "id": 1, "versao": 1}
+    assert response.headers["etag"] == '"1"'
+    assert api.get("/v1/empresas/2").status_code == 400
 
-    # Chama o endpoint
-    response = client.get("/v1/empresas/1")
+def test_update_empresa(api):
+    api.post("/v1/empresas", json=EMPRESA)
 
-    # Verifica a resposta
+    response = api.put("/v1/empresas/1", json={"nome": "Empresa Atualizada"})
+
+    # Só os campos enviados mudam, e a versão sobe
     assert response.status_code == 200
-    assert response.json()["nome"] == "Empresa Teste"
+    assert response.json() == {**EMPRESA, "nome": "Empresa Atualizada", "id": 1, "versao": 2}
+    assert api.get("/v1/empresas/1").json()["nome"] == "Empresa Atualizada"
 
-def test_update_empresa():
-    # Mock do retorno do repositório
-    mock_empresa = MagicMock()
-    mock_empresa.id = 1
-    mock_empresa.nome = "Empresa Teste"
-    mock_empresa.cnpj = "12345678901234"
-    mock_empresa.endereco = "Rua Teste, 123"
-    mock_empresa.email = "teste@empresa.com"
-    mock_empresa.telefone = "11987654321"
+def test_update_empresa_nao_encontrada(api):
+    response = api.put("/v1/empresas/1", json={"nome": "Empresa Atualizada"})
 
-    mock_db.query.return_value.filter.return_value.first.return_value = mock_empresa
-    mock_db.commit.return_value = None
-    mock_db.refresh.return_value = None
+    assert response.status_code == 400
+
+def test_delete_empresa(api):
+    api.post("/v1/empresas", json=EMPRESA)
+    api.post("/v1/obrigacaoAcessoria", json=OBRIGACAO)
+
+    response = api.delete("/v1/empresas/1")
+
+    # As obrigações saem pelo ON DELETE CASCADE do banco
+    assert response.status_code == 204
+    assert api.get("/v1/empresas/1").status_code == 400
+    assert api.get("/v1/obrigacaoAcessoria/1").status_code == 400
+    assert api.delete("/v1/empresas/1").status_code == 400
+
+# Testes para ObrigacaoAcessoria
+def test_create_obrigacao_acessoria(api):
+    api.post("/v1/empresas", json=EMPRESA)
+
+    response = api.post("/v1/obrigacaoAcessoria", json=OBRIGACAO)
+
+    assert response.status_code == 201
+    assert response.json()["nome"] == "Obrigacao Teste"
 
-    # Dados de atualização
-    update_data = {"nome": "Empresa Atualizada"}
+def test_read_obrigacao_acessoria(api):
+    api.post("/v1/empresas", json=EMPRESA)
+    api.post("/v1/obrigacaoAcessoria", json=OBRIGACAO)
 
-    # Chama o endpoint
-    response = client.put("/v1/empresas/1", json=update_data)
+    response = api.get("/v1/obrigacaoAcessoria/1")
 
-    # Verifica a resposta
     assert response.status_code == 200
-    assert response.json()["nome"] == "Empresa Atualizada"
+    assert (response.json()["nome"], response.json()["empresa_id"], response.json()["versao"]) == ("Obrigacao Teste", 1, 1)
 
-def test_delete_empresa():
-    # Mock do retorno do repositório
-    mock_empresa = MagicMock()
-    mock_empresa.id = 1
-    mock_empresa.nome = "Empresa Teste"
-    mock_empresa.cnpj = "12345678901234"
-    mock_empresa.endereco = "Rua Teste, 123"
-    mock_empresa.email = "teste@empresa.com"
-    mock_empresa.telefone = "11987654321"
+def test_update_obrigacao_acessoria(api):
+    api.post("/v1/empresas", json=EMPRESA)
+    api.post("/v1/obrigacaoAcessoria", json=OBRIGACAO)
 
-    mock_db.query.return_value.filter.return_value.first.return_value = mock_empresa
-    mock_db.commit.return_value = None
-    mock_db.delete.return_value = None
+    response = api.put("/v1/obrigacaoAcessoria/1", json={"nome": "Obrigacao Atualizada"})
 
-    # Chama o endpoint
-    response = client.delete("/v1/empresas/1")
+    assert response.status_code == 200
+    assert (response.json()["nome"], response.json()["periodicidade"], response.json()["versao"]) == ("Obrigacao Atualizada", "Mensal", 2)
+
+def test_delete_obrigacao_acessoria(api):
+    api.post("/v1/empresas", json=EMPRESA)
+    api.post("/v1/obrigacaoAcessoria", json=OBRIGACAO)
+
+    response = api.delete("/v1/obrigacaoAcessoria/1")
 
-    # Verifica a resposta
     assert response.status_code == 204
+    assert api.get("/v1/obrigacaoAcessoria/1").status_code == 400
+    assert api.get("/v1/empresas/1").status_code == 200
 
-    # Verifica se a empresa foi excluída
-    mock_db.delete.assert_called_once_with(mock_empresa)
+def test_delete_empresas_em_lote():
+    with patch("repositories.delete_empresas", return_value=[3, 1]) as delete_empresas:
+        response = client.delete("/v1/empresas?ids=1,2,3,1")
 
-# Testes para ObrigacaoAcessoria
-def test_create_obrigacao_acessoria():
-    # Dados da obrigação acessória
-    obrigacao_data = {
-        "nome": "Obrigacao Teste",
-        "periodicidade": "Mensal",
-        "empresa_id": 1
-    }
+    assert response.status_code == 200
+    delete_empresas.assert_called_once_with(mock_db, [1, 2, 3, 1])
+    assert response.json() == {"removidos": [1, 3], "nao_encontrados": [2]}
+
+    assert client.delete("/v1/obrigacaoAcessoria?ids=1,x").status_code == 400
+
+# Testes para cargas em lote
+def test_bulk_create_empresas():
+    empresas_data = [
+        {"nome": "Empresa A", "cnpj": "11111111111111", "endereco": "Rua A", "email": "a@empresa.com", "telefone": "1"},
+        {"nome": "Empresa sem CNPJ"},
+        {"nome": "Empresa B", "cnpj": "22222222222222", "endereco": "Rua B", "email": "b@empresa.com", "telefone": "2"},
+    ]
+
+    # O repositório recebe apenas as linhas válidas, com índices próprios
+    retorno = [
+        BulkItemResult(indice=0, id=10),
+        BulkItemResult(indice=1, erro="CNPJ já cadastrado"),
+    ]
+    with patch("repositories.bulk_create_empresas", return_value=retorno) as bulk_create:
+        response = client.post("/v1/empresas/bulk", json=empresas_data)
 
-    # Mock do retorno do repositório
-    mock_db.query.return_value.filter.return_value.first.return_value = None
-    mock_db.commit.return_value = None
-    mock_db.refresh.return_value = None
+    assert response.status_code == 200
+    assert [e.cnpj for e in bulk_create.call_args.args[1]] == ["11111111111111", "22222222222222"]
+    body = response.json()
+    assert body["inseridos"] == 1
+    assert body["falhas"] == 2
+    assert [r["indice"] for r in body["resultados"]] == [0, 1, 2]
+    assert body["resultados"][0]["id"] == 10
+    assert "cnpj" in body["resultados"][1]["erro"]
+    assert body["resultados"][2]["erro"] == "CNPJ já cadastrado"
+
+def test_bulk_create_obrigacoes_acessorias_ndjson():
+    corpo = "\n".join([
+        '{"nome": "Obrigacao A", "periodicidade": "Mensal", "empresa_id": 1}',
+        '{"nome": "Obrigacao B", "periodicidade": "Anual", "empresa_id": 1',
+        '',
+        '{"nome": "Obrigacao C", "periodicidade": "Anual", "empresa_id": 2}',
+    ])
+
+    retorno = [BulkItemResult(indice=0, id=1), BulkItemResult(indice=1, id=2)]
+    with patch("repositories.bulk_create_obrigacoes_acessorias", return_value=retorno):
+        response = client.post("/v1/obrigacaoAcessoria/bulk", content=corpo, headers={"Content-Type": "application/x-ndjson"})
 
-    # Chama o endpoint
-    response = client.post("/v1/obrigacaoAcessoria", json=obrigacao_data)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["inseridos"] == 2
+    assert [r["id"] for r in body["resultados"]] == [1, None, 2]
+    assert body["resultados"][1]["erro"] is not None
 
-    # Verifica a resposta
-    assert response.status_code == 201
-    assert response.json()["nome"] == "Obrigacao Teste"
+def test_bulk_create_empresas_corpo_invalido():
+    response = client.post("/v1/empresas/bulk", json={"nome": "Empresa Teste"})
 
-def test_read_obrigacao_acessoria():
-    # Mock do retorno do repositório
-    mock_obrigacao = MagicMock()
-    mock_obrigacao.id = 1
-    mock_obrigacao.nome = "Obrigacao Teste"
-    mock_obrigacao.periodicidade = "Mensal"
-    mock_obrigacao.empresa_id = 1
+    assert response.status_code == 400
 
-    mock_db.query.return_value.filter.return_value.first.return_value = mock_obrigacao
 
-    # Chama o endpoint
-    response = client.get("/v1/obrigacaoAcessoria/1")
+# Testes para listagens
+def test_list_empresas():
+    empresas = [
+        EmpresaRead(id=1, nome="Empresa A", cnpj="11111111111111", endereco="Rua A", email="a@empresa.com", telefone="1"),
+        EmpresaRead(id=2, nome="Empresa B", cnpj="22222222222222", endereco="Rua B", email="b@empresa.com", telefone="2"),
+    ]
+
+    # Sem include as linhas chegam como dicts e são serializadas direto
+    with patch("repositories.list_empresas", return_value=([e.model_dump() for e in empresas], 2)) as list_empresas:
+        response = client.get("/v1/empresas?cursor=0&limit=2")
 
-    # Verifica a resposta
     assert response.status_code == 200
-    assert response.json()["nome"] == "Obrigacao Teste"
+    list_empresas.assert_called_once_with(mock_db, None, 0, 2, False)
+    assert [e["id"] for e in response.json()["itens"]] == [1, 2]
+    assert response.json()["proximo_cursor"] == 2
 
-def test_update_obrigacao_acessoria():
-    # Mock do retorno do repositório
-    mock_obrigacao = MagicMock()
-    mock_obrigacao.id = 1
-    mock_obrigacao.nome = "Obrigacao Teste"
-    mock_obrigacao.periodicidade = "Mensal"
-    mock_obrigacao.empresa_id = 1
+def test_list_empresas_include_obrigacoes():
+    empresas = [
+        EmpresaComObrigacoesRead(id=1, nome="Empresa A", cnpj="11111111111111", endereco="Rua A", email="a@empresa.com", telefone="1", obrigacoes=[
+            ObrigacaoAcessoriaRead(id=5, nome="DCTF", periodicidade="Mensal", empresa_id=1),
+        ]),
+        EmpresaComObrigacoesRead(id=2, nome="Empresa B", cnpj="22222222222222", endereco="Rua B", email="b@empresa.com", telefone="2", obrigacoes=[]),
+    ]
 
-    mock_db.query.return_value.filter.return_value.first.return_value = mock_obrigacao
-    mock_db.commit.return_value = None
-    mock_db.refresh.return_value = None
+    with patch("repositories.list_empresas", return_value=(empresas, None)) as list_empresas:
+        response = client.get("/v1/empresas?include=obrigacoes")
+
+    assert response.status_code == 200
+    list_empresas.assert_called_once_with(mock_db, None, None, 100, True)
+    itens = response.json()["itens"]
+    assert [o["id"] for o in itens[0]["obrigacoes"]] == [5]
+    assert itens[1]["obrigacoes"] == []
+
+def test_read_empresa_include_obrigacoes():
+    empresa = EmpresaComObrigacoesRead(id=1, nome="Empresa A", cnpj="11111111111111", endereco="Rua A", email="a@empresa.com", telefone="1", obrigacoes=[
+        ObrigacaoAcessoriaRead(id=5, nome="DCTF", periodicidade="Mensal", empresa_id=1),
+    ])
+
+    with patch("repositories.get_empresa_com_obrigacoes", return_value=empresa) as get_empresa:
+        response = client.get("/v1/empresas/1?include=obrigacoes")
+
+    assert response.status_code == 200
+    get_empresa.assert_called_once()
+    assert [(o["id"], o["nome"]) for o in response.json()["obrigacoes"]] == [(5, "DCTF")]
 
-    # Dados de atualização
-    update_data = {"nome": "Obrigacao Atualizada"}
+def test_lookup_empresas():
+    empresa = EmpresaRead(id=3, nome="Empresa C", cnpj="33333333333333", endereco="Rua C", email="c@empresa.com", telefone="3")
 
-    # Chama o endpoint
-    response = client.put("/v1/obrigacaoAcessoria/1", json=update_data)
+    with patch("repositories.get_empresas", return_value=[empresa, None]) as get_empresas:
+        response = client.get("/v1/empresas?ids=3,9")
 
-    # Verifica a resposta
+    get_empresas.assert_called_once_with(mock_db, [3, 9])
     assert response.status_code == 200
-    assert response.json()["nome"] == "Obrigacao Atualizada"
+    assert [(item["chave"], item["empresa"] and item["empresa"]["id"]) for item in response.json()["itens"]] == [(3, 3), (9, None)]
+    assert response.json()["nao_encontrados"] == [9]
 
-def test_delete_obrigacao_acessoria():
-    # Mock do retorno do repositório
-    mock_obrigacao = MagicMock()
-    mock_obrigacao.id = 1
-    mock_obrigacao.nome = "Obrigacao Teste"
-    mock_obrigacao.periodicidade = "Mensal"
-    mock_obrigacao.empresa_id = 1
+    with patch("repositories.get_empresas_por_cnpj", return_value=[None, empresa]) as get_empresas_por_cnpj:
+        response = client.post("/v1/empresas/lookup", json={"cnpjs": ["00000000000000", "33333333333333"]})
 
-    mock_db.query.return_value.filter.return_value.first.return_value = mock_obrigacao
-    mock_db.commit.return_value = None
-    mock_db.delete.return_value = None
+    get_empresas_por_cnpj.assert_called_once_with(mock_db, ["00000000000000", "33333333333333"])
+    assert response.json()["nao_encontrados"] == ["00000000000000"]
 
-    # Chama o endpoint
-    response = client.delete("/v1/obrigacaoAcessoria/1")
+    assert client.post("/v1/empresas/lookup", json={"ids": [1], "cnpjs": ["1"]}).status_code == 400
+    assert client.get("/v1/empresas?ids=1,a").status_code == 400
 
-    # Verifica a resposta
-    assert response.status_code == 204
\ No newline at end of file
+def test_export_empresas(db_async):
+    lotes = [[(1, "Empresa A", "11111111111111", "Rua A", "a@empresa.com", "1", 10, "DCTF", "Mensal", 1, 15, None)]]
+
+    with _stream(db_async, "stream_export", lotes) as stream:
+        response = client.get("/v1/export/empresas?formato=csv&cursor=5")
+
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="empresas.csv"'
+    assert stream.call_args.kwargs == {"cursor": 5}
+    linhas = response.text.splitlines()
+    assert linhas[0].startswith("empresa_id,empresa_nome,cnpj")
+    assert linhas[1] == "1,Empresa A,11111111111111,Rua A,a@empresa.com,1,10,DCTF,Mensal,1,15,"
+
+def test_list_vencimentos_janela_invalida():
+    assert client.get("/v1/obrigacaoAcessoria/vencimentos?de=2024-02-01&ate=2024-01-01").status_code == 400
+    assert client.get("/v1/obrigacaoAcessoria/vencimentos?de=2024-01-01&ate=2025-06-01").status_code == 400
+    assert client.get("/v1/obrigacaoAcessoria/vencimentos?cursor=ontem").status_code == 400
+
+def test_read_empresa_if_none_match():
+    empresa = EmpresaRead(id=1, nome="Empresa A", cnpj="11111111111111", endereco="Rua A", email="a@empresa.com", telefone="1", versao=3)
+
+    with patch("repositories.versao_empresa", return_value=3), patch("repositories.get_empresa_linha", return_value=empresa.model_dump()) as get_empresa:
+        response = client.get("/v1/empresas/1")
+        assert response.status_code == 200
+        assert response.headers["etag"] == '"3"'
+
+        # Com a versão atual o 304 não carrega a empresa
+        get_empresa.reset_mock()
+        response = client.get("/v1/empresas/1", headers={"If-None-Match": 'W/"3"'})
+        assert response.status_code == 304
+        assert response.headers["etag"] == '"3"'
+        get_empresa.assert_not_called()
+
+        assert client.get("/v1/empresas/1", headers={"If-None-Match": '"2"'}).status_code == 200
+
+def test_update_empresa_if_match():
+    with patch("repositories.update_empresa", side_effect=repositories.VersaoDivergente(4)) as update_empresa:
+        response = client.put("/v1/empresas/1", json={"nome": "Empresa B"}, headers={"If-Match": '"2", W/"4"'})
+
+    # ETags fracas não valem para If-Match
+    assert update_empresa.call_args.args[3] == [2]
+    assert response.status_code == 412
+    assert response.headers["etag"] == '"4"'
+
+def test_list_empresas_limit_invalido():
+    response = client.get("/v1/empresas?limit=0")
+
+    assert response.status_code == 422
+
+def test_list_obrigacoes_acessorias_ndjson(db_async):
+    lotes = [
+        [ObrigacaoAcessoriaRead(id=1, nome="Obrigacao A", periodicidade="Mensal", empresa_id=1)],
+        [ObrigacaoAcessoriaRead(id=3, nome="Obrigacao B", periodicidade="Mensal", empresa_id=1)],
+    ]
+
+    with _stream(db_async, "stream_obrigacoes_acessorias", lotes) as stream:
+        response = client.get("/v1/obrigacaoAcessoria?formato=ndjson&empresa_id=1&periodicidade=Mensal")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert stream.call_args.kwargs == {"empresa_id": 1, "periodicidade": "Mensal"}
+    linhas = response.text.splitlines()
+    assert [json.loads(linha)["id"] for linha in linhas] == [1, 3]
+
+
+# Testes para o modo assíncrono (AsyncSession)
+def test_update_empresa_async_session():
+    mock_db.execute.return_value.mappings.return_value.one_or_none.return_value = {
+        "id": 1,
+        "nome": "Empresa Assincrona",
+        "cnpj": "12345678901234",
+        "endereco": "Rua Teste, 123",
+        "email": "teste@empresa.com",
+        "telefone": "11987654321",
+        "versao": 2,
+    }
+
+    # run_sync executa a função do repositório com a sessão síncrona subjacente
+    mock_async_db = MagicMock(spec=AsyncSession)
+    mock_async_db.run_sync.side_effect = lambda funcao, *args, **kwargs: funcao(mock_db, *args, **kwargs)
+
+    app.dependency_overrides[get_db] = lambda: mock_async_db
+    try:
+        response = client.put("/v1/empresas/1", json={"nome": "Empresa Assincrona"})
+    finally:
+        app.dependency_overrides[get_db] = lambda: mock_db
+
+    assert response.status_code == 200
+    assert response.json()["nome"] == "Empresa Assincrona"
+    mock_async_db.run_sync.assert_awaited_once()
+
+
+# Testes para o cache de entidades
+def test_read_empresa_cache():
+    empresa = EmpresaRead(id=1, nome="Empresa Teste", cnpj="12345678901234", endereco="Rua Teste, 123", email="teste@empresa.com", telefone="11987654321")
+
+    mock_db.reset_mock()
+    mock_db.execute.return_value.mappings.return_value.first.return_value = empresa.model_dump()
+
+    with patch("cache.backend", MemoryCache(max_entries=10, ttl=60)):
+        # A segunda leitura vem do cache, sem consultar o banco
+        assert client.get("/v1/empresas/1").json()["nome"] == "Empresa Teste"
+        assert client.get("/v1/empresas/1").json()["nome"] == "Empresa Teste"
+        assert mock_db.execute.call_count == 1
+
+        # A atualização invalida a entrada
+        empresa.nome = "Empresa Atualizada"
+        mock_db.execute.return_value.mappings.return_value.one_or_none.return_value = empresa.model_dump()
+        mock_db.execute.return_value.mappings.return_value.first.return_value = empresa.model_dump()
+        response = client.put("/v1/empresas/1", json={"nome": "Empresa Atualizada"})
+        assert response.status_code == 200
+        assert client.get("/v1/empresas/1").json()["nome"] == "Empresa Atualizada"
+        assert mock_db.execute.call_count == 4
+
+        stats = client.get("/v1/cache/stats").json()
+
+    assert stats["backend"] == "memory"
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+# Testes para as métricas
+@contextmanager
+def _engine_temporaria(tmp_path):
+    # Engines preguiçosas em um SQLite temporário, no lugar das de DATABASE_URL
+    url = f"sqlite:///{tmp_path}/pool.db"
+    with patch("database.get_engine", database._Preguicosa(lambda: database._cria_engine(url))), \
+         patch("database.get_async_engine", database._Preguicosa(lambda: database._cria_async_engine(url))):
+        try:
+            yield
+        finally:
+            if database.get_async_engine.criada():
+                asyncio.run(database.get_async_engine().dispose())
+
+def test_server_timing_e_metrics(db_async, tmp_path):
+    mock_db.execute.return_value.mappings.return_value.first.return_value = OBRIGACAO_LINHA
+
+    response = client.get("/v1/obrigacaoAcessoria/1")
+
+    assert response.status_code == 200
+    assert "db;dur=" in response.headers["server-timing"]
+    assert "ser;dur=" in response.headers["server-timing"]
+
+    with _engine_temporaria(tmp_path):
+        # A coleta não cria a engine: o pool aparece zerado até a primeira sessão
+        response = client.get("/metrics")
+        assert database.engine_da_api(cria=False) is None
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/v1/obrigacaoAcessoria/{obrigacao_acessoria_id}",status="200"}' in response.text
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+    assert "\ndb_pool_size 0\n" in response.text
+
+
+# Testes para o pool de conexões
+def test_read_pool_stats(db_async, tmp_path):
+    with _engine_temporaria(tmp_path):
+        antes = client.get("/v1/pool/stats")
+        assert database.engine_da_api(cria=False) is None
+        # Um checkout na engine do modo: o /ready com o pool já aquecido
+        with patch("main._pool_aquecido", True):
+            assert client.get("/ready").status_code == 200
+        depois = client.get("/v1/pool/stats")
+
+    assert antes.status_code == 200 and depois.status_code == 200
+    assert antes.json()["threadpool_size"] > 0
+    assert {"checked_out", "overflow", "espera_total", "espera_max"} <= set(antes.json())
+    assert (antes.json()["pool_size"], antes.json()["checkouts"]) == (0, 0)
+    assert (depois.json()["pool_size"], depois.json()["checkouts"]) == (DB_POOL_SIZE, 1)
+
+def test_relatorio_obrigacoes():
+    relatorio = RelatorioObrigacoes(
+        total=3,
+        por_periodicidade={"Anual": 1, "Mensal": 2},
+        empresas=[ResumoEmpresaObrigacoes(empresa_id=1, total=3, por_periodicidade={"Anual": 1, "Mensal": 2})],
+    )
+    with patch("repositories.relatorio_obrigacoes", return_value=relatorio) as relatorio_obrigacoes:
+        response = client.get("/v1/relatorios/obrigacoes?cursor=0&limit=10")
+
+    assert response.status_code == 200
+    relatorio_obrigacoes.assert_called_once_with(mock_db, None, 0, 10)
+    assert response.json()["empresas"] == [{"empresa_id": 1, "total": 3, "por_periodicidade": {"Anual": 1, "Mensal": 2}}]
+
+def test_list_mudancas_long_poll():
+    mudanca = {"seq": 8, "entidade": "empresa", "entidade_id": 1, "operacao": "atualizada", "versao": 2, "criada_em": "2024-01-01T00:00:00"}
+    with patch("main.difusor.espera", return_value=[mudanca]) as espera:
+        response = client.get("/v1/changes?since=7&espera=10")
+
+    assert response.status_code == 200
+    espera.assert_awaited_once_with(7, 100, 10)
+    assert response.json() == {"itens": [mudanca], "proximo_cursor": 8}
+
+    # Sem mudanças no prazo, o cursor continua o mesmo
+    with patch("main.difusor.espera", return_value=[]):
+        assert client.get("/v1/changes?since=7&espera=0").json() == {"itens": [], "proximo_cursor": 7}
+
+def test_list_mudancas_sse():
+    mudanca = {"seq": 8, "entidade": "empresa", "entidade_id": 1, "operacao": "removida", "versao": None}
+
+    async def primeiros_eventos():
+        eventos = _eventos(7, 100)
+        try:
+            return [await eventos.__anext__(), await eventos.__anext__()]
+        finally:
+            await eventos.aclose()
+
+    with patch("main.difusor.espera", side_effect=[[], [mudanca]]) as espera:
+        eventos = asyncio.run(primeiros_eventos())
+
+    assert eventos[0] == b": keep-alive\n\n"
+    assert eventos[1] == b'id: 8\nevent: mudanca\ndata: {"seq":8,"entidade":"empresa","entidade_id":1,"operacao":"removida","versao":null}\n\n'
+    assert espera.await_args_list[1].args == (7, 100, SSE_KEEPALIVE)
+
+def test_create_obrigacao_acessoria_agrupada():
+    async def executa(obrigacoes):
+        return [
+            BulkItemResult(indice=indice, id=indice + 1) if obrigacao.empresa_id == 1 else BulkItemResult(indice=indice, erro="Empresa não encontrada")
+            for indice, obrigacao in enumerate(obrigacoes)
+        ]
+
+    with patch("main.agrupador_obrigacoes", Agrupador(executa, espera=0.001, lote_max=10)):
+        criada = client.post("/v1/obrigacaoAcessoria", json={"nome": "DCTF", "periodicidade": "Mensal", "empresa_id": 1})
+        invalida = client.post("/v1/obrigacaoAcessoria", json={"nome": "DCTF", "periodicidade": "Mensal", "empresa_id": 2})
+
+    assert criada.status_code == 201
+    assert criada.json() == {"nome": "DCTF", "periodicidade": "Mensal", "empresa_id": 1, "dia_vencimento": None, "mes_inicial": None, "id": 1, "periodicidade_meses": 1, "versao": 1}
+    assert invalida.status_code == 400
+    assert invalida.json() == {"detail": "Empresa não encontrada"}
+
+def test_get_db_le_das_replicas(db_async, tmp_path):
+    # Dois bancos locais fazem o papel de primário e réplica; a réplica
+    # ainda tem o nome antigo da empresa 1
+    primario = sessionmaker(bind=create_engine(f"sqlite:///{tmp_path}/primario.db"))
+    primario_async = async_sessionmaker(bind=create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/primario.db"), expire_on_commit=False)
+    replicas = Replicas([f"sqlite:///{tmp_path}/replica.db"])
+    for sessoes, nome in ((primario, "No primário"), (replicas.replicas[0].SessionLocal, "Na réplica")):
+        with sessoes() as db:
+            Base.metadata.create_all(bind=db.get_bind())
+            db.add(Empresa(nome=nome, cnpj="11111111000111", endereco="Rua", email="e@empresa.com", telefone="1"))
+            db.commit()
+
+    empresa = {"nome": "Nova", "cnpj": "22222222000122", "endereco": "Rua", "email": "n@empresa.com", "telefone": "1"}
+    del app.dependency_overrides[get_db]
+    try:
+        with patch("main.replicas", replicas), patch("main.SessionLocal", primario), patch("main.AsyncSessionLocal", primario_async), patch("cache.backend", MemoryCache(max_entries=10, ttl=60)) as backend:
+            # A leitura da réplica é atendida, mas não preenche o cache
+            assert client.get("/v1/empresas/1").json()["nome"] == "Na réplica"
+            assert len(backend) == 0
+
+            # O lookup em lote é uma leitura: vai para a réplica e não prende
+            # o cliente ao primário
+            lookup = client.post("/v1/empresas/lookup", json={"ids": [1]})
+            assert lookup.json()["itens"][0]["empresa"]["nome"] == "Na réplica"
+            assert COOKIE_PRIMARIO not in lookup.cookies
+
+            # Depois de uma escrita o cliente lê do primário durante a janela
+            criada = client.post("/v1/empresas", json=empresa)
+            assert COOKIE_PRIMARIO in criada.cookies
+            no_primario = client.get("/v1/empresas", params={"cnpj": empresa["cnpj"]}).json()["itens"]
+            assert [item["nome"] for item in no_primario] == ["Nova"]
+            assert client.get("/v1/empresas/1").json()["nome"] == "No primário"
+            assert len(backend) == 1
+
+            client.cookies.clear()
+            assert client.get("/v1/empresas", params={"cnpj": empresa["cnpj"]}).json()["itens"] == []
+    finally:
+        client.cookies.clear()
+        app.dependency_overrides[get_db] = lambda: mock_db
+
+def _aquece(db_async, **kwargs):
+    return patch("main.aquece_async", new_callable=AsyncMock, **kwargs) if db_async else patch("main.aquece", **kwargs)
+
+def test_ready_aquece_o_pool_na_primeira_chamada(db_async):
+    with patch("main._pool_aquecido", False), _aquece(db_async, side_effect=lambda conexoes: conexoes) as aquece:
+        primeira = client.get("/ready")
+        segunda = client.get("/ready")
+
+    assert primeira.status_code == 200 and segunda.status_code == 200
+    assert primeira.json()["conexoes"] == DB_POOL_SIZE
+    assert segunda.json()["conexoes"] == 1
+    assert [chamada.args for chamada in aquece.call_args_list] == [(DB_POOL_SIZE,), (1,)]
+
+def test_ready_sem_banco(db_async):
+    with patch("main._pool_aquecido", False), _aquece(db_async, side_effect=OperationalError("SELECT 1", {}, Exception("conexão recusada"))):
+        response = client.get("/ready")
+
+    assert response.status_code == 503
+    assert response.json() == {"status": "indisponivel", "detail": "conexão recusada"}
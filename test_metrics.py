@@ -0,0 +1,44 @@
+import logging
+from unittest.mock import patch
+from sqlalchemy import create_engine, text
+import metrics
+
+def test_histogram_exposicao():
+    histograma = metrics.Histogram("latencia_seconds", "Latência.", ("route",), buckets=(0.1, 1.0))
+
+    histograma.observe(0.05, "/v1/empresas")
+    histograma.observe(0.5, "/v1/empresas")
+    histograma.observe(5, "/v1/empresas")
+
+    linhas = histograma.exposicao()
+    assert 'latencia_seconds_bucket{route="/v1/empresas",le="0.1"} 1' in linhas
+    assert 'latencia_seconds_bucket{route="/v1/empresas",le="1.0"} 2' in linhas
+    assert 'latencia_seconds_bucket{route="/v1/empresas",le="+Inf"} 3' in linhas
+    assert 'latencia_seconds_count{route="/v1/empresas"} 3' in linhas
+
+def test_instrumenta_conta_instrucoes_da_requisicao():
+    engine = create_engine("sqlite://")
+    metrics.instrumenta(engine)
+
+    stats = metrics.RequestStats()
+    token = metrics._requisicao.set(stats)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("select 1"))
+            conn.execute(text("select 2"))
+    finally:
+        metrics._requisicao.reset(token)
+
+    assert stats.statements == 2
+    assert stats.db_time > 0
+    assert 'db;dur=' in stats.server_timing()
+
+def test_slow_query_log(caplog):
+    engine = create_engine("sqlite://")
+    metrics.instrumenta(engine)
+
+    with patch("metrics.SLOW_QUERY_MS", 0.000001), caplog.at_level(logging.WARNING, logger="metrics.slow_query"):
+        with engine.connect() as conn:
+            conn.execute(text("select 1"))
+
+    assert "select 1" in caplog.text
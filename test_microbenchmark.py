@@ -0,0 +1,18 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+import microbenchmark
+
+@pytest.fixture
+def db():
+    engine = microbenchmark.cria_engine()
+    sessao = sessionmaker(autoflush=False, bind=engine)()
+    yield sessao
+    sessao.close()
+    engine.dispose()
+
+@pytest.mark.parametrize("rota", list(microbenchmark.cenarios()))
+def test_caminhos_produzem_os_mesmos_bytes(db, rota):
+    microbenchmark.popula(db, 5)
+    antes, depois = microbenchmark.cenarios(limit=3)[rota]
+
+    assert antes(db) == depois(db)
@@ -0,0 +1,52 @@
+import asyncio
+from mudancas import Difusor
+
+# Outbox em memória no lugar do banco; conta as leituras
+class FakeOutbox:
+    def __init__(self):
+        self.linhas = []
+        self.leituras = 0
+
+    def grava(self, quantidade):
+        for _ in range(quantidade):
+            self.linhas.append({"seq": len(self.linhas) + 1, "entidade": "empresa", "entidade_id": 1, "operacao": "atualizada", "versao": 1})
+
+    async def le(self, since, limite):
+        self.leituras += 1
+        return [linha for linha in self.linhas if linha["seq"] > since][:limite]
+
+    async def ultimo(self):
+        return len(self.linhas)
+
+def test_assinantes_compartilham_o_leitor():
+    outbox = FakeOutbox()
+    outbox.grava(3)
+
+    async def cenario():
+        difusor = Difusor(outbox.le, outbox.ultimo, intervalo=0.01, ocioso=0)
+        assinantes = [asyncio.create_task(difusor.espera(3, 100, 5)) for _ in range(50)]
+        await asyncio.sleep(0.05)
+        outbox.grava(2)
+        resultados = await asyncio.gather(*assinantes)
+        await difusor.para()
+        return resultados
+
+    resultados = asyncio.run(cenario())
+    assert all([mudanca["seq"] for mudanca in itens] == [4, 5] for itens in resultados)
+    # Uma consulta por intervalo, não uma por assinante
+    assert outbox.leituras < 50
+
+def test_since_anterior_a_memoria_le_do_outbox():
+    outbox = FakeOutbox()
+    outbox.grava(5)
+
+    async def cenario():
+        difusor = Difusor(outbox.le, outbox.ultimo, intervalo=0.01, capacidade=2, ocioso=0)
+        antigas = await difusor.espera(1, 2, 1)
+        vazia = await difusor.espera(5, 100, 0.05)
+        await difusor.para()
+        return antigas, vazia
+
+    antigas, vazia = asyncio.run(cenario())
+    assert [mudanca["seq"] for mudanca in antigas] == [2, 3]
+    assert vazia == []
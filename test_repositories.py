@@ -0,0 +1,239 @@
+import pytest
+from unittest.mock import patch
+from datetime import date
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+import models, repositories, schemas
+from cache import MemoryCache
+
+def _popula(db, quantidade):
+    for i in range(quantidade):
+        empresa = models.Empresa(nome=f"Empresa {i}", cnpj=f"{i:014d}", endereco="Rua", email="e@empresa.com", telefone="1", nome_normalizado=f"empresa {i}", cnpj_digitos=f"{i:014d}")
+        empresa.obrigacoes = [models.ObrigacaoAcessoria(nome=f"Obrigacao {j}", periodicidade="Mensal") for j in range(3)]
+        db.add(empresa)
+    db.commit()
+    # As obrigações entram pelo ORM, sem passar pelo repositório
+    repositories.reconstroi_resumo_obrigacoes(db)
+    db.expunge_all()
+
+@pytest.mark.parametrize("quantidade", [2, 20])
+def test_list_empresas_include_obrigacoes_sem_n_mais_1(db, sql, quantidade):
+    _popula(db, quantidade)
+
+    def lista():
+        itens, _ = repositories.list_empresas(db, limit=100, include_obrigacoes=True)
+        assert [len(empresa.obrigacoes) for empresa in itens] == [3] * quantidade
+
+    # Uma consulta para as empresas e uma para as obrigações de todas elas
+    assert sql.conta(lista) == 2
+
+def test_stream_empresas_include_obrigacoes(db, sql):
+    _popula(db, 10)
+
+    def lista():
+        lotes = list(repositories.stream_empresas(db, yield_per=4, include_obrigacoes=True))
+        assert [len(lote) for lote in lotes] == [4, 4, 2]
+        assert all(len(empresa.obrigacoes) == 3 for lote in lotes for empresa in lote)
+
+    # Uma consulta para as empresas e uma para as obrigações de cada bloco
+    assert sql.conta(lista) == 1 + 3
+
+def test_get_empresa_com_obrigacoes(db):
+    _popula(db, 1)
+
+    empresa = repositories.get_empresa_com_obrigacoes(db, 1)
+
+    assert [o.nome for o in empresa.obrigacoes] == ["Obrigacao 0", "Obrigacao 1", "Obrigacao 2"]
+    assert repositories.get_empresa_com_obrigacoes(db, 2) is None
+
+def test_list_vencimentos(db):
+    db.add(models.Empresa(nome="Empresa", cnpj="1", endereco="Rua", email="e@empresa.com", telefone="1", obrigacoes=[
+        models.ObrigacaoAcessoria(nome="DCTF", periodicidade="Mensal", periodicidade_meses=1, dia_vencimento=31),
+        models.ObrigacaoAcessoria(nome="EFD", periodicidade="Trimestral", periodicidade_meses=3, dia_vencimento=15, mes_inicial=2),
+        models.ObrigacaoAcessoria(nome="DIRF", periodicidade="Anual", periodicidade_meses=12, dia_vencimento=28, mes_inicial=2),
+        models.ObrigacaoAcessoria(nome="Sem dia", periodicidade="Mensal", periodicidade_meses=1),
+        models.ObrigacaoAcessoria(nome="Eventual", periodicidade="Eventual", dia_vencimento=10),
+    ]))
+    db.commit()
+
+    itens, proximo_cursor = repositories.list_vencimentos(db, date(2024, 1, 20), date(2024, 5, 15), limit=4)
+
+    # O dia 31 é limitado ao último dia do mês
+    assert [(i.nome, i.vencimento) for i in itens] == [
+        ("DCTF", date(2024, 1, 31)),
+        ("EFD", date(2024, 2, 15)),
+        ("DIRF", date(2024, 2, 28)),
+        ("DCTF", date(2024, 2, 29)),
+    ]
+    assert proximo_cursor == "2024-02-29_1"
+
+    itens, proximo_cursor = repositories.list_vencimentos(db, date(2024, 1, 20), date(2024, 5, 15), cursor=proximo_cursor, limit=4)
+
+    assert [(i.nome, i.vencimento) for i in itens] == [
+        ("DCTF", date(2024, 3, 31)),
+        ("DCTF", date(2024, 4, 30)),
+        ("EFD", date(2024, 5, 15)),
+    ]
+    assert proximo_cursor is None
+
+def test_get_empresas(db, sql):
+    _popula(db, 5)
+
+    with patch("cache.backend", MemoryCache(max_entries=10, ttl=60)):
+        # Uma única consulta para todos os ids; a ordem e as repetições são mantidas
+        empresas = []
+        assert sql.conta(lambda: empresas.extend(repositories.get_empresas(db, [4, 99, 1, 4]))) == 1
+        assert [empresa and empresa.id for empresa in empresas] == [4, None, 1, 4]
+
+        # Os ids já lidos vêm do cache e só as faltas vão ao banco
+        assert sql.conta(lambda: repositories.get_empresas(db, [1, 4])) == 0
+        assert sql.conta(lambda: repositories.get_empresas(db, [1, 2])) == 1
+
+    por_cnpj = []
+    assert sql.conta(lambda: por_cnpj.extend(repositories.get_empresas_por_cnpj(db, ["00000000000003", "x"]))) == 1
+    assert [empresa and empresa.id for empresa in por_cnpj] == [4, None]
+
+def test_search_empresas(db):
+    _popula(db, 3)
+    repositories.create_empresa(db, schemas.Empresa(nome="Padaria São João", cnpj="12.345.678/0001-90", endereco="Rua", email="contato@padaria.com", telefone="1"))
+
+    assert [e.nome for e in repositories.search_empresas(db, "sao joao")] == ["Padaria São João"]
+    assert [e.nome for e in repositories.search_empresas(db, "12345")] == ["Padaria São João"]
+    assert [e.id for e in repositories.search_empresas(db, "empresa", limit=2)] == [1, 2]
+
+    # O índice em memória acompanha as escritas feitas pelos repositórios
+    repositories.update_empresa(db, schemas.EmpresaPatch(nome="Confeitaria Central"), 4)
+    assert repositories.search_empresas(db, "padaria") == []
+    assert [e.id for e in repositories.search_empresas(db, "confeitaria")] == [4]
+
+
+def test_update_empresa_versao(db):
+    _popula(db, 1)
+
+    empresa = repositories.update_empresa(db, schemas.EmpresaPatch(nome="Empresa A"), 1)
+    assert empresa.versao == 2
+    assert repositories.versao_empresa(db, 1) == 2
+    assert repositories.versao_empresa(db, 99) is None
+
+    # If-Match com uma versão antiga não altera a linha
+    with pytest.raises(repositories.VersaoDivergente) as exc:
+        repositories.update_empresa(db, schemas.EmpresaPatch(nome="Empresa B"), 1, [1])
+    assert exc.value.versao_atual == 2
+    with pytest.raises(repositories.VersaoDivergente):
+        repositories.update_empresa(db, schemas.EmpresaPatch(), 1, [1])
+    assert repositories.get_empresa(db, 1).nome == "Empresa A"
+
+    assert repositories.update_empresa(db, schemas.EmpresaPatch(nome="Empresa B"), 1, [2]).versao == 3
+    assert repositories.update_empresa(db, schemas.EmpresaPatch(nome="Empresa C"), 99, [1]) is None
+
+@pytest.mark.parametrize("com_cache", [False, True])
+def test_delete_empresas_em_cascata(db, sql, com_cache):
+    _popula(db, 3)
+    backend = MemoryCache(max_entries=100, ttl=60) if com_cache else repositories.cache.NullCache()
+
+    with patch("cache.backend", backend):
+        assert repositories.get_obrigacao_acessoria(db, 1).nome == "Obrigacao 0"
+
+        # Sem cache basta travar as empresas, tirar o resumo delas dos totais,
+        # apagá-las e registrar a remoção no outbox (no Postgres, depois do
+        # advisory lock); as obrigações saem pelo ON DELETE CASCADE
+        removidos = []
+        instrucoes = sql.conta(lambda: removidos.extend(repositories.delete_empresas(db, [1, 3, 99])))
+        assert instrucoes == (6 if com_cache else 5) + (db.get_bind().dialect.name == "postgresql")
+        assert sorted(removidos) == [1, 3]
+
+        assert db.scalars(select(models.ObrigacaoAcessoria.empresa_id)).all() == [2, 2, 2]
+        assert repositories.get_obrigacao_acessoria(db, 1) is None
+        assert repositories.search_empresas(db, "00000000000000") == []
+        assert repositories.relatorio_obrigacoes(db).por_periodicidade == {"Mensal": 3}
+
+def test_delete_obrigacoes_acessorias(db):
+    _popula(db, 2)
+
+    assert sorted(repositories.delete_obrigacoes_acessorias(db, [1, 5, 99])) == [1, 5]
+    assert repositories.delete_obrigacao_acessoria(db, 1) is False
+    assert db.scalar(select(func.count()).select_from(models.ObrigacaoAcessoria)) == 4
+
+def _contagens(db):
+    relatorio = repositories.relatorio_obrigacoes(db)
+    return relatorio.por_periodicidade, {empresa.empresa_id: empresa.por_periodicidade for empresa in relatorio.empresas}
+
+def test_resumo_obrigacoes_acompanha_as_escritas(db):
+    _popula(db, 2)
+    assert _contagens(db) == ({"Mensal": 6}, {1: {"Mensal": 3}, 2: {"Mensal": 3}})
+
+    repositories.create_obrigacao_acessoria(db, schemas.ObrigacaoAcessoria(nome="DCTF", periodicidade="Anual", empresa_id=1))
+    resultados = repositories.bulk_create_obrigacoes_acessorias(db, [
+        schemas.ObrigacaoAcessoria(nome="EFD", periodicidade="Anual", empresa_id=2),
+        schemas.ObrigacaoAcessoria(nome="ECD", periodicidade="Anual", empresa_id=99),
+    ])
+    assert [resultado.erro is None for resultado in resultados] == [True, False]
+    assert _contagens(db) == ({"Anual": 2, "Mensal": 6}, {1: {"Anual": 1, "Mensal": 3}, 2: {"Anual": 1, "Mensal": 3}})
+
+    # A troca de periodicidade move a obrigação no resumo
+    repositories.update_obrigacao_acessoria(db, schemas.ObrigacaoAcessoriaPatch(periodicidade="Trimestral"), 1)
+    repositories.update_obrigacao_acessoria(db, schemas.ObrigacaoAcessoriaPatch(nome="DCTFWeb"), 2)
+    assert _contagens(db) == (
+        {"Anual": 2, "Mensal": 5, "Trimestral": 1},
+        {1: {"Anual": 1, "Mensal": 2, "Trimestral": 1}, 2: {"Anual": 1, "Mensal": 3}},
+    )
+
+    repositories.delete_obrigacoes_acessorias(db, [1, 3])
+    repositories.delete_empresas(db, [2])
+    assert _contagens(db) == ({"Anual": 1, "Mensal": 1}, {1: {"Anual": 1, "Mensal": 1}})
+
+    # Com o resumo divergente, a reconstrução volta às contagens reais
+    db.execute(models.TotalObrigacoes.__table__.update().values(quantidade=42))
+    db.commit()
+    assert repositories.reconstroi_resumo_obrigacoes(db) == 2
+    assert _contagens(db) == ({"Anual": 1, "Mensal": 1}, {1: {"Anual": 1, "Mensal": 1}})
+
+@pytest.mark.parametrize("quantidade", [3, 30])
+def test_relatorio_obrigacoes_sem_percorrer_as_obrigacoes(db, sql, quantidade):
+    _popula(db, quantidade)
+
+    paginas = []
+    instrucoes = sql.conta(lambda: paginas.append(repositories.relatorio_obrigacoes(db, limit=2)))
+    # Totais, ids da página e o resumo das empresas da página
+    assert instrucoes == 3
+    assert paginas[0].total == 3 * quantidade
+    assert [empresa.empresa_id for empresa in paginas[0].empresas] == [1, 2]
+    assert paginas[0].proximo_cursor == 2
+
+    ultima = repositories.relatorio_obrigacoes(db, cursor=quantidade - 1, limit=2)
+    assert [empresa.empresa_id for empresa in ultima.empresas] == [quantidade]
+    assert ultima.proximo_cursor is None
+    assert repositories.relatorio_obrigacoes(db, empresa_id=2).empresas[0].total == 3
+
+def test_escritas_gravam_no_outbox(db):
+    empresa = repositories.create_empresa(db, schemas.Empresa(nome="Empresa A", cnpj="1", endereco="Rua", email="a@empresa.com", telefone="1"))
+    repositories.bulk_create_empresas(db, [
+        schemas.Empresa(nome="Empresa B", cnpj="2", endereco="Rua", email="b@empresa.com", telefone="1"),
+        schemas.Empresa(nome="Empresa C", cnpj="1", endereco="Rua", email="c@empresa.com", telefone="1"),
+    ])
+    repositories.update_empresa(db, schemas.EmpresaPatch(nome="Empresa A2"), empresa.id)
+    obrigacao = repositories.create_obrigacao_acessoria(db, schemas.ObrigacaoAcessoria(nome="DCTF", periodicidade="Mensal", empresa_id=empresa.id))
+    repositories.bulk_create_obrigacoes_acessorias(db, [schemas.ObrigacaoAcessoria(nome="EFD", periodicidade="Anual", empresa_id=2)])
+    repositories.update_obrigacao_acessoria(db, schemas.ObrigacaoAcessoriaPatch(periodicidade="Anual"), obrigacao.id)
+    repositories.delete_obrigacoes_acessorias(db, [obrigacao.id, 99])
+    repositories.delete_empresas(db, [2])
+
+    mudancas = repositories.list_mudancas(db)
+    assert [(m["seq"], m["entidade"], m["entidade_id"], m["operacao"], m["versao"]) for m in mudancas] == [
+        (1, "empresa", 1, "criada", 1),
+        (2, "empresa", 2, "criada", 1),
+        (3, "empresa", 1, "atualizada", 2),
+        (4, "obrigacao_acessoria", 1, "criada", 1),
+        (5, "obrigacao_acessoria", 2, "criada", 1),
+        (6, "obrigacao_acessoria", 1, "atualizada", 2),
+        (7, "obrigacao_acessoria", 1, "removida", None),
+        (8, "empresa", 2, "removida", None),
+    ]
+    assert repositories.ultima_mudanca(db) == 8
+    assert [m["seq"] for m in repositories.list_mudancas(db, since=6, limit=1)] == [7]
+
+    # Uma escrita desfeita não deixa mudança no outbox
+    with pytest.raises(IntegrityError):
+        repositories.create_obrigacao_acessoria(db, schemas.ObrigacaoAcessoria(nome="ECD", periodicidade="Anual", empresa_id=99))
+    db.rollback()
+    assert repositories.ultima_mudanca(db) == 8
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+import pytest
+import run
+
+# O tempo da partida depende da máquina e da carga dela: a comparação com
+# PARTIDA_ORCAMENTO_MS só roda quando pedida
+TEST_PARTIDA_ORCAMENTO = os.getenv("TEST_PARTIDA_ORCAMENTO", "false").lower() in ("1", "true", "yes")
+
+def test_importar_a_aplicacao_nao_conecta():
+    # Banco inacessível: a importação não falha nem cria a engine
+    codigo = "import database, main; assert not database.get_engine.criada()"
+    ambiente = {**os.environ, "DATABASE_URL": "postgresql+psycopg2://u:p@127.0.0.1:9/inexistente"}
+    subprocess.run([sys.executable, "-c", codigo], env=ambiente, check=True, timeout=60)
+
+def test_partida_a_frio_fica_pronta(tmp_path, monkeypatch):
+    # mede_partida falha se o worker não responder ao /ready
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/partida.db")
+    tempos = run.mede_partida(1)
+
+    assert len(tempos) == 1
+
+@pytest.mark.skipif(not TEST_PARTIDA_ORCAMENTO, reason="defina TEST_PARTIDA_ORCAMENTO=true para medir a partida")
+def test_partida_a_frio_dentro_do_orcamento(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/partida.db")
+    tempos = run.mede_partida(1)
+
+    assert tempos[0] <= run.PARTIDA_ORCAMENTO_MS
@@ -0,0 +1,19 @@
+import pytest
+from datetime import date
+import vencimentos
+
+def test_periodicidade_meses():
+    assert vencimentos.periodicidade_meses("Mensal") == 1
+    assert vencimentos.periodicidade_meses(" TRIMESTRAL ") == 3
+    assert vencimentos.periodicidade_meses("anual") == 12
+    assert vencimentos.periodicidade_meses("Eventual") is None
+    assert vencimentos.periodicidade_meses(None) is None
+
+def test_cursor():
+    cursor = vencimentos.formata_cursor(date(2024, 2, 29), 42)
+
+    assert cursor == "2024-02-29_42"
+    assert vencimentos.le_cursor(cursor) == (vencimentos.indice_mes(2024, 2), 29, 42)
+    assert vencimentos.data_vencimento(vencimentos.indice_mes(2024, 2), 29) == date(2024, 2, 29)
+    with pytest.raises(ValueError):
+        vencimentos.le_cursor("ontem")
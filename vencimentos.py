@@ -0,0 +1,69 @@
+import calendar
+import unicodedata
+from datetime import date
+from typing import Optional
+from sqlalchemy import literal, select, union_all
+
+
+# Intervalo em meses entre duas ocorrências de cada periodicidade. O texto
+# livre de ObrigacaoAcessoria.periodicidade é normalizado para esse número
+# na gravação, e as ocorrências são calculadas a partir dele no banco
+PERIODICIDADES = {
+    "mensal": 1,
+    "bimestral": 2,
+    "trimestral": 3,
+    "quadrimestral": 4,
+    "semestral": 6,
+    "anual": 12,
+}
+
+# Tamanho máximo da janela de uma consulta de vencimentos
+JANELA_MAXIMA_DIAS = 366
+
+
+def periodicidade_meses(periodicidade: Optional[str]):
+    """Converte o texto da periodicidade ("Mensal", "TRIMESTRAL", "anual"...)
+    no intervalo em meses. Periodicidades não reconhecidas devolvem None e
+    ficam fora do calendário."""
+    if periodicidade is None:
+        return None
+    texto = unicodedata.normalize("NFKD", periodicidade.strip().lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return PERIODICIDADES.get(texto)
+
+
+def indice_mes(ano: int, mes: int):
+    return ano * 12 + mes - 1
+
+
+def data_vencimento(indice: int, dia: int):
+    return date(indice // 12, indice % 12 + 1, dia)
+
+
+def meses(de: date, ate: date):
+    """Subconsulta com uma linha por mês da janela [de, ate]: índice do mês,
+    último dia e o intervalo de dias que cai dentro da janela (só o primeiro
+    e o último mês são parciais)."""
+    linhas = []
+    for indice in range(indice_mes(de.year, de.month), indice_mes(ate.year, ate.month) + 1):
+        ano, mes = indice // 12, indice % 12 + 1
+        ultimo_dia = calendar.monthrange(ano, mes)[1]
+        linhas.append(select(
+            literal(indice).label("indice"),
+            literal(ultimo_dia).label("ultimo_dia"),
+            literal(de.day if (ano, mes) == (de.year, de.month) else 1).label("dia_min"),
+            literal(ate.day if (ano, mes) == (ate.year, ate.month) else ultimo_dia).label("dia_max"),
+        ))
+    return union_all(*linhas).subquery("meses")
+
+
+def formata_cursor(vencimento: date, obrigacao_acessoria_id: int):
+    return f"{vencimento.isoformat()}_{obrigacao_acessoria_id}"
+
+
+def le_cursor(cursor: str):
+    """Devolve (indice_mes, dia, obrigacao_acessoria_id) do cursor de
+    paginação; ValueError se o cursor for inválido."""
+    vencimento, _, id = cursor.partition("_")
+    vencimento = date.fromisoformat(vencimento)
+    return indice_mes(vencimento.year, vencimento.month), vencimento.day, int(id)
\ No newline at end of file
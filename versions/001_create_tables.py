@@ -3,6 +3,9 @@ import sqlalchemy as sa
 from sqlalchemy import Column, Integer, String, ForeignKey
 from sqlalchemy.orm import relationship
 
+revision = '001'
+down_revision = None
+
 
 def upgrade():
     op.create_table(
@@ -0,0 +1,29 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = '002'
+down_revision = '001'
+
+
+def upgrade():
+    op.add_column('obrigacoes_acessorias', sa.Column('periodicidade_meses', sa.Integer))
+    op.add_column('obrigacoes_acessorias', sa.Column('dia_vencimento', sa.Integer))
+    op.add_column('obrigacoes_acessorias', sa.Column('mes_inicial', sa.Integer))
+
+    # Normaliza as periodicidades já cadastradas (mesmo mapeamento de
+    # vencimentos.PERIODICIDADES); textos não reconhecidos ficam nulos
+    op.execute("""
+        UPDATE obrigacoes_acessorias SET periodicidade_meses = CASE lower(trim(periodicidade))
+            WHEN 'mensal' THEN 1
+            WHEN 'bimestral' THEN 2
+            WHEN 'trimestral' THEN 3
+            WHEN 'quadrimestral' THEN 4
+            WHEN 'semestral' THEN 6
+            WHEN 'anual' THEN 12
+        END
+    """)
+
+def downgrade():
+    op.drop_column('obrigacoes_acessorias', 'mes_inicial')
+    op.drop_column('obrigacoes_acessorias', 'dia_vencimento')
+    op.drop_column('obrigacoes_acessorias', 'periodicidade_meses')
\ No newline at end of file
@@ -0,0 +1,43 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = '003'
+down_revision = '002'
+
+
+def upgrade():
+    op.add_column('empresas', sa.Column('nome_normalizado', sa.String))
+    op.add_column('empresas', sa.Column('cnpj_digitos', sa.String))
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+        # Mesma normalização de busca.normaliza_nome e busca.digitos
+        op.execute("""
+            UPDATE empresas SET
+                nome_normalizado = regexp_replace(lower(unaccent(trim(nome))), '\\s+', ' ', 'g'),
+                cnpj_digitos = regexp_replace(cnpj, '\\D', '', 'g')
+        """)
+        # Trigramas para nome (similaridade e LIKE '%termo%') e
+        # text_pattern_ops para as buscas por prefixo de CNPJ e e-mail
+        op.execute("CREATE INDEX ix_empresas_nome_normalizado_trgm ON empresas USING gin (nome_normalizado gin_trgm_ops)")
+        op.execute("CREATE INDEX ix_empresas_cnpj_digitos ON empresas (cnpj_digitos text_pattern_ops)")
+        op.execute("CREATE INDEX ix_empresas_email_lower ON empresas (lower(email) text_pattern_ops)")
+    else:
+        import busca
+
+        conexao = op.get_bind()
+        empresas = sa.table('empresas', sa.column('id'), sa.column('nome'), sa.column('cnpj'), sa.column('nome_normalizado'), sa.column('cnpj_digitos'))
+        for id, nome, cnpj in conexao.execute(sa.select(empresas.c.id, empresas.c.nome, empresas.c.cnpj)).all():
+            conexao.execute(
+                empresas.update().where(empresas.c.id == id).values(nome_normalizado=busca.normaliza_nome(nome), cnpj_digitos=busca.digitos(cnpj))
+            )
+        op.create_index('ix_empresas_cnpj_digitos', 'empresas', ['cnpj_digitos'])
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX ix_empresas_email_lower")
+        op.execute("DROP INDEX ix_empresas_nome_normalizado_trgm")
+    op.drop_index('ix_empresas_cnpj_digitos', 'empresas')
+    op.drop_column('empresas', 'cnpj_digitos')
+    op.drop_column('empresas', 'nome_normalizado')
\ No newline at end of file
@@ -0,0 +1,15 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = '004'
+down_revision = '003'
+
+
+def upgrade():
+    # server_default preenche as linhas existentes com a versão 1
+    op.add_column('empresas', sa.Column('versao', sa.Integer, nullable=False, server_default='1'))
+    op.add_column('obrigacoes_acessorias', sa.Column('versao', sa.Integer, nullable=False, server_default='1'))
+
+def downgrade():
+    op.drop_column('obrigacoes_acessorias', 'versao')
+    op.drop_column('empresas', 'versao')
\ No newline at end of file
@@ -0,0 +1,42 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = '005'
+down_revision = '004'
+
+
+def _recria_foreign_key(ondelete):
+    if op.get_bind().dialect.name == 'postgresql':
+        # NOT VALID + VALIDATE: o ADD CONSTRAINT trava a tabela só pelo tempo
+        # de registrar a constraint, sem ler as linhas. O VALIDATE roda depois
+        # do commit, em transação própria, com um lock que não bloqueia as
+        # escritas enquanto as linhas existentes são conferidas
+        op.drop_constraint('obrigacoes_acessorias_empresa_id_fkey', 'obrigacoes_acessorias', type_='foreignkey')
+        op.execute(
+            "ALTER TABLE obrigacoes_acessorias ADD CONSTRAINT obrigacoes_acessorias_empresa_id_fkey "
+            f"FOREIGN KEY (empresa_id) REFERENCES empresas (id){' ON DELETE ' + ondelete if ondelete else ''} NOT VALID"
+        )
+        with op.get_context().autocommit_block():
+            op.execute("ALTER TABLE obrigacoes_acessorias VALIDATE CONSTRAINT obrigacoes_acessorias_empresa_id_fkey")
+    else:
+        # Sem ALTER de constraints (SQLite): a tabela é recriada; a convenção
+        # de nomes dá um nome à foreign key criada sem nome pela migração 001
+        convencao = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+        with op.batch_alter_table('obrigacoes_acessorias', naming_convention=convencao, recreate='always') as batch:
+            batch.drop_constraint('fk_obrigacoes_acessorias_empresa_id_empresas', type_='foreignkey')
+            batch.create_foreign_key('fk_obrigacoes_acessorias_empresa_id_empresas', 'empresas', ['empresa_id'], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _recria_foreign_key('CASCADE')
+
+    # O DELETE em cascata e as listagens por empresa_id passam a usar o índice
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_obrigacoes_acessorias_empresa_id ON obrigacoes_acessorias (empresa_id)")
+    else:
+        op.create_index('ix_obrigacoes_acessorias_empresa_id', 'obrigacoes_acessorias', ['empresa_id'])
+
+def downgrade():
+    op.drop_index('ix_obrigacoes_acessorias_empresa_id', 'obrigacoes_acessorias')
+    _recria_foreign_key(None)
\ No newline at end of file
@@ -0,0 +1,41 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = '006'
+down_revision = '005'
+
+
+def upgrade():
+    import relatorios
+
+    op.create_table(
+        'resumo_obrigacoes',
+        sa.Column('empresa_id', sa.Integer, sa.ForeignKey('empresas.id', ondelete='CASCADE'), primary_key=True, autoincrement=False),
+        sa.Column('periodicidade', sa.String, primary_key=True),
+        sa.Column('quantidade', sa.Integer, nullable=False, server_default='0'),
+    )
+    op.create_table(
+        'totais_obrigacoes',
+        sa.Column('fatia', sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column('periodicidade', sa.String, primary_key=True),
+        sa.Column('quantidade', sa.Integer, nullable=False, server_default='0'),
+    )
+
+    # Carga inicial com a mesma contagem de repositories.reconstroi_resumo_obrigacoes
+    op.execute("""
+        INSERT INTO resumo_obrigacoes (empresa_id, periodicidade, quantidade)
+        SELECT empresa_id, coalesce(periodicidade, ''), count(*)
+        FROM obrigacoes_acessorias
+        WHERE empresa_id IS NOT NULL
+        GROUP BY empresa_id, coalesce(periodicidade, '')
+    """)
+    op.execute(f"""
+        INSERT INTO totais_obrigacoes (fatia, periodicidade, quantidade)
+        SELECT empresa_id % {relatorios.FATIAS_TOTAIS}, periodicidade, sum(quantidade)
+        FROM resumo_obrigacoes
+        GROUP BY empresa_id % {relatorios.FATIAS_TOTAIS}, periodicidade
+    """)
+
+def downgrade():
+    op.drop_table('totais_obrigacoes')
+    op.drop_table('resumo_obrigacoes')
\ No newline at end of file
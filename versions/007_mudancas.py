@@ -0,0 +1,22 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = '007'
+down_revision = '006'
+
+
+def upgrade():
+    # Outbox do feed de mudanças; sem carga inicial, o feed começa vazio
+    op.create_table(
+        'mudancas',
+        sa.Column('seq', sa.BigInteger().with_variant(sa.Integer, 'sqlite'), primary_key=True),
+        sa.Column('entidade', sa.String, nullable=False),
+        sa.Column('entidade_id', sa.Integer, nullable=False),
+        sa.Column('operacao', sa.String, nullable=False),
+        sa.Column('versao', sa.Integer),
+        sa.Column('criada_em', sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sqlite_autoincrement=True,
+    )
+
+def downgrade():
+    op.drop_table('mudancas')
\ No newline at end of file